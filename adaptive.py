@@ -0,0 +1,131 @@
+import time
+
+from termcolor import colored
+
+from engine import run, run_many
+from stats import DONE_REGEX
+
+# In this file: adaptive timing - tuning rate and parallelism between waves of shards from nmap's stats
+
+# nmap packets per second: where the first wave starts and the limits it moves within
+START_RATE = 300
+MIN_RATE = 50
+MAX_RATE = 10000
+
+# More than this share of hosts timing out means the network (or the targets) cannot keep up
+TIMEOUT_SHARE = 0.05
+
+# Shards per worker when the shard count is left at 0, so there are waves to tune between
+WAVES = 4
+
+def user_max_rate(args_list):
+    # The --max-rate the user gave, None without one
+    for i, arg in enumerate(args_list):
+        value = arg.partition("=")[2] if arg.startswith("--max-rate=") else (
+            args_list[i + 1] if arg == "--max-rate" and i + 1 < len(args_list) else None)
+        if value is not None:
+            try:
+                return max(1, int(float(value)))
+            except ValueError:
+                return None
+    return None
+
+class AdaptiveTiming:
+    """
+    Rate and parallelism for the next wave of shards. Both go up while the
+    throughput holds and nothing times out, and back off on host timeouts or
+    nmap's dropped probe and retransmission warnings: multiplicative changes
+    to the rate, one shard at a time for the parallelism. Only nmap's
+    --min-rate is set, a --max-rate of the user stays the ceiling.
+    """
+    def __init__(self, max_parallel, rate=START_RATE):
+        self.rate = rate
+        self.ceiling = MAX_RATE
+        self.max_parallel = max(1, max_parallel)
+        self.parallel = max(1, self.max_parallel // 2)
+        self.best_throughput = 0.0
+
+    def apply(self, args_list):
+        # The job's arguments with our --min-rate instead of the user's, kept under their --max-rate
+        ceiling = user_max_rate(args_list)
+        if ceiling:
+            self.ceiling = min(MAX_RATE, ceiling)
+            self.rate = min(self.rate, self.ceiling)
+        args, skip = [], False
+        for arg in args_list:
+            if skip:
+                skip = False
+            elif arg == "--min-rate":
+                skip = True
+            elif not arg.startswith("--min-rate="):
+                args.append(arg)
+        return args + ["--min-rate", str(self.rate)]
+
+    def observe(self, hosts, stats, seconds):
+        """
+        Adjust after a wave that finished `hosts` hosts in `seconds`. stats
+        holds the last ScanStats of each shard. Returns what changed.
+        """
+        timed_out = sum(shard.hosts_timed_out for shard in stats)
+        congestion = sum(shard.congestion for shard in stats)
+        throughput = hosts / seconds if seconds > 0 else 0.0
+        if timed_out > max(1, hosts) * TIMEOUT_SHARE or congestion:
+            self.rate = max(MIN_RATE, self.rate // 2)
+            self.parallel = max(1, self.parallel - 1)
+            verdict = "backing off"
+        elif not hosts:
+            # No finished hosts seen at all says nothing about the network, only a slower wave would
+            verdict = "holding, no finished hosts seen"
+        elif throughput >= self.best_throughput * 0.9:
+            self.rate = min(self.ceiling, self.rate * 3 // 2)
+            self.parallel = min(self.max_parallel, self.parallel + 1)
+            verdict = "speeding up"
+        else:
+            verdict = "holding"
+        self.best_throughput = max(self.best_throughput, throughput)
+        return (f"{hosts} hosts in {seconds:.0f}s ({throughput:.1f}/s), {timed_out} timed out, "
+                f"{congestion} congestion warnings: {verdict}, next wave {self.parallel} shards at {self.rate} packets/s")
+
+def run_waves(jobs, timing, on_event=None, cancel=None, quiet=False):
+    """
+    Like run_many, but the jobs run in waves of timing.parallel and the
+    timing is tuned between waves. Returns a list of (return code,
+    ScanOutput) in the order of `jobs`, without the waves that had not
+    started when the cancel flag was set.
+    """
+    results = []
+    start = 0
+    while start < len(jobs):
+        wave = jobs[start:start + timing.parallel]
+        offset = start
+        last_stats = {}
+        # Finished hosts per shard: XML host events, unless the user's own -oX took the XML,
+        # so also nmap's stats and its final "Nmap done: N IP addresses" line
+        host_events = {}
+        done_lines = {}
+
+        def on_wave_event(index, kind, value):
+            if kind == "stats":
+                last_stats[index] = value
+            elif kind == "host":
+                host_events[index] = host_events.get(index, 0) + 1
+            elif kind == "line":
+                match = DONE_REGEX.match(value)
+                if match:
+                    done_lines[index] = int(match.group(1))
+            if on_event:
+                on_event(offset + index, kind, value)
+
+        started = time.time()
+        results.extend(run(run_many([timing.apply(args) for args in wave], len(wave), on_wave_event, cancel)))
+        start += len(wave)
+        if cancel is not None and cancel.is_set():
+            # The waves not started yet have no output to keep
+            break
+        if start < len(jobs):
+            hosts = sum(max(host_events.get(index, 0), done_lines.get(index, 0),
+                            last_stats[index].hosts_completed if index in last_stats else 0) for index in range(len(wave)))
+            change = timing.observe(hosts, list(last_stats.values()), time.time() - started)
+            if not quiet:
+                print(colored(f"Adaptive timing: {change}", "cyan"))
+    return results
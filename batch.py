@@ -0,0 +1,133 @@
+import json
+import time
+
+from termcolor import colored
+
+from getters import parse_port, merge_script_args
+from printers import generate_report, print_batch_summary
+from rules import load_matcher
+from targets import check_targets
+from outputs import check_output
+from engine import ScanControl
+from budget import stop_on_interrupt
+
+# In this file: the headless batch runner for JSON job manifests
+
+DEFAULT_WORKERS = 2
+
+# Job exit codes in the summary
+JOB_OK = 0
+JOB_FAILED = 1
+JOB_INVALID = 2
+
+def load_manifest(manifest_file):
+    """
+    A manifest is either a list of jobs or {"workers": N, "jobs": [...]}.
+    Each job has "targets" (target expressions or a target file) and either "script" (one
+    name or several comma separated, run by one nmap, with optional "ports":
+    "", "all" or "21,80" and "script_args") or "speed_dial" (a saved entry
+    name), plus optional "name", "output" (-oN file, compressed if it ends in
+    .gz or .zst) and "report" (true/false).
+    """
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        return manifest, 0
+    return manifest.get("jobs", []), manifest.get("workers", 0)
+
+def check_job(job, config_data):
+    # Reason the job cannot run, or None
+    if not isinstance(job, dict):
+        return "job is not an object"
+    targets = job.get("targets", "")
+    error = check_targets(targets) if isinstance(targets, str) and targets else "no targets"
+    if error:
+        return f"invalid targets '{targets}': {error}"
+    if ("script" in job) == ("speed_dial" in job):
+        return "needs exactly one of 'script' or 'speed_dial'"
+    if "speed_dial" in job and job["speed_dial"] not in config_data.get("speed_dial", {}):
+        return f"no speed dial named '{job['speed_dial']}'"
+    if "script" in job and parse_port(str(job.get("ports", ""))) is None:
+        return f"invalid ports: '{job.get('ports')}'"
+    if job.get("output") and check_output(job["output"]):
+        return check_output(job["output"])
+    return None
+
+def job_name(job, index):
+    if isinstance(job, dict):
+        return job.get("name") or job.get("script") or job.get("speed_dial") or f"job {index+1}"
+    return f"job {index+1}"
+
+def run_job(index, job, config_data, run_script, run_scan, control=None):
+    name = job_name(job, index)
+    result = {"name": name, "retcode": JOB_INVALID, "seconds": 0.0, "output_file": "", "error": ""}
+    error = check_job(job, config_data)
+    if error:
+        result["error"] = error
+        return result
+    if control is not None and control.cancel.is_set():
+        # The batch was stopped before this job's turn came
+        result["retcode"] = JOB_FAILED
+        result["error"] = f"not started: {control.reason}"
+        return result
+
+    output_file = job.get("output", "")
+    result["output_file"] = output_file
+    started = time.time()
+    try:
+        if "script" in job:
+            output = run_script(job["script"], job["targets"], parse_port(str(job.get("ports", ""))), output_file, config_data, name,
+                                control=control, script_args=merge_script_args(job.get("script_args", "")))
+            description = job["script"]
+        else:
+            flags = config_data["speed_dial"][job["speed_dial"]]
+            output = run_scan(flags.split(), job["targets"], output_file, config_data, name, control)
+            description = flags
+
+        if output is None:
+            result["retcode"] = JOB_FAILED
+            result["error"] = "nmap failed"
+        else:
+            # A scan stopped part way fails the job, but what it found is still reported
+            result["retcode"] = JOB_FAILED if output.stopped else JOB_OK
+            result["error"] = f"stopped: {output.stopped}, output kept" if output.stopped else ""
+            if job.get("report"):
+                generate_report(output, description, job["targets"], output_file, "n", load_matcher(config_data))
+    except Exception as e:
+        # One broken job must not take the rest of the batch down
+        result["retcode"] = JOB_FAILED
+        result["error"] = str(e)
+    result["seconds"] = time.time() - started
+    return result
+
+def run_batch(manifest_file, config_data, run_script, run_scan, workers=0):
+    """
+    Run every job of a manifest on a pool of `workers` threads (from the
+    command line, else the manifest, else DEFAULT_WORKERS), print a summary
+    and return the process exit code: 0 if every job succeeded, 1 otherwise.
+    Ctrl-C (or a hang up) stops every running job through its ScanControl,
+    the jobs still waiting are not started.
+    """
+    try:
+        jobs, manifest_workers = load_manifest(manifest_file)
+    except (OSError, ValueError) as e:
+        print(colored(f"Could not read manifest {manifest_file}: {e}", "red"))
+        return 1
+    workers = workers or manifest_workers or DEFAULT_WORKERS
+    print(colored(f"Running {len(jobs)} jobs from {manifest_file} on {workers} workers", "cyan"))
+
+    # Imported here, one-shot --speed-dial runs use run_job without the pool
+    from concurrent.futures import ThreadPoolExecutor
+    started = time.time()
+    controls = [ScanControl() for _ in jobs]
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(run_job, i, job, config_data, run_script, run_scan, controls[i]) for i, job in enumerate(jobs)]
+        with stop_on_interrupt(controls):
+            results = [future.result() for future in futures]
+    finally:
+        # Interrupted twice: the running jobs are stopping already, the waiting ones are dropped
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    print_batch_summary(results, time.time() - started)
+    return 0 if all(result["retcode"] == JOB_OK for result in results) else 1
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import argparse
+import ipaddress
+import platform
+import tempfile
+import subprocess
+
+from run_bench import ROOT, LINES_PER_HOST, install_fake_nmap
+
+# In this file: a coordinator and several agents on localhost against the fake nmap, results as JSON
+#
+#   python3 bench/cluster_bench.py [--agents N] [--targets CIDR] [--output results.json]
+#
+# Checks that the merged output has every host once and none of the agents' stats lines,
+# that the shards of an agent killed part way are run by the others, that an agent with the
+# wrong cluster token is turned away and that agents refuse options that touch their files.
+# Exits with 1 when a check fails.
+
+TOKEN = "cluster-bench-token"
+
+# Seconds the fake nmap spends on each host, so the scan lasts long enough to kill an agent in it
+HOST_DELAY = 0.05
+
+# Seconds a whole run may take before it counts as hung
+RUN_TIMEOUT = 180
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def write_config(path, token, speed_dial):
+    with open(path, 'w') as f:
+        json.dump({"configuration": {"cluster_token": token, "shard_count": 32}, "speed_dial": speed_dial}, f)
+
+def start(work_dir, name, argv):
+    # mymap.py ARGS in the background, its output in NAME.log
+    log = open(os.path.join(work_dir, f"{name}.log"), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "mymap.py")] + argv, cwd=work_dir,
+                               stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return process
+
+def read_log(work_dir, name):
+    with open(os.path.join(work_dir, f"{name}.log"), 'r', errors="replace") as f:
+        return f.read()
+
+def stop(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+    for process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def wait_for(predicate, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.1)
+    return False
+
+def expected_hosts(cidr):
+    return [str(address) for address in ipaddress.ip_network(cidr)]
+
+def scan_run(work_dir, agents, cidr):
+    # A scan on `agents` agents, one of them killed once it is running shards, plus an agent with the wrong token
+    port = free_port()
+    address = f"127.0.0.1:{port}"
+    config = os.path.join(work_dir, "config.json")
+    write_config(config, TOKEN, {"bench": "-p 80"})
+    write_config(os.path.join(work_dir, "wrong.json"), "not-the-token", {})
+    processes = [start(work_dir, f"agent{i}", ["--config", config, "--agent", address, "--workers", "2"]) for i in range(agents)]
+    processes.append(start(work_dir, "intruder", ["--config", "wrong.json", "--agent", address]))
+    output = os.path.join(work_dir, "merged.txt")
+    started = time.perf_counter()
+    coordinator = start(work_dir, "coordinator", ["--config", config, "--coordinator", address, "--speed-dial", "bench",
+                                                  "--targets", cidr, "--output", output])
+    try:
+        victim = processes[0]
+        killed = wait_for(lambda: "Running task" in read_log(work_dir, "agent0"), 60)
+        if killed:
+            victim.kill()
+        coordinator.wait(timeout=RUN_TIMEOUT)
+        seconds = time.perf_counter() - started
+    finally:
+        stop(processes + [coordinator])
+
+    log = read_log(work_dir, "coordinator")
+    with open(output, 'r') as f:
+        lines = f.read().splitlines()
+    reported = [line.split()[-1] for line in lines if line.startswith("Nmap scan report for ")]
+    expected = expected_hosts(cidr)
+    checks = {"exit code 0": coordinator.returncode == 0,
+              "every host once": sorted(reported) == sorted(expected),
+              "no stats lines": not any(line.startswith("Stats: ") for line in lines),
+              "killed agent's shards reassigned": killed and "lost, reassigning" in log,
+              "wrong token refused": "wrong cluster token" in log and "Running task" not in read_log(work_dir, "intruder")}
+    return {"name": "scan", "agents": agents, "hosts": len(expected), "hosts_reported": len(reported),
+            "seconds": round(seconds, 2), "checks": checks}
+
+def refusal_run(work_dir, cidr):
+    # A scan whose options would make the agent read its own files, every shard has to be refused
+    port = free_port()
+    address = f"127.0.0.1:{port}"
+    config = os.path.join(work_dir, "refuse.json")
+    write_config(config, TOKEN, {"datadir": "-p 80 --datadir /etc", "output": "-p 80 -oN/tmp/owned",
+                                 "script": "-p 80 --script=/tmp/evil.nse", "args": "-p 80 --script-args userdb=/etc/shadow"})
+    with open(os.path.join(work_dir, "jobs.json"), 'w') as f:
+        json.dump([{"speed_dial": name, "targets": cidr} for name in ("datadir", "output", "script", "args")], f)
+    processes = [start(work_dir, "refusing-agent", ["--config", config, "--agent", address, "--workers", "2"])]
+    coordinator = start(work_dir, "refused-coordinator", ["--config", config, "--coordinator", address, "--batch", "jobs.json"])
+    try:
+        coordinator.wait(timeout=RUN_TIMEOUT)
+    finally:
+        stop(processes + [coordinator])
+    log = read_log(work_dir, "refusing-agent")
+    checks = {"batch failed": coordinator.returncode != 0,
+              "--datadir refused": "Refused task" in log and "--datadir" in log,
+              "-oN refused": "-oN/tmp/owned" in log and not os.path.exists("/tmp/owned"),
+              "--script path refused": "--script=/tmp/evil.nse" in log,
+              "--script-args file refused": "userdb=/etc/shadow" in log,
+              "nothing run": "Running task" not in log}
+    return {"name": "refused options", "checks": checks}
+
+def main():
+    parser = argparse.ArgumentParser(description="A coordinator and agents on localhost against the fake nmap")
+    parser.add_argument("--agents", type=int, default=3, help="agents with the right token (default 3)")
+    parser.add_argument("--targets", default="10.0.0.0/24", help="targets of the scan (default 10.0.0.0/24)")
+    parser.add_argument("--output", default="", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+    if args.agents < 2:
+        parser.error("--agents must be at least 2, one of them is killed")
+
+    work_dir = tempfile.mkdtemp(prefix="mymap-cluster-")
+    try:
+        install_fake_nmap(work_dir)
+        os.environ["FAKE_NMAP_LINES"] = str(LINES_PER_HOST)
+        os.environ["FAKE_NMAP_DELAY"] = str(HOST_DELAY)
+        os.environ["HOME"] = work_dir
+        results = [scan_run(work_dir, args.agents, args.targets), refusal_run(work_dir, args.targets)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "platform": platform.platform(), "results": results}
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    failed = [f"{result['name']}: {name}" for result in results for name, ok in result["checks"].items() if not ok]
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
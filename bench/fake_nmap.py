@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import ipaddress
+
+# In this file: a stand-in for nmap that prints synthetic scan output, for the benchmarks
+#
+# Settings come from the environment:
+#   FAKE_NMAP_HOSTS          hosts to report (default: one per target given)
+#   FAKE_NMAP_LINES          output lines per host (default 20)
+#   FAKE_NMAP_FINDING_EVERY  every Nth host gets findings the report rules match (default 10, 0 = none)
+#   FAKE_NMAP_STATS_EVERY    a --stats-every style progress block every N hosts (default 50)
+#   FAKE_NMAP_DELAY          seconds spent on each host (default 0), for scans that have to be stopped part way
+
+FINDINGS = ["| ftp-anon: Anonymous FTP login allowed (FTP code 230)",
+            "|   State: VULNERABLE",
+            "|_http-title: Site doesn't have a title (text/html)."]
+
+def option(args, name):
+    return args[args.index(name) + 1] if name in args and args.index(name) + 1 < len(args) else None
+
+def read_targets(args):
+    target_file = option(args, "-iL")
+    if target_file:
+        with open(target_file, 'r') as f:
+            expressions = f.read().split()
+    else:
+        expressions = [arg for arg in args if arg[:1].isdigit()]
+    # CIDR blocks (the coordinator's shards) are expanded like nmap does, other expressions are used as they are
+    targets = []
+    for expression in expressions:
+        if "/" in expression:
+            targets.extend(str(address) for address in ipaddress.ip_network(expression, strict=False))
+        else:
+            targets.append(expression)
+    return targets
+
+def host_block(address, lines, finding):
+    block = [f"Nmap scan report for {address}", "Host is up (0.00042s latency).",
+             "PORT     STATE SERVICE", "21/tcp   open  ftp", "80/tcp   open  http"]
+    if finding:
+        block.extend(FINDINGS)
+    while len(block) < lines - 1:
+        block.append(f"| banner: synthetic line {len(block)} for {address} lorem ipsum dolor sit amet")
+    block.append("")
+    return "\n".join(block) + "\n"
+
+def host_xml(address, finding):
+    script = '<script id="ftp-anon" output="Anonymous FTP login allowed (FTP code 230)"/>' if finding else ""
+    return (f'<host><status state="up"/><address addr="{address}" addrtype="ipv4"/><hostnames/><ports>'
+            f'<port protocol="tcp" portid="21"><state state="open"/><service name="ftp"/>{script}</port>'
+            f'<port protocol="tcp" portid="80"><state state="open"/><service name="http"/></port></ports></host>\n')
+
+def main():
+    args = sys.argv[1:]
+    targets = read_targets(args)
+    count = int(os.environ.get("FAKE_NMAP_HOSTS", 0)) or len(targets)
+    lines = int(os.environ.get("FAKE_NMAP_LINES", 20))
+    finding_every = int(os.environ.get("FAKE_NMAP_FINDING_EVERY", 10))
+    stats_every = int(os.environ.get("FAKE_NMAP_STATS_EVERY", 50))
+    delay = float(os.environ.get("FAKE_NMAP_DELAY", 0))
+
+    normal = open(option(args, "-oN"), 'w') if option(args, "-oN") else None
+    xml = open(option(args, "-oX"), 'w') if option(args, "-oX") else None
+    if xml:
+        xml.write('<?xml version="1.0"?>\n<nmaprun scanner="nmap">\n')
+
+    out = sys.stdout
+    out.write("Starting Nmap 7.94 ( https://nmap.org )\n")
+    for i in range(count):
+        address = targets[i] if i < len(targets) else f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+        if stats_every and i % stats_every == 0:
+            out.write(f"Stats: 0:00:{i % 60:02d} elapsed; {i} hosts completed ({i} up), 1 undergoing Script Scan\n")
+            out.write(f"NSE Timing: About {i * 100 / count:.2f}% done; ETC: 12:00 (0:00:10 remaining)\n")
+        finding = finding_every and i % finding_every == 0
+        block = host_block(address, lines, finding)
+        if delay:
+            time.sleep(delay)
+        out.write(block)
+        if delay:
+            out.flush()
+        if normal:
+            normal.write(block)
+        if xml:
+            xml.write(host_xml(address, finding))
+    out.write(f"Nmap done: {count} IP addresses ({count} hosts up) scanned in 1.00 seconds\n")
+    out.flush()
+    if xml:
+        xml.write('</nmaprun>\n')
+        xml.close()
+    if normal:
+        normal.close()
+
+if __name__ == "__main__":
+    main()
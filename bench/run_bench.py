@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import builtins
+import platform
+import tempfile
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import catalog
+from engine import ScanControl
+from getters import get_scripts
+from mymap import run_nmap_with_progress
+from printers import generate_report, view_output, print_script_description
+
+# In this file: offline benchmarks of the scan, report and catalog hot paths, results as JSON
+#
+#   python3 bench/run_bench.py [--quick] [--repeat N] [--output results.json]
+#
+# nmap is replaced by bench/fake_nmap.py and the scripts directory by a synthetic one,
+# so the numbers only measure mymap and can be compared between commits.
+
+FAKE_NMAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_nmap.py")
+LINES_PER_HOST = 20
+
+SIZES = {"full": {"scan_lines": [10000, 100000, 500000], "report_lines": [10000, 100000, 500000], "scripts": [1000, 5000]},
+         "quick": {"scan_lines": [10000, 50000], "report_lines": [10000, 50000], "scripts": [500]}}
+
+def best_of(repeat, function):
+    # Fastest of `repeat` runs, the least disturbed by whatever else the machine is doing
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+def install_fake_nmap(work_dir):
+    # An "nmap" first on the PATH that runs the stub with this interpreter
+    bin_dir = os.path.join(work_dir, "bin")
+    os.makedirs(bin_dir)
+    with open(os.path.join(bin_dir, "nmap"), 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_NMAP}" "$@"\n')
+    os.chmod(os.path.join(bin_dir, "nmap"), 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+def make_scripts_dir(path, count):
+    # count .nse files with a description and @args, plus a script.db with their categories
+    os.makedirs(path)
+    prefixes = ["ftp", "http", "smb", "ssh", "dns", "smtp", "mysql", "rdp", "snmp", "vnc", "misc"]
+    with open(os.path.join(path, "script.db"), 'w') as db:
+        for i in range(count):
+            name = f"{prefixes[i % len(prefixes)]}-bench-{i}.nse"
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(f'local nmap = require "nmap"\ndescription = [[\nSynthetic script {i} for the benchmarks.\n'
+                        + "Checks something about the service and reports it.\n" * 5 + ']]\n'
+                        + f"-- @args {name[:-4]}.timeout how long to wait\n-- @args {name[:-4]}.path what to ask for\n"
+                        + "action = function(host, port)\n  return nil\nend\n" + "-- filler\n" * 100)
+            db.write(f'Entry {{ filename = "{name}", categories = {{ "default", "safe", }} }}\n')
+
+def synthetic_output(lines):
+    # A ScanOutput like a script scan of lines/LINES_PER_HOST hosts, one in ten with findings
+    os.environ["FAKE_NMAP_HOSTS"] = str(lines // LINES_PER_HOST)
+    return run_nmap_with_progress(["10.0.0.1"], control=ScanControl(quiet=True))
+
+def bench_scan(sizes, repeat):
+    results = []
+    for lines in sizes:
+        os.environ["FAKE_NMAP_HOSTS"] = str(lines // LINES_PER_HOST)
+        seconds = best_of(repeat, lambda: run_nmap_with_progress(["10.0.0.1"], control=ScanControl(quiet=True)).close())
+        results.append({"name": "run_nmap_with_progress", "size": lines, "unit": "lines",
+                        "seconds": round(seconds, 4), "per_second": round(lines / seconds)})
+    return results
+
+def bench_output(sizes, repeat):
+    results = []
+    quiet = open(os.devnull, 'w')
+    # view_output pages every 20 lines, the benchmark presses Enter instantly
+    real_input = builtins.input
+    builtins.input = lambda *args: ""
+    try:
+        for lines in sizes:
+            output = synthetic_output(lines)
+            with contextlib.redirect_stdout(quiet):
+                report = best_of(repeat, lambda: generate_report(output, "bench", "10.0.0.0/16", "", "n"))
+                view = best_of(repeat, lambda: view_output(output))
+            output.close()
+            results.append({"name": "generate_report", "size": lines, "unit": "lines",
+                            "seconds": round(report, 4), "per_second": round(lines / report)})
+            results.append({"name": "view_output", "size": lines, "unit": "lines",
+                            "seconds": round(view, 4), "per_second": round(lines / view)})
+    finally:
+        builtins.input = real_input
+        quiet.close()
+    return results
+
+def bench_catalog(sizes, repeat, work_dir):
+    results = []
+    quiet = open(os.devnull, 'w')
+    try:
+        for count in sizes:
+            scripts_dir = os.path.join(work_dir, f"scripts-{count}")
+            cache_file = os.path.join(work_dir, f"catalog-{count}.json")
+            make_scripts_dir(scripts_dir, count)
+
+            names = sorted(name for name in os.listdir(scripts_dir) if name.endswith(".nse"))
+
+            def listing():
+                catalog._catalog = catalog.Catalog(scripts_dir, cache_file)
+                get_scripts()
+
+            # The menus only list the directory, the catalog cache is read (or built) once a
+            # description, the args or the categories of a script are needed
+            def cold():
+                if os.path.exists(cache_file):
+                    os.remove(cache_file)
+                catalog._catalog = catalog.Catalog(scripts_dir, cache_file)
+                catalog.get_catalog().load()
+                for name in names:
+                    catalog.get_catalog().entry(name)
+
+            def warm():
+                catalog._catalog = catalog.Catalog(scripts_dir, cache_file)
+                catalog.get_catalog().load()
+                for name in names:
+                    catalog.get_catalog().entry(name)
+
+            listing_seconds = best_of(repeat, listing)
+            cold_seconds = best_of(repeat, cold)
+            warm_seconds = best_of(repeat, warm)
+            names = names[:200]
+            with contextlib.redirect_stdout(quiet):
+                describe = best_of(repeat, lambda: [print_script_description(name) for name in names])
+            results.append({"name": "get_scripts (listing)", "size": count, "unit": "scripts",
+                            "seconds": round(listing_seconds, 4), "per_second": round(count / listing_seconds)})
+            results.append({"name": "catalog load + entry (cold cache)", "size": count, "unit": "scripts",
+                            "seconds": round(cold_seconds, 4), "per_second": round(count / cold_seconds)})
+            results.append({"name": "catalog load + entry (warm cache)", "size": count, "unit": "scripts",
+                            "seconds": round(warm_seconds, 4), "per_second": round(count / warm_seconds)})
+            results.append({"name": "print_script_description", "size": len(names), "unit": "scripts",
+                            "seconds": round(describe, 4), "per_second": round(len(names) / describe)})
+    finally:
+        catalog._catalog = None
+        quiet.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for mymap")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a fast check")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the fastest counts (default 3)")
+    parser.add_argument("--output", default="", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+    sizes = SIZES["quick" if args.quick else "full"]
+
+    work_dir = tempfile.mkdtemp(prefix="mymap-bench-")
+    try:
+        install_fake_nmap(work_dir)
+        os.environ["FAKE_NMAP_LINES"] = str(LINES_PER_HOST)
+        results = bench_scan(sizes["scan_lines"], args.repeat)
+        results += bench_output(sizes["report_lines"], args.repeat)
+        results += bench_catalog(sizes["scripts"], args.repeat, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "platform": platform.platform(), "quick": args.quick, "repeat": args.repeat, "results": results}
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+from run_bench import ROOT, LINES_PER_HOST, install_fake_nmap, make_scripts_dir
+
+# In this file: startup time of fresh mymap processes against a time budget, results as JSON
+#
+#   python3 bench/startup_bench.py [--repeat N] [--budget NAME=MS ...] [--output results.json]
+#
+# Every run is a new interpreter, as when mymap is started from a shell or a cron job, so
+# imports and first reads count. Exits with 1 when a case's median is over its budget.
+
+# Default budgets in milliseconds, generous against a quiet machine so only real regressions fail
+BUDGETS = {"import": 150, "menu": 250, "speed dial": 400}
+
+# Runs mymap.main as `mymap.py ARGS` would, with the catalog on the synthetic scripts directory
+PRELUDE = """
+import sys
+sys.path.insert(0, {root!r})
+import catalog
+catalog._catalog = catalog.Catalog({scripts_dir!r}, {catalog_file!r})
+import mymap
+sys.argv = ["mymap.py"] + {argv!r}
+{call}
+"""
+
+def case_code(work_dir, argv, call="mymap.main()"):
+    return PRELUDE.format(root=ROOT, scripts_dir=os.path.join(work_dir, "scripts"),
+                          catalog_file=os.path.join(work_dir, "catalog.json"), argv=argv, call=call)
+
+def cases(work_dir):
+    # name: (python code, stdin)
+    config = os.path.join(work_dir, "config.json")
+    output = os.path.join(work_dir, "speed-dial.txt")
+    return {"import": (case_code(work_dir, [], call=""), ""),
+            "menu": (case_code(work_dir, ["--config", config]), "q\n"),
+            "speed dial": (case_code(work_dir, ["--config", config, "--speed-dial", "web", "--targets", "10.0.0.1",
+                                                "--output", output]), "")}
+
+def time_run(code, stdin):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], input=stdin, text=True, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"exit code {result.returncode}: {result.stderr.strip()[-500:]}")
+    return seconds
+
+def parse_budgets(values):
+    budgets = dict(BUDGETS)
+    for value in values:
+        name, _, ms = value.rpartition("=")
+        if name not in budgets or not ms.isdigit():
+            raise argparse.ArgumentTypeError(f"bad --budget {value!r}, expected one of {', '.join(budgets)} =MS")
+        budgets[name] = int(ms)
+    return budgets
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of mymap against a budget")
+    parser.add_argument("--repeat", type=int, default=7, help="runs per case, the median counts (default 7)")
+    parser.add_argument("--budget", action="append", default=[], metavar="NAME=MS",
+                        help=f"budget of one case in milliseconds (defaults: {', '.join(f'{k}={v}' for k, v in BUDGETS.items())})")
+    parser.add_argument("--output", default="", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+    try:
+        budgets = parse_budgets(args.budget)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    work_dir = tempfile.mkdtemp(prefix="mymap-startup-")
+    results = []
+    try:
+        install_fake_nmap(work_dir)
+        os.environ["FAKE_NMAP_LINES"] = str(LINES_PER_HOST)
+        os.environ["FAKE_NMAP_HOSTS"] = "1"
+        os.environ["HOME"] = work_dir
+        make_scripts_dir(os.path.join(work_dir, "scripts"), 1000)
+        with open(os.path.join(work_dir, "config.json"), 'w') as f:
+            json.dump({"configuration": {}, "speed_dial": {"web": "-p 80,443"}}, f)
+        for name, (code, stdin) in cases(work_dir).items():
+            # The first run fills the catalog cache and the bytecode caches, like any installed mymap has
+            time_run(code, stdin)
+            times = [time_run(code, stdin) for _ in range(args.repeat)]
+            median = statistics.median(times) * 1000
+            results.append({"name": name, "median_ms": round(median, 1), "min_ms": round(min(times) * 1000, 1),
+                            "budget_ms": budgets[name], "ok": median <= budgets[name]})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "platform": platform.platform(), "repeat": args.repeat, "results": results}
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    over = [result["name"] for result in results if not result["ok"]]
+    if over:
+        print(f"Over budget: {', '.join(over)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
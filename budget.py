@@ -0,0 +1,108 @@
+import time
+import signal
+import threading
+from contextlib import contextmanager
+
+from termcolor import colored
+
+from stats import TIMEOUT_REGEX
+
+# In this file: scan budgets - a wall-clock limit, a stall detector, nmap's per-host timeout - and stopping on Ctrl-C
+
+# Seconds between checks of the time limit and the stall detector
+CHECK_INTERVAL = 1.0
+
+def with_host_timeout(args_list, minutes):
+    # nmap gives up on a host (a tarpit, a slow firewall) after this long, unless the user set their own --host-timeout
+    if not minutes or "--host-timeout" in args_list:
+        return list(args_list)
+    return list(args_list) + ["--host-timeout", f"{minutes}m"]
+
+class ScanBudget:
+    """
+    Stops a scan through its ScanControl once it has run for time_limit
+    minutes, or once nmap's progress has not moved for stall_timeout minutes:
+    no phase, percentage or finished host count that any of its processes
+    had not reported before (a stuck nmap keeps printing the same stats
+    lines). Also notes the hosts nmap skipped because of --host-timeout.
+    Zero turns a limit off.
+    """
+    def __init__(self, control, time_limit=0, stall_timeout=0):
+        self.control = control
+        self.time_limit = time_limit
+        self.stall_timeout = stall_timeout
+        self.started = time.time()
+        self.last_progress = self.started
+        self.states = set()
+        self.timed_out = []
+        self.done = threading.Event()
+        control.add_handler(self.on_event)
+        if time_limit or stall_timeout:
+            threading.Thread(target=self.watch, daemon=True).start()
+
+    def on_event(self, kind, value):
+        if kind == "stats":
+            # Shards report in turns, so progress is a state not seen before rather than a change from the last one
+            state = (value.phase, value.percent, value.hosts_completed)
+            if state not in self.states:
+                self.states.add(state)
+                self.last_progress = time.time()
+        elif kind == "host":
+            self.last_progress = time.time()
+        elif kind == "line":
+            if value.startswith("Nmap scan report"):
+                self.last_progress = time.time()
+            elif TIMEOUT_REGEX.match(value):
+                self.timed_out.append(value.split()[2])
+
+    def watch(self):
+        while not self.done.wait(CHECK_INTERVAL):
+            now = time.time()
+            if self.time_limit and now - self.started >= self.time_limit * 60:
+                self.control.stop(f"time limit of {self.time_limit:g} min reached")
+                return
+            if self.stall_timeout and now - self.last_progress >= self.stall_timeout * 60:
+                self.control.stop(f"stalled, no progress for {self.stall_timeout:g} min")
+                return
+
+    def finish(self):
+        self.done.set()
+        if self.timed_out and not self.control.quiet:
+            shown = ", ".join(self.timed_out[:10]) + (", ..." if len(self.timed_out) > 10 else "")
+            print(colored(f"{len(self.timed_out)} hosts skipped after the host timeout: {shown}", "yellow"))
+
+@contextmanager
+def stop_on_interrupt(controls):
+    """
+    While scans run (one ScanControl each, e.g. the jobs of a batch), the
+    first Ctrl-C stops them all like a budget does (nmap is terminated, what
+    they found so far is kept) and a second one interrupts mymap at once.
+    A hang up (SIGHUP) stops them too, then exits with SystemExit once they
+    have saved their checkpoints. nmap runs in its own process group, so
+    these signals only reach mymap. Signals only reach the main thread,
+    elsewhere (background jobs, batch workers) this does nothing.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    stopped = []
+
+    def interrupt(signum, frame):
+        if signum == signal.SIGHUP:
+            stopped.append("hung up")
+        elif stopped:
+            raise KeyboardInterrupt()
+        else:
+            print(colored("\nStopping the scan and keeping what it found, Ctrl-C again to quit at once...", "yellow"))
+            stopped.append("interrupted")
+        for control in controls:
+            control.stop(stopped[-1])
+
+    previous = {number: signal.signal(number, interrupt) for number in (signal.SIGINT, signal.SIGHUP)}
+    try:
+        yield
+    finally:
+        for number, handler in previous.items():
+            signal.signal(number, handler)
+        if "hung up" in stopped:
+            raise SystemExit(1)
@@ -0,0 +1,205 @@
+import os
+import re
+import json
+from collections import defaultdict
+
+# In this file: the persistent NSE script catalog (names, menus, descriptions, args, categories)
+
+# Directory where Nmap scripts are stored
+SCRIPTS_DIR = "/usr/share/nmap/scripts/"
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mymap")
+CATALOG_FILE = os.path.join(CACHE_DIR, "catalog.json")
+CATALOG_VERSION = 1
+
+DESCRIPTION_REGEX = re.compile(r'description\s*=\s*\[(=*)\[(.*?)\]\1\]', re.DOTALL)
+ARGS_REGEX = re.compile(r'^--\s*@args\s+(\S+)', re.MULTILINE)
+SCRIPT_DB_REGEX = re.compile(r'filename\s*=\s*"([^"]+)"\s*,\s*categories\s*=\s*\{([^}]*)\}')
+
+def categorize_scripts(scripts):
+    # Create a dictionary to categorize scripts
+    categorized_scripts = defaultdict(list)
+    for script in scripts:
+        # Use the prefix of the script name as the category
+        category = script.split("-")[0]
+        categorized_scripts[category].append(script)
+
+    # Sort categories and scripts within each category
+    for category in categorized_scripts:
+        categorized_scripts[category] = sorted(categorized_scripts[category])
+
+    # Add SSL, SMB, SSH, RDP, DATABASE, VULN, BRUTE, FTP, MAINFRAME and RPC sub-menus
+    for group in ["SSL", "SMB", "SSH", "RDP", "DATABASE", "VULN", "BRUTE", "FTP", "RPC", "MAINFRAME"]:
+        categorized_scripts[group] = []
+
+    # Populate the sub-menus with the appropriate scripts
+    for script in scripts:
+        if script.startswith("ssl"):
+            categorized_scripts["SSL"].append(script)
+        elif script.startswith("smb"):
+            categorized_scripts["SMB"].append(script)
+        elif script.startswith("ssh"):
+            categorized_scripts["SSH"].append(script)
+        elif script.startswith("rdp"):
+            categorized_scripts["RDP"].append(script)
+        elif script.startswith(("tn3270","nwg-tn3270", "cics","nwg-cics","tso","nwg-tso", "vtam","nwg-vtam", "lu","nwg-lu", "db2", "nwg-db2","ims","nwg-ims")):
+            categorized_scripts["MAINFRAME"].append(script)
+        elif script.startswith(("oracle", "mysql", "mssql", "ms-sql", "pgsql", "db2")):
+            categorized_scripts["DATABASE"].append(script)
+        elif "vuln" in script:
+            categorized_scripts["VULN"].append(script)
+        elif "brute" in script:
+            categorized_scripts["BRUTE"].append(script)
+        elif "ftp" in script:
+            categorized_scripts["FTP"].append(script)
+        elif "rpc" in script:
+            categorized_scripts["RPC"].append(script)
+
+    # Return the categorized scripts as a sorted dictionary
+    return dict(sorted(categorized_scripts.items()))
+
+def parse_script(path):
+    # Pull the description and the documented @args out of an .nse file
+    with open(path, 'r', errors='replace') as f:
+        source = f.read()
+    match = DESCRIPTION_REGEX.search(source)
+    description = match.group(2).strip() if match else ""
+    return {"description": description, "args": list(dict.fromkeys(ARGS_REGEX.findall(source)))}
+
+def parse_script_db(path):
+    # nmap's own script.db: Entry { filename = "x.nse", categories = { "a", "b", } }
+    categories = {}
+    try:
+        with open(path, 'r', errors='replace') as f:
+            for filename, names in SCRIPT_DB_REGEX.findall(f.read()):
+                categories[filename] = re.findall(r'"([^"]+)"', names)
+    except OSError:
+        pass
+    return categories
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0
+
+class Catalog:
+    """
+    Everything mymap knows about the installed NSE scripts, kept in
+    ~/.cache/mymap/catalog.json. The cache is reused as long as the scripts
+    directory and script.db are unchanged; only files whose mtime changed
+    are parsed again. Editing a script in place changes neither, so every
+    file's mtime is checked on load too.
+    """
+    def __init__(self, scripts_dir=SCRIPTS_DIR, catalog_file=CATALOG_FILE):
+        self.scripts_dir = scripts_dir
+        self.catalog_file = catalog_file
+        self.data = None
+        self.menu_data = None
+
+    def load(self):
+        if self.data is not None:
+            return self.data
+        cached = {}
+        try:
+            with open(self.catalog_file, 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        dir_mtime = os.stat(self.scripts_dir).st_mtime
+        db_mtime = mtime(os.path.join(self.scripts_dir, "script.db"))
+        if (cached.get("version") == CATALOG_VERSION and cached.get("scripts_dir") == self.scripts_dir
+                and cached.get("dir_mtime") == dir_mtime and cached.get("db_mtime") == db_mtime):
+            self.data = cached
+            if self.refresh_changed():
+                self.save()
+        else:
+            self.data = self.rebuild(cached.get("scripts", {}) if cached.get("scripts_dir") == self.scripts_dir else {},
+                                     dir_mtime, db_mtime)
+            self.save()
+        return self.data
+
+    def rebuild(self, previous, dir_mtime, db_mtime):
+        db = parse_script_db(os.path.join(self.scripts_dir, "script.db"))
+        scripts = {}
+        for name in os.listdir(self.scripts_dir):
+            if not name.endswith(".nse"):
+                continue
+            entry = previous.get(name)
+            file_mtime = mtime(os.path.join(self.scripts_dir, name))
+            if not entry or entry.get("mtime") != file_mtime:
+                entry = self.parse_entry(name, file_mtime)
+            entry["categories"] = db.get(name, [])
+            scripts[name] = entry
+        return {"version": CATALOG_VERSION, "scripts_dir": self.scripts_dir, "dir_mtime": dir_mtime,
+                "db_mtime": db_mtime, "scripts": scripts, "menu": categorize_scripts(sorted(scripts))}
+
+    def refresh_changed(self):
+        # Parse again the scripts edited since they were cached, True if there were any
+        changed = False
+        for name, entry in self.data["scripts"].items():
+            file_mtime = mtime(os.path.join(self.scripts_dir, name))
+            if entry.get("mtime") != file_mtime:
+                categories = entry.get("categories", [])
+                entry.clear()
+                entry.update(self.parse_entry(name, file_mtime))
+                entry["categories"] = categories
+                changed = True
+        return changed
+
+    def parse_entry(self, name, file_mtime):
+        try:
+            entry = parse_script(os.path.join(self.scripts_dir, name))
+        except OSError:
+            entry = {"description": "", "args": []}
+        entry["mtime"] = file_mtime
+        return entry
+
+    def save(self):
+        # Write to a temp file and rename, so a crash never leaves half a catalog
+        try:
+            os.makedirs(os.path.dirname(self.catalog_file), exist_ok=True)
+            tmp_file = f"{self.catalog_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(tmp_file, self.catalog_file)
+        except OSError:
+            # No writable cache directory, the catalog is simply rebuilt next time
+            pass
+
+    def menu(self):
+        # The menus only need the script names: until something needs descriptions, args or
+        # categories, a listing of the directory is enough and the catalog is not read at all
+        if self.data is not None:
+            return self.data["menu"]
+        if self.menu_data is None:
+            self.menu_data = categorize_scripts(sorted(name for name in os.listdir(self.scripts_dir) if name.endswith(".nse")))
+        return self.menu_data
+
+    def scripts(self):
+        return self.load()["scripts"]
+
+    def entry(self, name):
+        # Catalog entry for one script, re-parsed first if the file changed since it was cached
+        scripts = self.scripts()
+        if name not in scripts:
+            return None
+        entry = scripts[name]
+        file_mtime = mtime(os.path.join(self.scripts_dir, name))
+        if entry.get("mtime") != file_mtime:
+            categories = entry.get("categories", [])
+            entry = self.parse_entry(name, file_mtime)
+            entry["categories"] = categories
+            scripts[name] = entry
+            self.save()
+        return entry
+
+_catalog = None
+
+def get_catalog():
+    # The catalog is only read from disk the first time something asks for it
+    global _catalog
+    if _catalog is None:
+        _catalog = Catalog()
+    return _catalog
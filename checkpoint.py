@@ -0,0 +1,135 @@
+import os
+import re
+import time
+import json
+import uuid
+
+from catalog import CACHE_DIR
+from targets import TargetSet, is_target
+
+# In this file: checkpoints of multi-host scans, so an interrupted scan can be resumed
+
+# Points at the checkpoint of the last scan that did not finish
+LAST_CHECKPOINT = os.path.join(CACHE_DIR, "last_checkpoint")
+
+# Seconds between checkpoint writes while hosts are completing
+SAVE_INTERVAL = 10
+
+# Nmap scan report for name (10.0.0.1), or for 10.0.0.1 [host down] with -v
+REPORT_REGEX = re.compile(r'^Nmap scan report for (\S+)(?: \(([^)]+)\))?')
+
+class Checkpoint:
+    """
+    The hosts a multi-host scan has completed so far. It is written next to
+    the output file (or to the cache directory without one) every few seconds
+    and when the scan stops, and removed once the scan finishes cleanly.
+    nmap only reports the hosts that are up, so when one nmap goes through
+    the targets in order (see follow), every target before the last host
+    report counts as done too, as do the first N once nmap says N hosts
+    completed with none in progress.
+    """
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self.done = set(data["done"])
+        self.last_save = 0
+        self.scanning = None
+        self.reached = 0
+
+    @classmethod
+    def start(cls, args_list, targets, output_file, label):
+        if output_file:
+            path = f"{output_file}.checkpoint.json"
+        else:
+            # Several scans can be running at once, each needs its own file
+            path = os.path.join(CACHE_DIR, f"checkpoint-{uuid.uuid4().hex[:12]}.json")
+        data = {"args": list(args_list), "targets": list(targets.expressions()), "output_file": output_file,
+                "label": label, "started": time.time(), "done": []}
+        return cls(os.path.abspath(path), data)
+
+    @classmethod
+    def load_last(cls):
+        try:
+            with open(LAST_CHECKPOINT, 'r') as f:
+                path = f.read().strip()
+            with open(path, 'r') as f:
+                return cls(path, json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def args(self):
+        return self.data["args"]
+
+    @property
+    def output_file(self):
+        return self.data["output_file"]
+
+    @property
+    def label(self):
+        return self.data["label"]
+
+    def follow(self, targets):
+        # targets (a TargetSet) are scanned by a single nmap in their order, hosts up or down are done as it passes them
+        self.scanning = targets
+        self.reached = 0
+
+    def on_event(self, kind, value):
+        # Engine event handler: every finished host is marked done
+        if kind == "host":
+            self.done.add(value.address)
+            if value.hostname:
+                self.done.add(value.hostname)
+        elif kind == "line":
+            match = REPORT_REGEX.match(value)
+            if not match:
+                return
+            names = [name for name in match.groups() if name]
+            self.done.update(names)
+            if self.scanning:
+                positions = [self.scanning.position(name) for name in names]
+                self.reached = max([self.reached] + [position for position in positions if position])
+        elif kind == "stats" and self.scanning and value.hosts_undergoing == 0:
+            self.reached = max(self.reached, value.hosts_completed)
+        else:
+            return
+        if time.time() - self.last_save >= SAVE_INTERVAL:
+            self.save()
+
+    def done_targets(self):
+        if not self.reached:
+            return set(self.done)
+        return self.done | set(self.scanning.head(self.reached).expressions())
+
+    def total(self):
+        return TargetSet(self.data["targets"]).count()
+
+    def remaining(self):
+        # The targets as a TargetSet minus every host marked done
+        return TargetSet(self.data["targets"], [name for name in self.done_targets() if is_target(name)])
+
+    def save(self):
+        self.data["done"] = sorted(self.done_targets())
+        self.last_save = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_file = f"{self.path}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(tmp_file, self.path)
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(LAST_CHECKPOINT, 'w') as f:
+                f.write(self.path)
+        except OSError:
+            pass
+
+    def finish(self):
+        # The scan completed, nothing left to resume
+        try:
+            with open(LAST_CHECKPOINT, 'r') as f:
+                if f.read().strip() == self.path:
+                    os.remove(LAST_CHECKPOINT)
+        except OSError:
+            pass
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,642 @@
+import os
+import re
+import hmac
+import json
+import time
+import socket
+import hashlib
+import secrets
+import tempfile
+import threading
+from collections import deque
+
+from termcolor import colored
+
+from engine import ScanControl, ScanCancelled
+from printers import print_progress
+from results import Host, Port, ScriptResult, ScanOutput
+from stats import ScanStats
+from targets import TargetSet
+from outputs import open_output, STATUS_REGEX
+from catalog import SCRIPTS_DIR
+from timing import span
+
+# In this file: distributed scans - a coordinator that shards scans out to worker agents over TCP
+#
+# The protocol is one JSON object per line. Agents connect and both sides prove they know the
+# cluster token: the coordinator sends {"type": "challenge", "nonce"}, the agent answers
+# {"type": "hello", "name", "slots", "nonce", "proof"} and the coordinator {"type": "welcome",
+# "proof"}, each proof an HMAC of the other side's nonce. Then the coordinator sends {"type":
+# "task", "id", "args", "targets"} and {"type": "cancel", "id"}, agents answer with "lines",
+# "progress", "eta", "stats" and finally {"type": "done", "id", "retcode", "hosts"}, and "ping"
+# while idle. Nothing is encrypted, use an SSH tunnel or VPN across untrusted networks.
+
+DEFAULT_PORT = 7700
+
+# Seconds between agent pings, and without any message before the coordinator gives an agent up
+PING_INTERVAL = 10
+AGENT_TIMEOUT = 45
+
+# Seconds an agent waits before connecting again after losing the coordinator
+RECONNECT_INTERVAL = 5
+
+# Runs of one shard before it counts as failed
+MAX_ATTEMPTS = 3
+
+# Shards per agent slot when shard_count is not set, small shards lose less when an agent dies
+SHARDS_PER_SLOT = 4
+
+# Output lines an agent collects before sending them
+LINE_BATCH = 200
+
+# Return code of a task an agent refused to run, see refused_option
+REFUSED = 2
+
+# nmap options an agent refuses because they read or write files on its machine. nmap also
+# takes unambiguous abbreviations of long options, those are refused too
+FILE_OPTIONS = {"oN", "oX", "oG", "oA", "oS", "oM", "oH", "iL", "iR", "excludefile", "resume", "datadir",
+                "servicedb", "versiondb", "stylesheet", "script-args-file", "append-output", "script-updatedb"}
+
+# key=value pairs of --script-args, values can be quoted or {tables}
+SCRIPT_ARG_REGEX = re.compile(r'([\w.\-]+)\s*=\s*("[^"]*"|\'[^\']*\'|\{[^}]*\}|[^,]*)')
+
+# Script args that name a file to read or write (brute force lists, http-fetch.destination...), matched on
+# the last part of the key
+FILE_SCRIPT_ARGS = ("db", "file", "filename", "destination", "dir", "directory", "path", "output", "outfile")
+
+# Long options that start with or contain o, i or m, the short options that take file names
+# (-o, -i, -m, -oN, -iL, ...), see refused_option
+SAFE_OPTIONS = {"data", "data-string", "data-length", "script", "script-args", "script-trace", "script-timeout",
+                "exclude", "version-intensity", "version-light", "version-all", "version-trace", "open", "osscan-limit",
+                "osscan-guess", "iflist", "ip-options", "initial-rtt-timeout", "min-rtt-timeout", "max-rtt-timeout",
+                "min-rate", "max-rate", "min-parallelism", "max-parallelism", "min-hostgroup", "max-hostgroup",
+                "max-retries", "host-timeout", "scan-delay", "max-scan-delay", "spoof-mac", "source-port",
+                "traceroute", "privileged", "unprivileged", "system-dns", "disable-arp-ping", "discovery-ignore-rst",
+                "mtu", "randomize-hosts", "defeat-rst-ratelimit", "defeat-icmp-ratelimit", "nsock-engine",
+                "noninteractive", "reason", "stats-every", "top-ports", "port-ratio", "allports", "send-ip", "proxies"}
+
+def make_proof(token, role, nonce):
+    return hmac.new(token.encode(), f"{role}:{nonce}".encode(), hashlib.sha256).hexdigest()
+
+def check_proof(token, role, nonce, proof):
+    return isinstance(proof, str) and hmac.compare_digest(make_proof(token, role, nonce), proof)
+
+def script_allowed(value):
+    # --script names, categories and expressions are looked up by nmap, paths only inside the scripts directory
+    scripts_dir = os.path.realpath(SCRIPTS_DIR)
+    for item in value.split(","):
+        item = item.strip().lstrip("+")
+        if "/" in item and os.path.commonpath([scripts_dir, os.path.realpath(item)]) != scripts_dir:
+            return False
+    return True
+
+def script_args_allowed(value):
+    # No script arg that names a file, or whose value looks like a path
+    for key, arg in SCRIPT_ARG_REGEX.findall(value):
+        name = key.rsplit(".", 1)[-1].lower()
+        arg = arg.strip("\"'{} ")
+        if name.endswith(FILE_SCRIPT_ARGS) or arg.startswith(("/", "~", "./", "../")):
+            return False
+    return True
+
+def refused_option(args):
+    """
+    The first argument an agent will not run, None if all are fine: options
+    that read or write files (FILE_OPTIONS, or an abbreviation of one),
+    scripts outside the scripts directory and script args naming files.
+    Script args only get a best effort check, by name and by value. The coordinator is trusted with
+    targets and scan options, not with the agent's file system. nmap reads a
+    single dash argument that is no long option as short options, so any
+    other with an o, i or m (-oNfile, -vvoN, -mfile) is refused as well.
+    """
+    for i, arg in enumerate(args):
+        if not arg.startswith("-") or arg == "-":
+            continue
+        name, _, value = arg.lstrip("-").partition("=")
+        if name in ("script", "script-args"):
+            value = value or (args[i + 1] if i + 1 < len(args) else "")
+            if not (script_allowed(value) if name == "script" else script_args_allowed(value)):
+                return arg if "=" in arg else f"{arg} {value}"
+            continue
+        if name in SAFE_OPTIONS:
+            continue
+        if name in FILE_OPTIONS or (len(name) >= 2 and any(option.startswith(name) for option in FILE_OPTIONS)):
+            return arg
+        if not arg.startswith("--") and any(letter in name for letter in "oim"):
+            return arg
+    return None
+
+def parse_address(address):
+    # "host:port", ":port" (every interface) or just "host"
+    host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+    return host.strip("[]"), int(port) if port else DEFAULT_PORT
+
+def encode_host(host):
+    scripts = lambda results: [[script.id, script.output] for script in results]
+    return {"address": host.address, "hostname": host.hostname, "status": host.status, "scripts": scripts(host.scripts),
+            "ports": [[port.protocol, port.portid, port.state, port.service, port.product, port.version, scripts(port.scripts)]
+                      for port in host.ports]}
+
+def decode_host(data):
+    host = Host(data["address"], data["hostname"], data["status"])
+    host.scripts = [ScriptResult(*script) for script in data["scripts"]]
+    for protocol, portid, state, service, product, version, scripts in data["ports"]:
+        port = Port(protocol, portid, state, service, product, version)
+        port.scripts = [ScriptResult(*script) for script in scripts]
+        host.ports.append(port)
+    return host
+
+def encode_stats(stats):
+    return {name: getattr(stats, name) for name in ScanStats.__slots__}
+
+def decode_stats(data):
+    stats = ScanStats()
+    for name in ScanStats.__slots__:
+        setattr(stats, name, data.get(name, getattr(stats, name)))
+    return stats
+
+class Connection:
+    # One end of a coordinator/agent link, writes can come from several threads
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        data = (json.dumps(message) + "\n").encode()
+        with self.lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        # The next message, None once the other end is gone
+        line = self.reader.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+class Task:
+    # One shard of a distributed scan, possibly run more than once
+    def __init__(self, number, index, scan, args, targets):
+        self.id = number
+        self.index = index
+        self.scan = scan
+        self.args = args
+        self.targets = targets
+        self.attempts = 0
+        self.failed_on = set()
+        self.agent = None
+        self.output = None
+        self.retcode = None
+
+class Agent:
+    def __init__(self, name, slots, connection):
+        self.name = name
+        self.slots = max(1, slots)
+        self.connection = connection
+        self.tasks = {}
+
+    def free(self):
+        return self.slots - len(self.tasks)
+
+class ClusterScan:
+    # The shards of one scan and how they are doing, finished() when none is left to run
+    def __init__(self, control, labels):
+        self.control = control
+        self.labels = labels
+        self.tasks = []
+        self.remaining = 0
+
+    def finished(self):
+        return self.remaining == 0
+
+class Coordinator:
+    """
+    Accepts agents on a TCP port and runs scans on them. A scan's targets
+    are split into shards that are handed to whichever agent has a free
+    slot. A shard whose agent disconnects or goes quiet is put back in the
+    queue, and one that fails is retried on another agent, up to
+    MAX_ATTEMPTS runs. Several scans (batch jobs) can share the agents.
+    Only agents that know the cluster token are let in.
+    """
+    def __init__(self, address, token):
+        self.host, self.port = parse_address(address)
+        self.token = token
+        self.agents = []
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.next_id = 0
+        self.server = None
+
+    def start(self):
+        self.server = socket.create_server((self.host, self.port))
+        threading.Thread(target=self.accept_agents, daemon=True).start()
+        print(colored(f"Coordinator listening on {self.host or '*'}:{self.port}, "
+                      f"start agents with: python3 mymap.py --agent HOST:{self.port}", "cyan"))
+
+    def accept_agents(self):
+        while True:
+            try:
+                sock, peer = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_agent, args=(sock, peer), daemon=True).start()
+
+    def slots(self):
+        with self.condition:
+            return sum(agent.slots for agent in self.agents)
+
+    def serve_agent(self, sock, peer):
+        sock.settimeout(AGENT_TIMEOUT)
+        connection = Connection(sock)
+        agent = None
+        try:
+            nonce = secrets.token_hex(16)
+            connection.send({"type": "challenge", "nonce": nonce})
+            hello = connection.receive()
+            if not hello or hello.get("type") != "hello":
+                return
+            if not check_proof(self.token, "agent", nonce, hello.get("proof")):
+                print(colored(f"Refused an agent from {peer[0]}: wrong cluster token", "red"))
+                return
+            connection.send({"type": "welcome", "proof": make_proof(self.token, "coordinator", str(hello.get("nonce", "")))})
+            agent = Agent(str(hello.get("name", "")), int(hello.get("slots", 1)), connection)
+            with self.condition:
+                self.agents.append(agent)
+                self.dispatch()
+            print(colored(f"Agent {agent.name} joined with {agent.slots} slots", "green"))
+            while True:
+                message = connection.receive()
+                if message is None:
+                    break
+                self.handle(agent, message)
+        except (OSError, ValueError):
+            # A timeout, a reset connection or garbage all mean the agent is gone
+            pass
+        finally:
+            connection.close()
+            if agent:
+                self.lost(agent)
+
+    def lost(self, agent):
+        # Everything the agent was running goes back to the front of the queue
+        with self.condition:
+            self.agents.remove(agent)
+            for task in agent.tasks.values():
+                task.agent = None
+                task.output.close()
+                task.output = None
+                if task.attempts < MAX_ATTEMPTS:
+                    self.queue.appendleft(task)
+                else:
+                    # A shard that keeps taking its agent down is not tried forever
+                    task.retcode = -1
+                    task.scan.remaining -= 1
+            if agent.tasks:
+                print(colored(f"Agent {agent.name} lost, reassigning {len(agent.tasks)} shards", "yellow"))
+            else:
+                print(colored(f"Agent {agent.name} left", "yellow"))
+            agent.tasks = {}
+            self.dispatch()
+            self.condition.notify_all()
+
+    def next_task(self, agent):
+        # The first queued shard that has not already failed on this agent, unless no other agent is left for it
+        for task in self.queue:
+            others = [other for other in self.agents if other.name not in task.failed_on]
+            if agent.name not in task.failed_on or not others:
+                self.queue.remove(task)
+                return task
+        return None
+
+    def dispatch(self):
+        # Called with the condition held: fill every free agent slot from the queue
+        for agent in list(self.agents):
+            while agent.free() > 0:
+                task = self.next_task(agent)
+                if task is None:
+                    break
+                task.attempts += 1
+                task.agent = agent
+                task.output = ScanOutput()
+                agent.tasks[task.id] = task
+                try:
+                    agent.connection.send({"type": "task", "id": task.id, "args": task.args, "targets": task.targets})
+                except OSError:
+                    # serve_agent sees the broken connection and reassigns the task
+                    agent.connection.close()
+                    break
+
+    def handle(self, agent, message):
+        kind = message.get("type")
+        with self.condition:
+            task = agent.tasks.get(message.get("id"))
+        if task is None:
+            return
+        scan = task.scan
+        if kind == "lines":
+            with self.condition:
+                # Not into a shard that was taken back from the agent (lost, cancelled) meanwhile
+                if task.agent is not agent:
+                    return
+                for line in message["lines"]:
+                    task.output.write(line)
+            for line in message["lines"]:
+                scan.control.emit("line", line)
+        elif kind == "progress":
+            scan.control.emit("progress", message["percent"])
+            if not scan.control.quiet:
+                print_progress(message["percent"], f"{scan.labels[task.index]} on {agent.name}")
+        elif kind == "eta":
+            scan.control.emit("eta", message["eta"])
+        elif kind == "stats":
+            scan.control.emit("stats", decode_stats(message["stats"]))
+        elif kind == "done":
+            self.finish_task(agent, task, message)
+
+    def finish_task(self, agent, task, message):
+        with self.condition:
+            del agent.tasks[task.id]
+            task.agent = None
+            if message["retcode"] == 0:
+                task.retcode = 0
+                task.output.release()
+                task.output.hosts = [decode_host(host) for host in message["hosts"]]
+                task.scan.remaining -= 1
+            elif task.attempts < MAX_ATTEMPTS:
+                reason = "refused an option that reads or writes its files" if message["retcode"] == REFUSED else f"return code {message['retcode']}"
+                print(colored(f"{task.scan.labels[task.index]} failed on {agent.name} ({reason}), retrying", "yellow"))
+                task.failed_on.add(agent.name)
+                task.output.close()
+                task.output = None
+                self.queue.append(task)
+            else:
+                task.retcode = message["retcode"]
+                task.scan.remaining -= 1
+            self.dispatch()
+            self.condition.notify_all()
+        # Hosts are only passed on once a shard is complete, so a retried shard never reports a host twice
+        if task.retcode == 0:
+            for host in task.output.hosts:
+                task.scan.control.emit("host", host)
+
+    def cancel(self, scan):
+        with self.condition:
+            for task in scan.tasks:
+                if task in self.queue:
+                    self.queue.remove(task)
+                elif task.agent:
+                    try:
+                        task.agent.connection.send({"type": "cancel", "id": task.id})
+                    except OSError:
+                        pass
+                    del task.agent.tasks[task.id]
+                    task.agent = None
+            self.dispatch()
+
+    def run(self, args_list, targets, output_file, shard_count=0, control=None, append=False, label=""):
+        """
+        Run nmap with args_list over targets (a TargetSet) on the agents and
+        return the merged ScanOutput in shard order, or None if every shard
+        failed. The agents' output is written (or appended) to output_file.
+        Waits for the first agent if none has joined yet. Cancelled, the
+        shards are stopped and ScanCancelled carries what they sent so far.
+        """
+        control = control or ScanControl()
+        with self.condition:
+            while not self.agents:
+                if not control.quiet:
+                    print(colored(f"\rWaiting for agents to connect to port {self.port}...", "yellow"), end="", flush=True)
+                self.condition.wait(1)
+                if control.cancel.is_set():
+                    raise ScanCancelled()
+
+        shards = targets.split(shard_count or self.slots() * SHARDS_PER_SLOT)
+        total = len(shards)
+        print(colored(f"\nRunning {targets.count()} targets as {total} shards on {len(self.agents)} agents "
+                      f"({self.slots()} slots)", "cyan"))
+        labels = [f"{label} shard {i+1}/{total}" if label else f"shard {i+1}/{total}" for i in range(total)]
+        scan = ClusterScan(control, labels)
+
+        with self.condition:
+            for i, shard in enumerate(shards):
+                self.next_id += 1
+                task = Task(self.next_id, i, scan, list(args_list) + shard.family_args(), list(shard.expressions()))
+                scan.tasks.append(task)
+                self.queue.append(task)
+            scan.remaining = total
+            self.dispatch()
+
+        try:
+            with span("nmap"), self.condition:
+                while not scan.finished():
+                    self.condition.wait(1)
+                    if control.cancel.is_set():
+                        raise ScanCancelled()
+        except ScanCancelled:
+            self.cancel(scan)
+            raise ScanCancelled(self.merge(scan, output_file, append, partial=True)) from None
+        except BaseException:
+            # Interrupted: stop the shards still running on the agents
+            self.cancel(scan)
+            raise
+        return self.merge(scan, output_file, append)
+
+    def merge(self, scan, output_file, append, partial=False):
+        # partial: a cancelled scan, the shards that had not finished count with the lines they sent
+        merged = ScanOutput()
+        failed = 0
+        for task in scan.tasks:
+            if task.retcode == 0 or (partial and task.retcode is None and task.output is not None):
+                merged.extend(task.output)
+            else:
+                failed += 1
+            if task.output is not None:
+                task.output.close()
+        total = len(scan.tasks)
+        if output_file:
+            with open_output(output_file, append) as f:
+                for line in merged.lines():
+                    # Agents stream nmap's stats lines for the progress display, they are not part of the output
+                    if not STATUS_REGEX.match(line):
+                        f.write(line + "\n")
+        if partial:
+            return merged
+        if failed:
+            print(colored(f"{failed} of {total} shards failed after {MAX_ATTEMPTS} attempts", "red"))
+        if failed == total:
+            merged.close()
+            return None
+        return merged
+
+_coordinator = None
+
+def start_coordinator(address, token):
+    global _coordinator
+    _coordinator = Coordinator(address, token)
+    _coordinator.start()
+    return _coordinator
+
+def get_coordinator():
+    # The running coordinator, None unless mymap was started with --coordinator
+    return _coordinator
+
+class AgentSession:
+    """
+    One connection of an agent to the coordinator: runs every task it is
+    sent through run_nmap (up to `slots` at once) and streams the output
+    back. If the connection drops the running scans are stopped, the
+    coordinator has given them to other agents by then.
+    """
+    def __init__(self, connection, name, slots, run_nmap):
+        self.connection = connection
+        self.name = name
+        self.slots = slots
+        self.run_nmap = run_nmap
+        self.controls = {}
+        self.threads = []
+        self.closed = threading.Event()
+
+    def handshake(self, token):
+        # Proves the agent knows the token and checks the coordinator does, True if both do
+        challenge = self.connection.receive()
+        if not challenge or challenge.get("type") != "challenge":
+            return False
+        nonce = secrets.token_hex(16)
+        self.connection.send({"type": "hello", "name": self.name, "slots": self.slots, "nonce": nonce,
+                              "proof": make_proof(token, "agent", str(challenge.get("nonce", "")))})
+        welcome = self.connection.receive()
+        return bool(welcome) and welcome.get("type") == "welcome" and check_proof(token, "coordinator", nonce, welcome.get("proof"))
+
+    def serve(self):
+        threading.Thread(target=self.ping, daemon=True).start()
+        try:
+            while True:
+                message = self.connection.receive()
+                if message is None:
+                    break
+                if message.get("type") == "task":
+                    thread = threading.Thread(target=self.run_task, args=(message,), daemon=True)
+                    thread.start()
+                    self.threads = [other for other in self.threads if other.is_alive()] + [thread]
+                elif message.get("type") == "cancel" and message.get("id") in self.controls:
+                    self.controls[message["id"]].cancel.set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.closed.set()
+            for control in list(self.controls.values()):
+                control.cancel.set()
+            self.connection.close()
+            # Give the engine a moment to kill the nmap processes, even when stopping on Ctrl-C
+            for thread in self.threads:
+                thread.join(timeout=5)
+
+    def ping(self):
+        while not self.closed.wait(PING_INTERVAL):
+            self.send({"type": "ping"})
+
+    def send(self, message):
+        try:
+            self.connection.send(message)
+        except OSError:
+            # serve() notices the broken connection and stops the scans
+            pass
+
+    def run_task(self, message):
+        number = message["id"]
+        lines = []
+
+        def stream(kind, value):
+            if kind == "line":
+                lines.append(value)
+                if len(lines) >= LINE_BATCH:
+                    flush()
+                return
+            if kind == "progress":
+                flush()
+                self.send({"type": "progress", "id": number, "percent": value})
+            elif kind == "eta":
+                self.send({"type": "eta", "id": number, "eta": value})
+            elif kind == "stats":
+                self.send({"type": "stats", "id": number, "stats": encode_stats(value)})
+
+        def flush():
+            if lines:
+                self.send({"type": "lines", "id": number, "lines": lines[:]})
+                lines.clear()
+
+        refused = refused_option(message["args"])
+        if refused:
+            print(colored(f"Refused task {number}: {refused} reads or writes files on this machine", "red"))
+            self.send({"type": "done", "id": number, "retcode": REFUSED, "hosts": []})
+            return
+        control = ScanControl(stream, quiet=True)
+        self.controls[number] = control
+        fd, target_file = tempfile.mkstemp(prefix="mymap-", suffix=".targets")
+        os.close(fd)
+        label = f"task {number}"
+        print(colored(f"Running {label}: {len(message['targets'])} target blocks", "cyan"))
+        output = None
+        try:
+            TargetSet(message["targets"]).write(target_file)
+            output = self.run_nmap(message["args"] + ["-iL", target_file], label, control)
+        except ScanCancelled:
+            print(colored(f"{label} cancelled", "yellow"))
+            return
+        except (OSError, ValueError) as e:
+            print(colored(f"{label} failed: {e}", "red"))
+        finally:
+            del self.controls[number]
+            os.remove(target_file)
+        flush()
+        if output is None or output.stopped:
+            # nmap failed part way, the coordinator retries the whole shard
+            self.send({"type": "done", "id": number, "retcode": 1, "hosts": []})
+            return
+        self.send({"type": "done", "id": number, "retcode": 0, "hosts": [encode_host(host) for host in output.hosts]})
+        output.close()
+        print(colored(f"{label} done", "green"))
+
+def run_agent(address, token, slots, run_nmap, name=""):
+    """
+    Work for the coordinator at address until interrupted, connecting again
+    whenever the connection is lost. run_nmap(args, label, control) runs one
+    scan and returns its ScanOutput, or None if nmap failed. Both sides must
+    have the same cluster token.
+    """
+    host, port = parse_address(address)
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    try:
+        while True:
+            try:
+                sock = socket.create_connection((host or "localhost", port), timeout=AGENT_TIMEOUT)
+            except OSError as e:
+                print(colored(f"Cannot reach the coordinator at {host}:{port} ({e}), retrying", "yellow"))
+                time.sleep(RECONNECT_INTERVAL)
+                continue
+            session = AgentSession(Connection(sock), name, slots, run_nmap)
+            try:
+                accepted = session.handshake(token)
+            except (OSError, ValueError):
+                accepted = False
+            if not accepted:
+                session.connection.close()
+                print(colored(f"{host}:{port} did not accept our cluster token or did not prove it has it, retrying", "red"))
+                time.sleep(RECONNECT_INTERVAL)
+                continue
+            # Tasks can take hours, only a dead connection should end the session
+            sock.settimeout(None)
+            print(colored(f"Agent {name} connected to {host}:{port} with {slots} slots", "green"))
+            session.serve()
+            print(colored("Lost the coordinator, reconnecting", "yellow"))
+            time.sleep(RECONNECT_INTERVAL)
+    except KeyboardInterrupt:
+        print(colored("\nAgent stopped.", "yellow"))
+    return 0
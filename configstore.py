@@ -0,0 +1,175 @@
+import os
+import json
+import stat
+import fcntl
+import tempfile
+from contextlib import contextmanager
+
+# In this file: the config file store - locked, atomic writes shared safely by several mymap sessions
+#
+# config.json holds the settings, report rules and speed dials. Speed dial changes are appended
+# to a journal next to it (config.speed_dial.jsonl, one {"op", "name", "flags"} per line) instead
+# of rewriting the whole file, and folded back into config.json on the next full save.
+
+# Journal entries before adding a speed dial rewrites config.json instead
+COMPACT_AFTER = 50
+
+def file_stamp(path):
+    # What changes whenever the file is written or replaced, None if it does not exist
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+class ConfigStore:
+    """
+    config.json plus its speed dial journal, as one dict (data) that the
+    rest of mymap reads. Every change is made under an exclusive lock on
+    config.json.lock, on top of whatever is on disk at that moment, so two
+    sessions never undo each other's changes. config.json is only ever
+    replaced whole (write a temporary file, then rename), so a crash cannot
+    leave it half written. refresh() reloads data in place when another
+    session has changed either file.
+    """
+    def __init__(self, path):
+        self.path = path
+        root, _ = os.path.splitext(path)
+        self.journal_path = f"{root}.speed_dial.jsonl"
+        self.lock_path = f"{path}.lock"
+        self.data = {}
+        self.stamps = None
+        self.journal_entries = 0
+
+    @contextmanager
+    def locked(self):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def current_stamps(self):
+        return (file_stamp(self.path), file_stamp(self.journal_path))
+
+    def load(self):
+        # Read both files, json.JSONDecodeError if config.json is broken
+        data = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        stamps = self.current_stamps()
+        entries = 0
+        if os.path.isfile(self.journal_path):
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # An append cut short by a crash, the entries before it still count
+                        continue
+                    entries += 1
+                    dials = data.setdefault("speed_dial", {})
+                    if entry.get("op") == "delete":
+                        dials.pop(entry.get("name"), None)
+                    else:
+                        dials[entry["name"]] = entry["flags"]
+        # Update in place, everyone holding the dict sees the new values
+        self.data.clear()
+        self.data.update(data)
+        self.stamps = stamps
+        self.journal_entries = entries
+        return self.data
+
+    def refresh(self):
+        # Reload if another session changed the files since we last did, True if it did
+        if self.current_stamps() == self.stamps:
+            return False
+        try:
+            self.load()
+        except (OSError, ValueError):
+            # Caught in the middle of someone else's write, the next refresh gets it
+            return False
+        return True
+
+    def sync(self):
+        # Called locked, before a change: a broken file raises instead of being saved over
+        if self.current_stamps() != self.stamps:
+            self.load()
+
+    def save(self):
+        # Called locked: replace config.json with data, which already includes the journal
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_file = tempfile.mkstemp(prefix=".config-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.isfile(self.path):
+                os.chmod(tmp_file, stat.S_IMODE(os.stat(self.path).st_mode))
+            os.replace(tmp_file, self.path)
+        except BaseException:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            raise
+        # Replaying the journal on top of the new file would change nothing, it can go
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self.stamps = self.current_stamps()
+        self.journal_entries = 0
+
+    def set_setting(self, key, value):
+        with self.locked():
+            self.sync()
+            self.data.setdefault("configuration", {})[key] = value
+            self.save()
+
+    def append(self, entry):
+        # Called locked: one journal line instead of a whole new config.json
+        if self.journal_entries >= COMPACT_AFTER:
+            self.save()
+            return
+        stamps = self.current_stamps()
+        line = json.dumps(entry) + "\n"
+        with open(self.journal_path, 'ab+') as f:
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # End the line a crash cut short, or it would swallow this one
+                    line = "\n" + line
+            f.write(line.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_entries += 1
+        # Only our own line was added, no need to read it back
+        if stamps == self.stamps:
+            self.stamps = self.current_stamps()
+
+    def set_speed_dial(self, name, flags):
+        with self.locked():
+            self.sync()
+            self.data.setdefault("speed_dial", {})[name] = flags
+            self.append({"op": "set", "name": name, "flags": flags})
+
+    def delete_speed_dial(self, name):
+        with self.locked():
+            self.sync()
+            self.data.get("speed_dial", {}).pop(name, None)
+            self.append({"op": "delete", "name": name})
+
+_config = None
+
+def open_config(path):
+    # Load the config file into a new store, json.JSONDecodeError if it is broken
+    global _config
+    store = ConfigStore(path)
+    store.load()
+    # A broken file is never used for saving, that would replace it with nothing
+    _config = store
+    return store
+
+def get_config():
+    # The store load_config opened
+    return _config
@@ -0,0 +1,207 @@
+import os
+import re
+import sys
+import json
+import time
+import xml.etree.ElementTree as ET
+
+from termcolor import colored
+
+from results import iter_hosts
+from rules import SEVERITIES, Matcher
+from outputs import HOST_REGEX, open_text
+
+# In this file: the consolidated report over a whole directory of -oN / -oX outputs from an engagement
+
+REPORT_FORMATS = ["text", "json", "html"]
+
+PORT_REGEX = re.compile(r'^(\d+)/(tcp|udp|sctp)\s')
+
+# Each worker process compiles the rules once
+_matcher = None
+
+def init_worker(rules):
+    global _matcher
+    _matcher = Matcher(rules)
+
+def output_kind(path):
+    # "xml", "normal" or None, from the first bytes of the file (decompressed for .gz/.zst)
+    try:
+        with open_text(path) as f:
+            head = f.read(4096)
+    except (OSError, EOFError):
+        return None
+    if "<nmaprun" in head:
+        return "xml"
+    if "Nmap scan report for" in head or head.startswith(("# Nmap", "Starting Nmap")):
+        return "normal"
+    return None
+
+def xml_findings(path):
+    # (host, port, keyword, evidence) from the script output in an -oX file
+    for host in iter_hosts(path):
+        name = host.address or host.hostname
+        outputs = [("", script.output) for script in host.scripts]
+        outputs += [(f"{port.portid}/{port.protocol}", script.output) for port in host.ports for script in port.scripts]
+        for port, output in outputs:
+            for line in output.splitlines():
+                for keyword in _matcher.line_hits(line):
+                    yield name, port, keyword, line.strip()
+
+def normal_findings(path):
+    # (host, port, keyword, evidence) from an -oN file, following the host and port each line belongs to
+    host, port = "", ""
+    with open_text(path) as f:
+        for line in f:
+            if line.startswith(("Nmap done", "# Nmap done")):
+                # Anything after this (mymap's report, cached results) is not about a host
+                host, port = "", ""
+                continue
+            match = HOST_REGEX.match(line)
+            if match:
+                host = match.group(2) or match.group(1)
+                port = ""
+                continue
+            match = PORT_REGEX.match(line)
+            if match:
+                port = f"{match.group(1)}/{match.group(2)}"
+            elif line.startswith("Host script results"):
+                port = ""
+            if not host:
+                continue
+            for keyword in _matcher.line_hits(line):
+                # Without the "| " script output markers, so the evidence matches the -oX text
+                yield host, port, keyword, line.strip().lstrip("|_ ")
+
+def parse_file(path):
+    # Runs in a worker process: (path, kind, findings, error) for one output file
+    kind = output_kind(path)
+    findings = []
+    if kind is None:
+        return path, kind, findings, ""
+    try:
+        for finding in (xml_findings(path) if kind == "xml" else normal_findings(path)):
+            findings.append(finding)
+    except (OSError, EOFError, ET.ParseError) as e:
+        # A truncated file from an interrupted scan still counts up to where it breaks
+        return path, kind, findings, str(e)
+    return path, kind, findings, ""
+
+def find_outputs(directory):
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+class Finding:
+    # One rule hit on one host and port, however many files and lines it appeared in
+    __slots__ = ("host", "port", "keyword", "severity", "evidence", "files", "count")
+
+    def __init__(self, host, port, keyword, severity, evidence):
+        self.host = host
+        self.port = port
+        self.keyword = keyword
+        self.severity = severity
+        self.evidence = evidence
+        self.files = set()
+        self.count = 0
+
+    def as_dict(self):
+        return {"severity": self.severity, "host": self.host, "port": self.port, "rule": self.keyword,
+                "evidence": self.evidence, "count": self.count, "files": sorted(self.files)}
+
+def host_key(host):
+    # IP addresses in numeric order, hostnames after them
+    parts = host.split(".")
+    if len(parts) == 4 and all(part.isdigit() for part in parts):
+        return (0, tuple(int(part) for part in parts), "")
+    return (1, (), host)
+
+def port_key(port):
+    number, _, protocol = port.partition("/")
+    return (int(number) if number.isdigit() else -1, protocol)
+
+def consolidate(directory, rules, workers=0):
+    """
+    Parse every nmap output under directory in a process pool and merge the
+    findings per (host, port, rule). Returns (findings sorted by severity,
+    host and port, files parsed, files skipped, [(file, error)]).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    matcher = Matcher(rules)
+    findings = {}
+    parsed, skipped, errors = 0, 0, []
+    with ProcessPoolExecutor(max_workers=workers or None, initializer=init_worker, initargs=(matcher.rules,)) as pool:
+        for path, kind, hits, error in pool.map(parse_file, find_outputs(directory), chunksize=8):
+            if kind is None:
+                skipped += 1
+                continue
+            parsed += 1
+            if error:
+                errors.append((path, error))
+            for host, port, keyword, evidence in hits:
+                key = (host, port, keyword)
+                if key not in findings:
+                    findings[key] = Finding(host, port, keyword, matcher.rules[keyword], evidence)
+                findings[key].files.add(path)
+                findings[key].count += 1
+    ordered = sorted(findings.values(), key=lambda finding: (SEVERITIES.index(finding.severity), host_key(finding.host),
+                                                             port_key(finding.port), finding.keyword))
+    return ordered, parsed, skipped, errors
+
+def format_text(findings, directory, parsed):
+    lines = [f"Consolidated report for {directory}: {len(findings)} findings from {parsed} files", ""]
+    for severity in SEVERITIES:
+        matching = [finding for finding in findings if finding.severity == severity]
+        if not matching:
+            continue
+        lines.append(f"{severity.upper()} ({len(matching)})")
+        for finding in matching:
+            where = f"{finding.host} {finding.port}".strip()
+            lines.append(f"  {where}: '{finding.keyword}' - {finding.evidence}  [{finding.count}x in {len(finding.files)} files]")
+        lines.append("")
+    return "\n".join(lines)
+
+def format_json(findings, directory, parsed):
+    return json.dumps({"directory": directory, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "files": parsed,
+                       "findings": [finding.as_dict() for finding in findings]}, indent=4)
+
+def format_html(findings, directory, parsed):
+    import html
+    colours = {"critical": "#b71c1c", "high": "#e53935", "medium": "#8e24aa", "low": "#f9a825", "info": "#546e7a"}
+    rows = []
+    for finding in findings:
+        rows.append(f'<tr><td style="color:{colours[finding.severity]}"><b>{finding.severity}</b></td>'
+                    f"<td>{html.escape(finding.host)}</td><td>{html.escape(finding.port)}</td>"
+                    f"<td>{html.escape(finding.keyword)}</td><td><code>{html.escape(finding.evidence)}</code></td>"
+                    f"<td>{finding.count}</td><td>{html.escape(', '.join(sorted(finding.files)))}</td></tr>")
+    return (f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>MyMap report: {html.escape(directory)}</title>"
+            "<style>body{font-family:sans-serif}table{border-collapse:collapse}td,th{border:1px solid #ccc;padding:4px 8px;"
+            "text-align:left;vertical-align:top}</style></head><body>\n"
+            f"<h1>Consolidated report for {html.escape(directory)}</h1>\n<p>{len(findings)} findings from {parsed} files</p>\n"
+            "<table><tr><th>Severity</th><th>Host</th><th>Port</th><th>Rule</th><th>Evidence</th><th>Count</th><th>Files</th></tr>\n"
+            + "\n".join(rows) + "\n</table></body></html>")
+
+FORMATTERS = {"text": format_text, "json": format_json, "html": format_html}
+
+def run_report_dir(directory, rules, report_format="text", output_file="", workers=0):
+    """
+    Build the consolidated report for directory and print it or write it to
+    output_file. Returns the process exit code.
+    """
+    if not os.path.isdir(directory):
+        print(colored(f"No such directory: {directory}", "red"))
+        return 1
+    started = time.time()
+    findings, parsed, skipped, errors = consolidate(directory, rules, workers)
+    text = FORMATTERS[report_format](findings, directory, parsed)
+    if output_file:
+        with open(output_file, 'w') as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+    # Notes go to stderr, so the report itself can be piped
+    for path, error in errors:
+        print(colored(f"{path} is incomplete, parsed up to: {error}", "yellow"), file=sys.stderr)
+    print(colored(f"{len(findings)} findings from {parsed} files ({skipped} not nmap output) in {time.time() - started:.1f}s", "cyan"),
+          file=sys.stderr)
+    return 0
@@ -0,0 +1,254 @@
+import os
+import signal
+import tempfile
+import time
+import threading
+import xml.etree.ElementTree as ET
+
+from results import HostParser, ScanOutput
+from stats import StatsParser, PROGRESS_REGEX, ETA_REGEX
+from timing import profiler
+
+# In this file: the asyncio engine that drives nmap processes and streams their output
+
+# nmap script output can produce very long lines, asyncio's default limit is 64KB
+LINE_LIMIT = 16 * 1024 * 1024
+
+# Seconds between checks of the cancel flag while nmap is quiet
+POLL_INTERVAL = 1.0
+
+# Seconds nmap gets to exit after SIGTERM before its process group is killed
+TERMINATE_GRACE = 5.0
+
+# asyncio is the slowest import of mymap's startup, it is only imported once a scan runs
+
+def run(coroutine):
+    # asyncio.run for the synchronous callers of the engine
+    import asyncio
+    return asyncio.run(coroutine)
+
+class ScanCancelled(Exception):
+    # output is what the scan printed before it was stopped (a ScanOutput), if anything
+    def __init__(self, output=None):
+        super().__init__()
+        self.output = output
+
+class ScanControl:
+    """
+    How a running scan talks to whoever started it: handlers that receive
+    every engine event, a cancel flag that can be set from any thread, and
+    whether progress should be printed to the terminal.
+    """
+    def __init__(self, on_event=None, quiet=False):
+        self.handlers = [on_event] if on_event else []
+        self.cancel = threading.Event()
+        self.reason = ""
+        self.quiet = quiet
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def emit(self, kind, value):
+        for handler in self.handlers:
+            handler(kind, value)
+
+    def stop(self, reason):
+        # Set the cancel flag saying why ("time limit", "stalled"...), the first reason given is kept
+        if not self.cancel.is_set():
+            self.reason = reason
+            self.cancel.set()
+
+def with_stats(args_list):
+    # Add --stats-every 5s to get periodic progress
+    if "--stats-every" not in args_list:
+        return list(args_list) + ["--stats-every", "5s"]
+    return list(args_list)
+
+def wants_xml(args_list):
+    # nmap only takes one XML output, leave it alone if the user asked for their own
+    return not any(arg in ("-oX", "-oA") for arg in args_list)
+
+class XmlTail:
+    # Follow an -oX file while nmap is still writing it and parse hosts out as they finish
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.parser = HostParser()
+
+    def read_hosts(self):
+        if self.parser is None:
+            return []
+        try:
+            if self.file is None:
+                self.file = open(self.path, 'rb')
+            return self.parser.feed(self.file.read())
+        except (OSError, ET.ParseError):
+            # Unreadable or broken XML only costs us the structured results, not the scan
+            self.parser = None
+            return []
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+async def watch_cancel(process, cancel):
+    # Stops nmap once the cancel flag is set, its output then ends and the reading loop sees EOF
+    import asyncio
+    while process.returncode is None:
+        if cancel.is_set():
+            await stop_process(process)
+            return
+        await asyncio.sleep(POLL_INTERVAL)
+
+async def stop_watching(watcher):
+    import asyncio
+    if watcher is None:
+        return
+    watcher.cancel()
+    try:
+        await watcher
+    except asyncio.CancelledError:
+        pass
+
+async def stop_process(process):
+    # SIGTERM to nmap's process group so it can flush its output files, SIGKILL for whatever is left after TERMINATE_GRACE
+    import asyncio
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        await asyncio.wait_for(process.wait(), TERMINATE_GRACE)
+    except (ProcessLookupError, asyncio.TimeoutError):
+        pass
+    # Also anything nmap started that outlived it
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    await process.wait()
+
+async def stream_nmap(args_list, parse_xml=True, cancel=None):
+    """
+    Run nmap with the given arguments and yield events as they happen:
+    ("line", text) for every output line, ("stats", ScanStats) whenever
+    nmap reports on its phase, hosts, timeouts or dropped probes,
+    ("progress", percent) whenever the reported percentage goes up,
+    ("eta", "h:mm:ss") when nmap estimates the time remaining, ("host", Host) as soon as a host is finished in the -oX
+    output and finally ("exit", return code). Setting the cancel event
+    (a threading.Event) stops nmap and raises ScanCancelled.
+    nmap runs in a process group of its own, away from the terminal: Ctrl-C
+    reaches mymap only, which decides how the scan stops.
+    """
+    import asyncio
+    if cancel is not None and cancel.is_set():
+        raise ScanCancelled()
+    args = with_stats(args_list)
+    xml_tail = None
+    if parse_xml and wants_xml(args):
+        fd, xml_file = tempfile.mkstemp(prefix="mymap-", suffix=".xml")
+        os.close(fd)
+        args += ["-oX", xml_file]
+        xml_tail = XmlTail(xml_file)
+
+    process = await asyncio.create_subprocess_exec(
+        "nmap", *args, stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, limit=LINE_LIMIT, start_new_session=True)
+    last_percentage = 0
+    stats = StatsParser()
+    # Lines are read straight from the pipe, a separate task looks at the cancel flag while nmap is quiet
+    watcher = asyncio.ensure_future(watch_cancel(process, cancel)) if cancel is not None else None
+    try:
+        while True:
+            raw = await process.stdout.readline()
+            if cancel is not None and cancel.is_set():
+                raise ScanCancelled()
+            if not raw:
+                break
+            line = raw.decode(errors="replace")
+            yield ("line", line)
+
+            # A new host report or stats line means earlier hosts are in the XML by now
+            if xml_tail and line.startswith(("Nmap scan report", "Stats:")):
+                for host in xml_tail.read_hosts():
+                    yield ("host", host)
+
+            if stats.feed(line):
+                yield ("stats", stats.stats.copy())
+
+            match = PROGRESS_REGEX.search(line)
+            if match:
+                percent_val = float(match.group(1))
+                # Only report if percent increased
+                if percent_val > last_percentage:
+                    last_percentage = percent_val
+                    yield ("progress", percent_val)
+                eta = ETA_REGEX.search(line)
+                if eta:
+                    yield ("eta", eta.group(1))
+
+        retcode = await process.wait()
+        if xml_tail:
+            for host in xml_tail.read_hosts():
+                yield ("host", host)
+        yield ("exit", retcode)
+    finally:
+        # The consumer stopped early or was cancelled, don't leave nmap behind
+        await stop_watching(watcher)
+        if process.returncode is None:
+            await stop_process(process)
+        if xml_tail:
+            xml_tail.close()
+
+async def collect(args_list, on_event=None, cancel=None):
+    # Drain a scan into a spooled ScanOutput, passing every event to on_event
+    output = ScanOutput()
+    retcode = None
+    # With --profile, the time mymap spends on each event is added up
+    profiling = profiler.enabled
+    handling = 0.0
+    events = 0
+    try:
+        async for kind, value in stream_nmap(args_list, cancel=cancel):
+            if profiling:
+                started = time.perf_counter()
+            if kind == "line":
+                output.write(value)
+            elif kind == "host":
+                output.hosts.append(value)
+            elif kind == "exit":
+                retcode = value
+            if on_event:
+                on_event(kind, value)
+            if profiling:
+                handling += time.perf_counter() - started
+                events += 1
+    except ScanCancelled:
+        # What nmap printed until it was stopped goes with the exception
+        raise ScanCancelled(output) from None
+    finally:
+        # Finished outputs can wait to be merged without holding a file descriptor each
+        output.release()
+    if profiling:
+        profiler.add("engine: event handling", handling, events)
+    return retcode, output
+
+async def run_many(jobs, limit, on_event=None, cancel=None):
+    """
+    Run a list of argument lists with at most `limit` nmap processes at once.
+    on_event(index, kind, value) is called for every event of every job.
+    Returns a list of (return code, ScanOutput) in the order of `jobs`. When
+    the cancel flag stops them, every job gives (None, its output so far)
+    and the caller decides what to make of the pieces.
+    """
+    import asyncio
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run_one(index, args_list):
+        async with semaphore:
+            handler = (lambda kind, value: on_event(index, kind, value)) if on_event else None
+            try:
+                return await collect(args_list, handler, cancel)
+            except ScanCancelled as e:
+                return None, e.output or ScanOutput()
+
+    return await asyncio.gather(*(run_one(i, args) for i, args in enumerate(jobs)))
@@ -3,89 +3,108 @@ from collections import defaultdict
 from termcolor import colored
 import re
 
+from catalog import get_catalog
+from targets import check_targets
+
 # In this file: functions that get stuff and return it without needing other functions
 
+def parse_port(port):
+    # Turn a port answer into nmap options: "" default, "all" every port, or a list; None if invalid
+    if port.lower() == "":
+        return ""
+    elif port.lower() == "all":
+        return "-p-"
+    #input validation, only allow numbers and commas
+    elif re.match(r'^[0-9,]+$', port):
+        return "-p " + port
+    return None
+
+def parse_selection(choice, count):
+    # Menu numbers from "3", "1,3,5-8" or "all"; None if anything is out of range or malformed
+    choice = choice.strip().lower()
+    if choice == "all":
+        return list(range(1, count + 1))
+    if not re.match(r'^\d+(-\d+)?(,\d+(-\d+)?)*$', choice.replace(" ", "")):
+        return None
+    selected = []
+    for part in choice.replace(" ", "").split(","):
+        first, _, last = part.partition("-")
+        low, high = int(first), int(last or first)
+        if low < 1 or high > count or low > high:
+            return None
+        selected.extend(range(low, high + 1))
+    return list(dict.fromkeys(selected))
+
+def split_script_args(text):
+    # Split nmap --script-args on top level commas, commas inside {} or quotes belong to the value
+    parts, current, depth, quote = [], "", 0, ""
+    for char in text:
+        if quote:
+            quote = "" if char == quote else quote
+        elif char in "'\"":
+            quote = char
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        current += char
+    parts.append(current.strip())
+    return [part for part in parts if part]
+
+def merge_script_args(*texts):
+    # One --script-args value from several, a later value for the same name wins
+    merged = {}
+    for text in texts:
+        for part in split_script_args(text or ""):
+            name = part.split("=", 1)[0].strip()
+            merged[name] = part
+    return ",".join(merged.values())
+
+def get_script_args(arg_names):
+    # Ask once for the arguments of every chosen script
+    if not arg_names:
+        return ""
+    print(colored(f"\nScript args: {', '.join(arg_names)}", "yellow"))
+    return merge_script_args(input(colored("Enter script args as name=value, comma separated (leave blank for none):\n-> ", "yellow")))
+
 def get_target():
-    #get target ip/file
+    #get target ip/range/hostname or file
     while True:
-        target = input(colored("\nEnter an IP address or file:\n-> ", "yellow"))
+        print(colored("\nEnter targets or a file, e.g. '10.0.0.1', '10.0.0.0/24 !10.0.0.5', '10.0.1-3.1-254', 'host.example.com'", "yellow"))
+        target = input(colored("-> ", "yellow")).strip()
 
-        #if it is an IP address
-        if re.match(r'^((\d{1,2}|1\d{2}|2[0-4]\d|25[0-5])\.){3}(\d{1,2}|1\d{2}|2[0-4]\d|25[0-5])$', target):  
-            print(colored("\nValid IP address entered.", "green"))
-            break  
-        else:
-            #if it is not an IP check if it is a file which exists
-            if os.path.isfile(target) == False:
-                print((colored("\nNo valid IP address or file found.", "red")))
-            else:
-                print(colored("\nFile located.", "green"))
-                break
+        #a file which exists, checked line by line when the scan starts
+        if os.path.isfile(target):
+            print(colored("\nFile located.", "green"))
+            break
+        error = check_targets(target) if target else "nothing entered"
+        if error is None:
+            print(colored("\nValid targets entered.", "green"))
+            break
+        print(colored(f"\nNo valid targets or file found: {error}.", "red"))
     return target
 
 
+def scripts_dir_error(error):
+    # What to tell the user when the scripts directory cannot be read
+    if isinstance(error, PermissionError):
+        return "You do not have the necessary permissions to read the directory."
+    if isinstance(error, FileNotFoundError):
+        return "The directory does not exist."
+    return f"Could not read the scripts directory: {error}"
+
 def get_scripts():
-    # Directory where Nmap scripts are stored
-    scripts_dir = "/usr/share/nmap/scripts/"
+    # Scripts by menu category, from the cached script catalog
     try:
-        # Get a list of all scripts in the directory
-        scripts = os.listdir(scripts_dir)
-    except FileNotFoundError:
-        print("The directory does not exist.")
-        return defaultdict(list)
-    except PermissionError:
-        print("You do not have the necessary permissions to read the directory.")
+        return get_catalog().menu()
+    except (FileNotFoundError, PermissionError) as e:
+        print(scripts_dir_error(e))
         return defaultdict(list)
 
-    # Create a dictionary to categorize scripts
-    categorized_scripts = defaultdict(list)
-    for script in scripts:
-        # Use the prefix of the script name as the category
-        category = script.split("-")[0]
-        categorized_scripts[category].append(script)
-    
-    # Sort categories and scripts within each category
-    for category in categorized_scripts:
-        categorized_scripts[category] = sorted(categorized_scripts[category])
-    
-    # Add SSL, SMB, SSH, RDP, DATABASE, VULN, BRUTE, FTP, MAINFRAME and RPC sub-menus
-    categorized_scripts["SSL"] = []
-    categorized_scripts["SMB"] = []
-    categorized_scripts["SSH"] = []
-    categorized_scripts["RDP"] = []
-    categorized_scripts["DATABASE"] = []
-    categorized_scripts["VULN"] = []
-    categorized_scripts["BRUTE"] = []
-    categorized_scripts["FTP"] = []
-    categorized_scripts["RPC"] = []
-    categorized_scripts["MAINFRAME"] = []
-
-    # Populate the sub-menus with the appropriate scripts
-    for script in scripts:
-        if script.startswith("ssl"):
-            categorized_scripts["SSL"].append(script)
-        elif script.startswith("smb"):
-            categorized_scripts["SMB"].append(script)
-        elif script.startswith("ssh"):
-            categorized_scripts["SSH"].append(script)
-        elif script.startswith("rdp"):
-            categorized_scripts["RDP"].append(script)
-        elif script.startswith(("tn3270","nwg-tn3270", "cics","nwg-cics","tso","nwg-tso", "vtam","nwg-vtam", "lu","nwg-lu", "db2", "nwg-db2","ims","nwg-ims")):
-            categorized_scripts["MAINFRAME"].append(script)
-        elif script.startswith(("oracle", "mysql", "mssql", "ms-sql", "pgsql", "db2")):    
-                    categorized_scripts["DATABASE"].append(script)
-        elif "vuln" in script:
-            categorized_scripts["VULN"].append(script)
-        elif "brute" in script:
-            categorized_scripts["BRUTE"].append(script)
-        elif "ftp" in script:
-            categorized_scripts["FTP"].append(script)
-        elif "rpc" in script:
-            categorized_scripts["RPC"].append(script)
-
-    # Return the categorized scripts as a sorted dictionary
-    return dict(sorted(categorized_scripts.items()))
-
 def get_port():
     # Ask the user for the port to scan
     while True:
@@ -93,19 +112,9 @@ def get_port():
         print(colored("- leave blank for default", "yellow"))
         print(colored("- 'all' for all ports", "yellow"))
         print(colored("- single port/list e.g. '8080' or '8080,443,25'", "yellow"))
-        port = input(colored("-> ", "yellow"))
-
-        if port.lower() == "":
-            port = ""
-            break
-        elif port.lower() == "all":
-            port = "-p-"
-            break
+        port = parse_port(input(colored("-> ", "yellow")))
+        if port is None:
+            print(colored("\nInvalid port option", "red"))
         else:
-            #input validation, only allow numbers and commas
-            if not re.match(r'^[0-9,]+$', port):
-                print(colored("\nInvalid port option", "red"))
-            else:
-                port = "-p " + port
-                break
+            break
     return port
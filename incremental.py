@@ -0,0 +1,140 @@
+import os
+import time
+import tempfile
+
+from termcolor import colored
+
+from results import ScanOutput
+from store import get_store
+from targets import TargetSet, load_targets
+from outputs import open_output
+
+# In this file: incremental re-scans that reuse fresh results from the results store
+
+# Bigger target sets are scanned in full, looking every host up would cost more than it saves
+MAX_INCREMENTAL_TARGETS = 65536
+
+def scan_key(args_list):
+    # Everything that decides what a scan does except the targets and outputs:
+    # port spec, scripts, script args and other flags
+    return " ".join(args_list)
+
+def format_host(host, scanned=None):
+    # nmap style text for a host result we did not scan this time
+    when = f" (cached from {time.strftime('%Y-%m-%d %H:%M', time.localtime(scanned))})" if scanned else ""
+    name = f"{host.hostname} ({host.address})" if host.hostname else host.address
+    lines = [f"Nmap scan report for {name}{when}"]
+    if host.status:
+        lines.append(f"Host is {host.status}.")
+    if host.ports:
+        lines.append("PORT      STATE  SERVICE")
+    for port in host.ports:
+        lines.append(f"{port.portid}/{port.protocol: <5} {port.state: <6} {port.service}")
+        for script in port.scripts:
+            lines.append(f"| {script.id}: {script.output.strip()}")
+    if host.scripts:
+        lines.append("Host script results:")
+        for script in host.scripts:
+            lines.append(f"| {script.id}: {script.output.strip()}")
+    return "\n".join(lines) + "\n"
+
+def first_line(text):
+    lines = text.strip().splitlines()
+    return lines[0] if lines else ""
+
+def port_results(host):
+    # {(port, protocol): (state, {script id: output})} with host scripts under port 0
+    results = {(0, "host"): ("", {script.id: script.output for script in host.scripts})}
+    for port in host.ports:
+        results[(port.portid, port.protocol)] = (port.state, {script.id: script.output for script in port.scripts})
+    return results
+
+def diff_hosts(previous, current):
+    """
+    Compare the previous results of each host against this run.
+    previous and current are {address: Host}; returns a list of change lines.
+    """
+    changes = []
+    for address, host in current.items():
+        if address not in previous:
+            changes.append(f"{address}: new host ({host.status or 'no status'})")
+            continue
+        before = previous[address]
+        if before.status != host.status:
+            changes.append(f"{address}: host was {before.status or 'unknown'}, now {host.status or 'unknown'}")
+        old_ports = port_results(before)
+        new_ports = port_results(host)
+        for key in sorted(set(old_ports) | set(new_ports)):
+            where = "host script" if key[0] == 0 else f"{key[0]}/{key[1]}"
+            old_state, old_scripts = old_ports.get(key, ("", {}))
+            new_state, new_scripts = new_ports.get(key, ("", {}))
+            if key[0] != 0 and old_state != new_state:
+                changes.append(f"{address}: {where} was {old_state or 'not seen'}, now {new_state or 'not seen'}")
+            for script in sorted(set(old_scripts) | set(new_scripts)):
+                if script not in new_scripts:
+                    changes.append(f"{address}: {where} {script} no longer reports anything")
+                elif script not in old_scripts:
+                    changes.append(f"{address}: {where} {script} new result: {first_line(new_scripts[script])}")
+                elif old_scripts[script] != new_scripts[script]:
+                    changes.append(f"{address}: {where} {script} output changed")
+    return changes
+
+def run_incremental(scan, args_list, target, output_file, ttl_minutes):
+    """
+    Only scan the targets without a result younger than ttl_minutes for the
+    same scan key. scan(target) runs nmap on a target or target file and
+    returns its ScanOutput. Cached hosts are added to the output, followed by
+    the changes since each host's previous result.
+    """
+    target_set = load_targets(target)
+    if target_set.count() > MAX_INCREMENTAL_TARGETS:
+        print(colored(f"Incremental scan: more than {MAX_INCREMENTAL_TARGETS} targets, scanning them all", "cyan"))
+        return scan(target)
+    targets = list(target_set)
+    key = scan_key(args_list)
+    previous = get_store().latest_hosts(key, targets)
+
+    cutoff = time.time() - ttl_minutes * 60
+    fresh = {}
+    for address, (host, scanned) in previous.items():
+        if scanned >= cutoff:
+            fresh[address] = (host, scanned)
+            if host.hostname:
+                fresh[host.hostname] = (host, scanned)
+    stale = [t for t in targets if t not in fresh]
+    cached = list({host.address: (host, scanned) for host, scanned in (fresh[t] for t in targets if t in fresh)}.values())
+
+    print(colored(f"Incremental scan: {len(stale)} targets to scan, {len(cached)} with results from the last {ttl_minutes} minutes", "cyan"))
+    if stale:
+        if len(stale) == 1:
+            output = scan(stale[0])
+        else:
+            fd, stale_file = tempfile.mkstemp(prefix="mymap-", suffix=".targets")
+            os.close(fd)
+            TargetSet(stale).write(stale_file)
+            try:
+                output = scan(stale_file)
+            finally:
+                os.remove(stale_file)
+        if output is None:
+            return None
+    else:
+        output = ScanOutput()
+
+    extra = []
+    if cached:
+        extra.append(f"\nCached results (scanned within the last {ttl_minutes} minutes):\n")
+        extra.extend(format_host(host, scanned) + "\n" for host, scanned in cached)
+    changes = diff_hosts({address: host for address, (host, _) in previous.items()},
+                         {host.address: host for host in output.hosts})
+    extra.append("\nChanges since the previous run:\n")
+    extra.append("\n".join(changes) + "\n" if changes else "No changes.\n")
+
+    # Scanned hosts were already written by nmap, the rest goes after them
+    text = "".join(extra)
+    output.write(text)
+    output.hosts.extend(host for host, _ in cached)
+    if output_file:
+        with open_output(output_file, append=True) as f:
+            f.write(text)
+    return output
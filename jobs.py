@@ -0,0 +1,187 @@
+import sys
+import time
+import threading
+from collections import deque
+
+from termcolor import colored
+
+from engine import ScanControl
+
+# In this file: background scan jobs for the interactive menu
+
+DEFAULT_RUNNING = 2
+
+class JobOutput:
+    """
+    Stands in for sys.stdout while background jobs exist. What a job thread
+    prints is held back as whole lines tagged with the job's number, and
+    shown by show_messages() before the next prompt instead of in the middle
+    of whatever the user is typing. Everything else goes straight through.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.messages = deque()
+
+    def write(self, text):
+        job = getattr(self.local, "job", None)
+        if job is None:
+            return self.stream.write(text)
+        pending = getattr(self.local, "pending", "") + text
+        *lines, self.local.pending = pending.split("\n")
+        for line in lines:
+            # Progress bars redraw with \r, only the last state of a line counts
+            line = line.rsplit("\r", 1)[-1]
+            if line.strip():
+                self.messages.append(f"[job {job.number}] {line}")
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def start(self, job):
+        self.local.job = job
+        self.local.pending = ""
+
+    def end(self):
+        if self.local.pending.strip():
+            self.write("\n")
+        self.local.job = None
+
+class Job:
+    """
+    One scan running (or queued) in the background. scan(control) runs the
+    scan and returns its output; progress and ETA come from the engine events.
+    """
+    def __init__(self, number, description, target, output_file, scan):
+        self.number = number
+        self.description = description
+        self.target = target
+        self.output_file = output_file
+        self.scan = scan
+        self.control = ScanControl(self.on_event, quiet=True)
+        self.status = "queued"
+        self.progress = 0.0
+        self.eta = ""
+        self.phase = ""
+        self.hosts_done = 0
+        self.started = None
+        self.finished = None
+        self.output = None
+        self.error = ""
+
+    def on_event(self, kind, value):
+        if kind == "progress":
+            self.progress = value
+        elif kind == "eta":
+            self.eta = value
+        elif kind == "stats":
+            self.phase = value.phase
+        elif kind == "host":
+            self.hosts_done += 1
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def finished_ok(self):
+        # Done, or stopped part way with the output so far
+        return self.status in ("done", "stopped") and self.output is not None
+
+    def cancel(self):
+        self.control.stop("cancelled")
+        if self.status == "queued":
+            self.status = "cancelled"
+
+    def run(self, output=None):
+        if output:
+            output.start(self)
+        try:
+            self.run_scan()
+        finally:
+            if output:
+                output.end()
+                output.messages.append(colored(f"Background job {self.number} {self.status}: {self.description}",
+                                               {"done": "green", "failed": "red"}.get(self.status, "yellow")))
+
+    def run_scan(self):
+        if self.control.cancel.is_set():
+            self.status = "cancelled"
+            return
+        self.status = "running"
+        self.started = time.time()
+        try:
+            self.output = self.scan(self.control)
+            if self.output is not None and self.output.stopped:
+                self.status = "stopped"
+                self.error = self.output.stopped
+            elif self.output is not None:
+                self.status = "done"
+                self.progress = 100.0
+            elif self.control.cancel.is_set():
+                self.status = "cancelled"
+            else:
+                self.status = "failed"
+        except Exception as e:
+            # Keep the menu alive whatever happens inside a job
+            self.status = "failed"
+            self.error = str(e)
+        self.finished = time.time()
+
+class JobManager:
+    # Runs submitted jobs on a small thread pool, the rest wait in the queue
+    def __init__(self, max_running=DEFAULT_RUNNING):
+        # Imported here, concurrent.futures costs more startup time than the rest of this module
+        from concurrent.futures import ThreadPoolExecutor
+        self.pool = ThreadPoolExecutor(max_workers=max(1, max_running))
+        self.jobs = []
+        self.output = JobOutput(sys.stdout)
+        sys.stdout = self.output
+
+    def submit(self, description, target, output_file, scan):
+        job = Job(len(self.jobs) + 1, description, target, output_file, scan)
+        self.jobs.append(job)
+        self.pool.submit(job.run, self.output)
+        return job
+
+    def show_messages(self):
+        # What the jobs printed since the last prompt
+        while self.output.messages:
+            print(self.output.messages.popleft())
+
+    def get(self, number):
+        if 1 <= number <= len(self.jobs):
+            return self.jobs[number-1]
+        return None
+
+    def running(self):
+        return [job for job in self.jobs if job.status in ("queued", "running")]
+
+    def cancel_all(self):
+        # Returns once the running jobs have stopped their nmap processes
+        for job in self.running():
+            job.cancel()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.show_messages()
+
+_manager = None
+
+def get_jobs(max_running=DEFAULT_RUNNING):
+    global _manager
+    if _manager is None:
+        _manager = JobManager(max_running or DEFAULT_RUNNING)
+    return _manager
+
+def show_job_messages():
+    # Called before each menu prompt, does nothing until a background job was started
+    if _manager is not None:
+        _manager.show_messages()
+
+def cancel_jobs():
+    # Stop every background job before mymap exits, if any were started
+    if _manager is not None:
+        _manager.cancel_all()
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import threading
+
+from stats import DONE_REGEX
+
+# In this file: the metrics file - scan progress for dashboards, as JSON lines or a Prometheus textfile
+
+# Seconds between writes while a scan is running, starting and finishing always write
+WRITE_INTERVAL = 5
+
+class ScanMetrics:
+    """
+    Live numbers for one scan, fed by engine events: progress, phase, ETA,
+    hosts up and down, output lines and when the scan last got anywhere.
+    nmap keeps printing stats while it is stuck, so a stalled scan shows up
+    as a growing seconds_since_progress rather than as silence.
+    """
+    def __init__(self, number, description, metrics_file):
+        self.number = number
+        self.description = description
+        self.metrics_file = metrics_file
+        self.status = "running"
+        self.phase = ""
+        self.progress = 0.0
+        self.eta = ""
+        self.hosts_up = 0
+        self.hosts_down = 0
+        # nmap only reports the hosts that are up, the down ones are counted from its stats and summary lines
+        self.down_events = 0
+        self.down_stats = 0
+        self.down_done = 0
+        self.lines = 0
+        self.started = time.time()
+        self.last_progress = self.started
+        self.finished = None
+        self.last_write = 0
+
+    def on_event(self, kind, value):
+        if kind == "line":
+            self.lines += 1
+            match = DONE_REGEX.match(value)
+            if match:
+                # One summary per nmap process, so the shards of a scan add up
+                self.down_done += int(match.group(1)) - int(match.group(2))
+        elif kind == "progress":
+            self.progress = value
+            self.last_progress = time.time()
+        elif kind == "eta":
+            self.eta = value
+        elif kind == "stats":
+            self.phase = value.phase
+            self.down_stats = max(self.down_stats, value.hosts_completed - value.hosts_up)
+        elif kind == "host":
+            self.last_progress = time.time()
+            if value.status == "up":
+                self.hosts_up += 1
+            else:
+                self.down_events += 1
+        # The sources overlap (a down host can be in all three), the largest count is the closest
+        self.hosts_down = max(self.down_events, self.down_stats, self.down_done)
+        self.metrics_file.update(self)
+
+    def finish(self, status):
+        self.status = status
+        self.finished = time.time()
+        if status == "done":
+            self.progress = 100.0
+        self.metrics_file.update(self, force=True)
+
+    def snapshot(self):
+        now = self.finished or time.time()
+        wall = now - self.started
+        return {"time": time.time(), "scan": self.number, "description": self.description,
+                "status": self.status, "phase": self.phase, "progress": self.progress, "eta": self.eta,
+                "hosts_up": self.hosts_up, "hosts_down": self.hosts_down, "lines": self.lines,
+                "lines_per_second": round(self.lines / wall, 2) if wall > 0 else 0.0,
+                "wall_seconds": round(wall, 2), "seconds_since_progress": round(now - self.last_progress, 2)}
+
+def label(value):
+    # Prometheus label values escape backslashes, quotes and newlines
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# (metric name, snapshot key, help text) of every number in the Prometheus file
+PROMETHEUS_METRICS = [
+    ("mymap_scan_progress_percent", "progress", "Percent done reported by nmap"),
+    ("mymap_scan_hosts_up", "hosts_up", "Hosts reported up so far"),
+    ("mymap_scan_hosts_down", "hosts_down", "Hosts reported down so far"),
+    ("mymap_scan_output_lines", "lines", "Lines of nmap output so far"),
+    ("mymap_scan_lines_per_second", "lines_per_second", "Average nmap output lines per second"),
+    ("mymap_scan_wall_seconds", "wall_seconds", "Seconds since the scan started"),
+    ("mymap_scan_seconds_since_progress", "seconds_since_progress", "Seconds since the percentage went up or a host finished"),
+    ("mymap_scan_updated_timestamp_seconds", "time", "When this scan was last written, it stops moving if mymap hangs"),
+]
+
+class MetricsFile:
+    """
+    Where every scan of this process reports to. A path ending in .prom is
+    rewritten as a whole in the Prometheus textfile collector format,
+    anything else gets one JSON line per update appended.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.prometheus = path.endswith(".prom")
+        self.lock = threading.Lock()
+        self.scans = []
+
+    def track(self, description):
+        with self.lock:
+            scan = ScanMetrics(len(self.scans) + 1, description, self)
+            self.scans.append(scan)
+        self.update(scan, force=True)
+        return scan
+
+    def update(self, scan, force=False):
+        now = time.time()
+        if not force and now - scan.last_write < WRITE_INTERVAL:
+            return
+        scan.last_write = now
+        with self.lock:
+            try:
+                if self.prometheus:
+                    self.write_prometheus()
+                else:
+                    with open(self.path, 'a') as f:
+                        f.write(json.dumps(scan.snapshot()) + "\n")
+            except OSError:
+                # Metrics must never break a scan
+                pass
+
+    def write_prometheus(self):
+        snapshots = [scan.snapshot() for scan in self.scans]
+        lines = []
+        for name, key, help_text in PROMETHEUS_METRICS:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for snapshot in snapshots:
+                labels = f'scan="{snapshot["scan"]}",description="{label(snapshot["description"])}"'
+                lines.append(f"{name}{{{labels}}} {snapshot[key]}")
+        lines.append("# HELP mymap_scan_info Status, phase and ETA of the scan")
+        lines.append("# TYPE mymap_scan_info gauge")
+        for snapshot in snapshots:
+            labels = (f'scan="{snapshot["scan"]}",description="{label(snapshot["description"])}",'
+                      f'status="{snapshot["status"]}",phase="{label(snapshot["phase"])}",eta="{snapshot["eta"]}"')
+            lines.append(f"mymap_scan_info{{{labels}}} 1")
+        # The collector must never see a half written file
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.path)
+
+_metrics = {}
+
+def get_metrics(path):
+    # One MetricsFile per path, shared by every scan and background job
+    if path not in _metrics:
+        _metrics[path] = MetricsFile(path)
+    return _metrics[path]
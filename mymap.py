@@ -1,93 +1,297 @@
 #!/usr/bin/python
 
 import os
-import subprocess
 import time
-import re
+import tempfile
 import json
+import sqlite3
+import signal
+import sys
+import argparse
 
-from tqdm import tqdm
 from termcolor import colored
 
-from getters import get_scripts, get_port, get_target
-from printers import print_menu, print_sub_menu, generate_report, view_output, print_script_description
+from getters import get_scripts, scripts_dir_error, get_port, get_target, get_script_args, parse_selection
+from printers import print_menu, print_sub_menu, generate_report, view_output, print_script_description, print_progress, print_results, print_jobs
+from engine import run, collect, wants_xml, ScanControl, ScanCancelled
+from shards import run_sharded
+from catalog import SCRIPTS_DIR, get_catalog
+from searchindex import get_index
+from rules import load_matcher
+from store import get_store
+from incremental import run_incremental, scan_key
+from targets import load_targets, is_address
+from pipeline import run_pipeline
+from adaptive import AdaptiveTiming
+from metrics import get_metrics
+from timing import profiler, span
+from consolidate import run_report_dir, REPORT_FORMATS
+from outputs import compression, check_output, open_output, set_rotation, SavedOutput
+from configstore import open_config, get_config
+from checkpoint import Checkpoint
+from budget import ScanBudget, with_host_timeout, stop_on_interrupt
+from batch import run_batch, run_job, JOB_OK
+from jobs import get_jobs, cancel_jobs, show_job_messages
+
+# Settings that take any text, blank to turn them off
+TEXT_SETTINGS = ["metrics_file", "cluster_token"]
+
+# Settings that take any whole number instead of a 1/0 toggle
+NUMERIC_SETTINGS = ["shard_workers", "shard_count", "incremental_ttl", "background_jobs", "pipeline_min_rate", "output_rotate_mb",
+                    "scan_time_limit", "host_timeout", "stall_timeout"]
 
 def load_config(config_path='config.json'):
+    # A missing file starts empty and is created on the first save, a broken one is never saved over
     if not os.path.isfile(config_path):
         print(colored(f"Config file {config_path} not found.", "red"))
-        return {}
     try:
-        with open(config_path, 'r') as config_file:
-            return json.load(config_file)
+        return open_config(config_path).data
     except json.JSONDecodeError:
         print(colored(f"Error decoding JSON from {config_path}.", "red"))
         return {}
 
+def reload_config():
+    # Pick up what other mymap sessions changed in the config file
+    store = get_config()
+    if store and store.refresh():
+        set_rotation(read_config(store.data, 'output_rotate_mb'))
+        print(colored("\nThe config file was changed by another session, reloaded.", "yellow"))
+
+def save_config(change):
+    # change(store) makes one change through the config store, False if it could not be saved
+    store = get_config()
+    if store is None:
+        print(colored("The config file could not be read at startup, changes are not saved.", "red"))
+        return False
+    try:
+        change(store)
+    except (OSError, ValueError) as e:
+        print(colored(f"Could not save the config file: {e}", "red"))
+        return False
+    return True
+
 def read_config(config_data, option):
     return config_data.get("configuration", {}).get(option, 0)
 
-def run_nmap_with_progress(args_list):
+def run_nmap_with_progress(args_list, label="", control=None):
     """
     Run nmap with given arguments plus --stats-every for progress.
-    Capture output line by line, display progress when found.
-    Return full output at the end.
+    Synchronous wrapper around the asyncio engine: display progress when found
+    and return full output at the end. control (a ScanControl) sees every
+    event and can cancel the scan, which raises ScanCancelled with the output
+    so far. If nmap fails after finishing some hosts, their output is
+    returned with output.stopped saying so.
     """
-    # Add --stats-every 5s to get periodic progress
-    if "--stats-every" not in args_list:
-        args_list += ["--stats-every", "5s"]
-
-    cmd = ["nmap"] + args_list
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    full_output = []
-    progress_regex = re.compile(r'About\s+(\d+(\.\d+)?)%\s+done')
-
-    last_percentage = 0
-    start_time = time.time()
-
-    while True:
-        line = process.stdout.readline()
-        if not line and process.poll() is not None:
-            break
-        if line:
-            full_output.append(line)
-            # Check for progress line
-            match = progress_regex.search(line)
-            if match:
-                percent = match.group(1)
-                try:
-                    percent_val = float(percent)
-                    # Only print if percent increased
-                    if percent_val > last_percentage:
-                        print(colored(f"Progress: {percent_val:.2f}% done", "cyan"))
-                        last_percentage = percent_val
-                except ValueError:
-                    pass
-
-    retcode = process.poll()
+    control = control or ScanControl()
+    seen = {"hosts": 0}
+
+    def show_progress(kind, value):
+        control.emit(kind, value)
+        if kind == "progress" and not control.quiet:
+            print_progress(value, label)
+        elif kind == "line" and value.startswith("Nmap scan report"):
+            seen["hosts"] += 1
+
+    with span("nmap"):
+        retcode, output = run(collect(args_list, show_progress, control.cancel))
     if retcode != 0:
-        print(colored(f"Error running nmap: return code {retcode}", "red"))
-        return None
-    return "".join(full_output)
-
-def run_script(script, target, port, output_file, config_data):
+        where = f" ({label})" if label else ""
+        print(colored(f"Error running nmap{where}: return code {retcode}", "red"))
+        if not seen["hosts"]:
+            output.close()
+            return None
+        output.stopped = f"nmap failed with return code {retcode}"
+    return output
+
+def target_args(target):
     if os.path.isfile(target):
-        target_option = ["-iL", target]
-        run_target = []
-    else:
-        target_option = []
-        run_target = [target]
+        return ["-iL", target]
+    return [target]
 
-    script_path = f"/usr/share/nmap/scripts/{script}"
-    if not os.path.exists(script_path):
-        print(colored(f"Script {script} not found at {script_path}", "red"))
+def record_scan(output, command, started, output_file, config_data, scan_key=None):
+    # Keep the parsed results of every run in the local results store, a stopped one with the hosts it finished
+    if not output or read_config(config_data, 'store_results') != 1:
+        return
+    try:
+        with span("results store"):
+            get_store().record(command, started, time.time() - started, 1 if output.stopped else 0, output_file, output.hosts, scan_key)
+    except (sqlite3.Error, OSError) as e:
+        print(colored(f"Could not save results to the results store: {e}", "red"))
+
+def track_scan(command, control, config_data):
+    # Report the scan's progress to the metrics file, when one is configured
+    metrics_file = read_config(config_data, 'metrics_file')
+    if not metrics_file:
+        return None
+    metrics = get_metrics(os.path.expanduser(metrics_file)).track(command)
+    control.add_handler(metrics.on_event)
+    return metrics
+
+def finish_tracking(metrics, output, control):
+    if metrics:
+        if output is not None:
+            metrics.finish("stopped" if output.stopped else "done")
+        else:
+            metrics.finish("cancelled" if control.cancel.is_set() else "failed")
+
+def watch_budget(control, config_data):
+    # The time limit and stall detector of one scan, from the settings in minutes
+    return ScanBudget(control, read_config(config_data, 'scan_time_limit'), read_config(config_data, 'stall_timeout'))
+
+def keep_partial(error, control, label=""):
+    # The output of a stopped scan (from ScanCancelled), marked with why it stopped, None if it had nothing yet
+    where = f" ({label})" if label else ""
+    reason = control.reason or "cancelled"
+    output = error.output
+    if not output:
+        print(colored(f"\nScan stopped{where}: {reason}.", "red"))
+        return None
+    output.stopped = reason
+    print(colored(f"\nScan stopped{where}: {reason}. The output so far is kept.", "yellow"))
+    return output
+
+def execute_scan(args_list, target, output_file, config_data, checkpoint=None, label="", control=None):
+    started = time.time()
+    control = control or ScanControl()
+    append = checkpoint is not None
+    try:
+        targets = load_targets(target)
+    except (ValueError, OSError) as e:
+        print(colored(f"Invalid targets: {e}", "red"))
+        return None
+    if not targets:
+        print(colored("No targets left to scan after exclusions.", "red"))
         return None
 
-    base_args = ["-T4", port, "--script", script_path]
-    if output_file:
-        base_args += ["-oN", output_file]
-
-    args = base_args + target_option + run_target
-    return run_nmap_with_progress(args)
+    # Scans of more than one host are checkpointed so they can be resumed after an interruption
+    if checkpoint is None and targets.count() > 1:
+        checkpoint = Checkpoint.start(args_list, targets, output_file, " ".join(["nmap"] + list(args_list)))
+    if checkpoint:
+        control.add_handler(checkpoint.on_event)
+        if not wants_xml(args_list):
+            # nmap writes a single XML output, with the user's own mymap cannot follow the finished hosts in it
+            print(colored("With your own -oX/-oA the checkpoint only sees nmap's host reports, and the results store "
+                          "gets no hosts for this scan.", "yellow"))
+    metrics = track_scan(" ".join(["nmap"] + list(args_list) + target_args(target)), control, config_data)
+    budget = watch_budget(control, config_data)
+    scan_args = with_host_timeout(args_list, read_config(config_data, 'host_timeout'))
+
+    output = None
+    target_file = None
+    writer = None
+    try:
+        # Target sets are split across several nmap processes when shard_workers > 1,
+        # or across the agents' machines when running as a coordinator
+        workers = read_config(config_data, 'shard_workers')
+        from cluster import get_coordinator
+        coordinator = get_coordinator()
+        with stop_on_interrupt([control]):
+            if coordinator:
+                output = coordinator.run(scan_args, targets, output_file, read_config(config_data, 'shard_count'), control, append, label)
+            elif workers > 1 and targets.count() > 1:
+                shard_count = read_config(config_data, 'shard_count')
+                timing = AdaptiveTiming(workers) if read_config(config_data, 'adaptive_timing') == 1 else None
+                output = run_sharded(scan_args, targets, output_file, workers, shard_count, control, append, label, timing)
+            else:
+                fd, target_file = tempfile.mkstemp(prefix="mymap-", suffix=".targets")
+                os.close(fd)
+                args = scan_args + targets.nmap_args(target_file)
+                if checkpoint and "--randomize-hosts" not in scan_args:
+                    checkpoint.follow(targets)
+                if compression(output_file):
+                    # nmap only writes plain -oN files, compressed output is written from its stdout instead
+                    writer = open_output(output_file, append)
+                    control.add_handler(writer.on_event)
+                elif output_file:
+                    args += ["-oN", output_file]
+                    if append:
+                        args += ["--append-output"]
+                output = run_nmap_with_progress(args, label, control)
+    except KeyboardInterrupt:
+        print(colored("\nScan interrupted.", "red"))
+    except ScanCancelled as e:
+        output = keep_partial(e, control, label)
+    finally:
+        budget.finish()
+        if writer:
+            writer.close()
+        if target_file and os.path.isfile(target_file):
+            os.remove(target_file)
+        if checkpoint:
+            if output is not None and not output.stopped:
+                checkpoint.finish()
+            else:
+                checkpoint.save()
+                print(colored(f"{checkpoint.remaining().count()} targets left, use 'l' at the main menu to resume.", "yellow"))
+        finish_tracking(metrics, output, control)
+
+    record_scan(output, " ".join(["nmap"] + list(args_list) + target_args(target)), started, output_file, config_data, scan_key(args_list))
+    return output
+
+def run_scan(args_list, target, output_file, config_data, label="", control=None):
+    # With incremental_ttl set, targets with fresh results in the store are not scanned again
+    ttl = read_config(config_data, 'incremental_ttl')
+    if ttl > 0 and read_config(config_data, 'store_results') == 1:
+        try:
+            return run_incremental(lambda scan_target: execute_scan(args_list, scan_target, output_file, config_data, label=label, control=control),
+                                   args_list, target, output_file, ttl)
+        except (sqlite3.Error, OSError) as e:
+            print(colored(f"Could not read the results store, running a full scan: {e}", "red"))
+    return execute_scan(args_list, target, output_file, config_data, label=label, control=control)
+
+def run_script(script, target, port, output_file, config_data, label="", control=None, script_args=""):
+    # script is one name or several comma separated ones, all run by a single nmap
+    script_paths = []
+    for name in script.split(","):
+        script_path = os.path.join(SCRIPTS_DIR, name.strip())
+        if not os.path.exists(script_path):
+            print(colored(f"Script {name} not found at {script_path}", "red"))
+            return None
+        script_paths.append(script_path)
+
+    script_opts = ["--script", ",".join(script_paths)] + (["--script-args", script_args] if script_args else [])
+    base_args = ["-T4"] + port.split() + script_opts
+    if read_config(config_data, 'pipeline_mode') == 1:
+        return run_pipeline_scan(["-T4"] + script_opts, port, target, output_file, config_data, base_args, label, control)
+    return run_scan(base_args, target, output_file, config_data, label, control)
+
+def run_pipeline_scan(script_args, port, target, output_file, config_data, base_args, label="", control=None):
+    # Discovery sweep first, then the script only against live hosts and their open ports
+    started = time.time()
+    control = control or ScanControl()
+    metrics = track_scan(" ".join(["nmap"] + base_args + target_args(target)), control, config_data)
+    budget = watch_budget(control, config_data)
+    output = None
+    try:
+        targets = load_targets(target)
+        with stop_on_interrupt([control]):
+            output = run_pipeline(script_args, port, targets, output_file, read_config(config_data, 'shard_workers'),
+                                  read_config(config_data, 'pipeline_min_rate'), control, label, read_config(config_data, 'host_timeout'))
+    except (ValueError, OSError) as e:
+        print(colored(f"Invalid targets: {e}", "red"))
+    except KeyboardInterrupt:
+        print(colored("\nScan interrupted.", "red"))
+    except ScanCancelled as e:
+        output = keep_partial(e, control, label)
+    budget.finish()
+    finish_tracking(metrics, output, control)
+
+    record_scan(output, " ".join(["nmap"] + base_args + target_args(target)), started, output_file, config_data, scan_key(base_args))
+    return output
+
+def ask_output_file():
+    # Names ending in .gz or .zst are written compressed
+    while True:
+        output_file = input(colored("\nEnter output file (leave blank for default, .gz/.zst to compress): ", "yellow")).strip()
+        if output_file == "":
+            timestr = time.strftime("%Y_%m_%d-%I_%M_%S_%p")
+            output_file = timestr + ".txt"
+            print(colored(f"\nDefault output file: {output_file}", "green"))
+            return output_file
+        error = check_output(output_file)
+        if error is None:
+            return output_file
+        print(colored(error, "red"))
 
 def get_output_file(config_data):
     output_ask = read_config(config_data, 'output_ask')
@@ -98,11 +302,7 @@ def get_output_file(config_data):
         while True:
             choice = input(colored("\nDo you want to output to file? (y/n): ", "yellow")).strip().lower()
             if choice in ["y", "yes"]:
-                output_file = input(colored("\nEnter output file (leave blank for default): ", "yellow")).strip()
-                if output_file == "":
-                    timestr = time.strftime("%Y_%m_%d-%I_%M_%S_%p")
-                    output_file = timestr + ".txt"
-                    print(colored(f"\nDefault output file: {output_file}", "green"))
+                output_file = ask_output_file()
                 break
             elif choice in ["n", "no"]:
                 output_file = ""
@@ -111,11 +311,7 @@ def get_output_file(config_data):
                 print(colored("Invalid option", "red"))
     else:
         if output_default == 1:
-            output_file = input(colored("\nEnter output file (leave blank for default): ", "yellow")).strip()
-            if output_file == "":
-                timestr = time.strftime("%Y_%m_%d-%I_%M_%S_%p")
-                output_file = timestr + ".txt"
-                print(colored(f"\nDefault output file: {output_file}", "green"))
+            output_file = ask_output_file()
         else:
             output_file = ""
 
@@ -130,7 +326,7 @@ def get_screen_output(output, config_data):
         while True:
             choice = input(colored("\nDo you want to view the output? (y/n): ", "yellow")).strip().lower()
             if choice in ["y", "yes"]:
-                view_output(output)
+                view_output(output, load_matcher(config_data))
                 view_choice = "y"
                 break
             elif choice in ["n", "no"]:
@@ -139,11 +335,42 @@ def get_screen_output(output, config_data):
                 print(colored("Invalid option", "red"))
     else:
         if screen_output_default == 1:
-            view_output(output)
+            view_output(output, load_matcher(config_data))
             view_choice = "y"
 
     return view_choice
 
+def get_background(config_data):
+    background_ask = read_config(config_data, 'background_ask')
+    background_default = read_config(config_data, 'background_default')
+
+    if background_ask == 1:
+        while True:
+            choice = input(colored("\nRun the scan in the background? (y/n): ", "yellow")).strip().lower()
+            if choice in ["y", "yes"]:
+                return True
+            elif choice in ["n", "no"]:
+                return False
+            else:
+                print(colored("Invalid option", "red"))
+    return background_default == 1
+
+def start_scan(description, target, output_file, config_data, scan):
+    """
+    scan(control) runs the scan and returns its output. It either runs now,
+    followed by the usual view and report questions, or is handed to the
+    background job manager and followed from the 'j' menu.
+    """
+    if get_background(config_data):
+        job = get_jobs(read_config(config_data, 'background_jobs')).submit(description, target, output_file, scan)
+        print(colored(f"\nStarted background job {job.number}. Use 'j' at the main menu to follow it.", "green"))
+        return
+
+    output = scan(ScanControl())
+    if output:
+        view_choice = get_screen_output(output, config_data)
+        report_stuff(output, description, target, output_file, view_choice, config_data)
+
 def report_stuff(output, script, target, output_file, view_choice, config_data):
     report_ask = read_config(config_data, 'report_ask')
     report_default = read_config(config_data, 'report_default')
@@ -152,7 +379,7 @@ def report_stuff(output, script, target, output_file, view_choice, config_data):
         while True:
             choice = input(colored("Do you want to generate a penetration testing report? (y/n): ", "yellow")).strip().lower()
             if choice in ["y", "yes"]:
-                generate_report(output, script, target, output_file, view_choice)
+                generate_report(output, script, target, output_file, view_choice, load_matcher(config_data))
                 break
             elif choice in ["n", "no"]:
                 break
@@ -160,22 +387,28 @@ def report_stuff(output, script, target, output_file, view_choice, config_data):
                 print(colored("Invalid option", "red"))
     else:
         if report_default == 1:
-            generate_report(output, script, target, output_file, view_choice)
+            generate_report(output, script, target, output_file, view_choice, load_matcher(config_data))
 
 def search(scripts, config_data):
     search_results = []
     while not search_results:
-        search_term = input(colored("\nEnter a search term (max 8 chars):\n-> ", 'yellow'))[:8]
-        search_results = [script for category in scripts for script in scripts[category] if search_term in script]
+        search_term = input(colored("\nEnter search terms (script name, category, argument or description words):\n-> ", 'yellow'))
+        try:
+            with span("search"):
+                search_results = get_index().search(search_term)
+        except OSError as e:
+            # The index is built from the scripts directory, which may be gone or unreadable
+            print(scripts_dir_error(e))
+            return
         if not search_results:
             print(colored('\nNO RESULTS', "red"))
 
     print_sub_menu("Search Results", search_results)
 
-    choice = input(colored("\nChoose script by number, 's' to search again, '0' to menu:\n-> ", 'yellow')).strip().lower()
-    while choice != 's' and (not choice.isdigit() or int(choice) < 0 or int(choice) > len(search_results)):
+    choice = input(colored("\nChoose scripts by number (e.g. '3', '1,3,5-8' or 'all'), 's' to search again, '0' to menu:\n-> ", 'yellow')).strip().lower()
+    while choice not in ('s', '0') and parse_selection(choice, len(search_results)) is None:
         print(colored("\nInvalid choice. Please try again.", "red"))
-        choice = input(colored("\nChoose script or 's' to search again, '0' for menu:\n-> ", 'yellow')).strip().lower()
+        choice = input(colored("\nChoose scripts or 's' to search again, '0' for menu:\n-> ", 'yellow')).strip().lower()
 
     if choice == 's':
         search(scripts, config_data)
@@ -183,19 +416,7 @@ def search(scripts, config_data):
     elif choice == '0':
         return
     else:
-        choice = int(choice)
-        print_script_description(search_results[choice-1])
-        target = get_target()
-        port = get_port()
-        output_file = get_output_file(config_data)
-        output = run_script(search_results[choice-1], target, port, output_file, config_data)
-
-        if output:
-            view_choice = get_screen_output(output, config_data)
-            report_stuff(output, search_results[choice-1], target, output_file, view_choice, config_data)
-
-        if read_config(config_data, 'speed_dial_ask') == 1:
-            ask_to_add_to_speed_dial(config_data)
+        get_info_run_script([search_results[i-1] for i in parse_selection(choice, len(search_results))], config_data)
 
 def run_custom_command(config_data):
     print(colored("\nExample: nmap <target> -p 80 -sV -O", "blue"))
@@ -208,21 +429,39 @@ def run_custom_command(config_data):
 
     args = user_cmd.split()
     output_file = get_output_file(config_data)
-    if output_file:
-        args += ["-oN", output_file]
 
     # Run nmap with progress
-    output = run_nmap_with_progress(args)
+    started = time.time()
+    control = ScanControl()
+    writer = None
+    if compression(output_file):
+        # nmap only writes plain -oN files, compressed output is written from its stdout instead
+        writer = open_output(output_file)
+        control.add_handler(writer.on_event)
+    elif output_file:
+        args += ["-oN", output_file]
+    metrics = track_scan(f"nmap {user_cmd}", control, config_data)
+    output = None
+    try:
+        with stop_on_interrupt([control]):
+            output = run_nmap_with_progress(args, control=control)
+    except ScanCancelled as e:
+        output = keep_partial(e, control)
+    finally:
+        if writer:
+            writer.close()
+        finish_tracking(metrics, output, control)
+    record_scan(output, f"nmap {user_cmd}", started, output_file, config_data)
     if output:
         view_choice = get_screen_output(output, config_data)
         report_stuff(output, user_cmd, "", output_file, view_choice, config_data)
 
-    ip_pattern = r'((\d{1,2}|1\d{2}|2[0-4]\d|25[0-5])\.){3}(\d{1,2}|1\d{2}|2[0-4]\d|25[0-5])$'
-    if re.search(ip_pattern, user_cmd):
-        remove_target = re.sub(ip_pattern, '', user_cmd)
-        ask_to_add_to_speed_dial(config_data, custom=True, last=remove_target)
+    # Speed dial entries are saved without their targets (addresses, CIDR blocks, ranges)
+    flags = [arg for arg in user_cmd.split() if not is_address(arg.lstrip('!'))]
+    if len(flags) < len(user_cmd.split()):
+        ask_to_add_to_speed_dial(config_data, custom=True, last=" ".join(flags))
     else:
-        print(colored("Cannot add to speed dial automatically (no direct IP found).", "yellow"))
+        print(colored("Cannot add to speed dial automatically (no IP address or range found).", "yellow"))
 
 def ask_to_add_to_speed_dial(config_data, custom=False, last=""):
     while True:
@@ -238,17 +477,14 @@ def ask_to_add_to_speed_dial(config_data, custom=False, last=""):
             print(colored("Invalid option","red"))
 
 def add_to_speed_dial(config_data, title, flags):
-    if "speed_dial" not in config_data:
-        config_data["speed_dial"] = {}
-    config_data["speed_dial"][title] = flags
-    with open('config.json','w') as config_file:
-        json.dump(config_data, config_file, indent=4)
-    print(colored("\nSpeed dial saved.", "green"))
+    if save_config(lambda store: store.set_speed_dial(title, flags)):
+        print(colored("\nSpeed dial saved.", "green"))
 
 def speed_dial(config_data):
     print("\nSPEED DIAL MENU: Quick access to saved commands.")
 
     while True:
+        reload_config()
         dials = config_data.get("speed_dial", {})
         if not dials:
             print(colored("\nNo speed dial options.", "red"))
@@ -282,10 +518,8 @@ def speed_dial(config_data):
                 idx = int(to_delete)-1
                 if 0 <= idx < len(dials):
                     key_to_del = list(dials.keys())[idx]
-                    del config_data["speed_dial"][key_to_del]
-                    with open('config.json','w') as config_file:
-                        json.dump(config_data, config_file, indent=4)
-                    print(colored(f"\nDeleted speed dial {to_delete}.", "green"))
+                    if save_config(lambda store: store.delete_speed_dial(key_to_del)):
+                        print(colored(f"\nDeleted speed dial {to_delete}.", "green"))
                 else:
                     print(colored("Invalid number.", "red"))
             else:
@@ -298,34 +532,18 @@ def speed_dial(config_data):
                 key = list(dials.keys())[idx]
                 flags = dials[key]
                 target = get_target()
-                if os.path.isfile(target):
-                    target_option = ["-iL", target]
-                    run_target = []
-                else:
-                    target_option = []
-                    run_target = [target]
-
                 output_file = get_output_file(config_data)
-                cmd = ["nmap"] + target_option + run_target + flags.split()
-                if output_file:
-                    cmd += ["-oN", output_file]
-
-                # Progress may not be possible here unless we add --stats-every again
-                # Add stats and run with progress:
-                if "--stats-every" not in cmd:
-                    cmd += ["--stats-every", "5s"]
-                output = run_nmap_with_progress(cmd[1:]) # pass arguments without 'nmap'
-
-                if output:
-                    view_choice = get_screen_output(output, config_data)
-                    report_stuff(output, " ".join(cmd[1:]), "", output_file, view_choice, config_data)
+                start_scan(" ".join(target_args(target) + flags.split()), "", output_file, config_data,
+                           lambda control: run_scan(flags.split(), target, output_file, config_data, control=control))
         else:
             print(colored("Invalid choice.", "red"))
 
 def config_checkup(config_data):
     while True:
+        reload_config()
         configuration = config_data.get("configuration", {})
-        content = [f"{i+1}. {k}: {v}" for i,(k,v) in enumerate(configuration.items())]
+        # The cluster token is a secret, the menu only says whether it is set
+        content = [f"{i+1}. {k}: {'(set)' if k == 'cluster_token' and v else v}" for i,(k,v) in enumerate(configuration.items())]
 
         print_sub_menu("Current Configuration", content)
         option = input(colored("\nENTER:\nNumber to edit\n'0' back\n-> ", 'yellow')).strip()
@@ -341,27 +559,121 @@ def config_checkup(config_data):
             print(colored("Invalid option.", "red"))
             continue
         key = list(configuration.keys())[idx]
-        new_value = input(colored("\nSet value (1 or 0):\n-> ", "yellow")).strip()
-        while new_value not in ["0","1"]:
-            print(colored("Invalid. Must be 0 or 1", "red"))
+        if key in TEXT_SETTINGS:
+            new_value = input(colored("\nSet value (leave blank to turn off):\n-> ", "yellow")).strip()
+        elif key in NUMERIC_SETTINGS:
+            new_value = input(colored("\nSet value (whole number):\n-> ", "yellow")).strip()
+            while not new_value.isdigit():
+                print(colored("Invalid. Must be a whole number", "red"))
+                new_value = input(colored("\nSet value (whole number):\n-> ", "yellow")).strip()
+        else:
             new_value = input(colored("\nSet value (1 or 0):\n-> ", "yellow")).strip()
+            while new_value not in ["0","1"]:
+                print(colored("Invalid. Must be 0 or 1", "red"))
+                new_value = input(colored("\nSet value (1 or 0):\n-> ", "yellow")).strip()
+
+        if save_config(lambda store: store.set_setting(key, new_value if key in TEXT_SETTINGS else int(new_value))):
+            set_rotation(read_config(config_data, 'output_rotate_mb'))
+            print(colored("\nConfig saved.", "green"))
+
+def query_results(config_data):
+    # Search the results store for past findings, blank answers match anything
+    print(colored("\nSEARCH PAST RESULTS (leave blank to match anything)", "cyan"))
+    script = input(colored("Script name (e.g. ftp-anon): ", "yellow")).strip()
+    contains = input(colored("Script output contains: ", "yellow")).strip()
+    host = input(colored("Host address: ", "yellow")).strip()
+    port = input(colored("Port: ", "yellow")).strip()
+    service = input(colored("Service (e.g. ftp): ", "yellow")).strip()
+    days = input(colored("Only the last N days: ", "yellow")).strip()
+
+    if (port and not port.isdigit()) or (days and not days.isdigit()):
+        print(colored("Port and days must be numbers.", "red"))
+        return
+    try:
+        rows = get_store().query(host, port, service, script.removesuffix(".nse"), contains, days)
+    except (sqlite3.Error, OSError) as e:
+        print(colored(f"Could not read the results store: {e}", "red"))
+        return
+    print_results(rows)
 
-        config_data["configuration"][key] = int(new_value)
-        with open('config.json','w') as config_file:
-            json.dump(config_data, config_file, indent=4)
-        print(colored("\nConfig saved.", "green"))
+def resume_scan(config_data):
+    # Rerun the targets an interrupted scan did not finish, appending to its output file
+    checkpoint = Checkpoint.load_last()
+    if checkpoint is None:
+        print(colored("\nNo interrupted scan to resume.", "red"))
+        return
+    remaining = checkpoint.remaining()
+    print(colored(f"\nResuming: {checkpoint.label}", "cyan"))
+    print(colored(f"{checkpoint.total() - remaining.count()} targets done, {remaining.count()} remaining.", "cyan"))
+    if not remaining:
+        checkpoint.finish()
+        return
 
-def get_info_run_script(scripts, script_index, config_data):
-    script_name = scripts[script_index-1]
-    print_script_description(script_name)
-    target = get_target()
-    port = get_port()
-    output_file = get_output_file(config_data)
-    output = run_script(script_name, target, port, output_file, config_data)
+    remaining_file = f"{checkpoint.path}.targets"
+    remaining.write(remaining_file)
+    try:
+        output = execute_scan(checkpoint.args, remaining_file, checkpoint.output_file, config_data, checkpoint)
+    finally:
+        if os.path.isfile(remaining_file):
+            os.remove(remaining_file)
 
     if output:
         view_choice = get_screen_output(output, config_data)
-        report_stuff(output, script_name, target, output_file, view_choice, config_data)
+        report_stuff(output, checkpoint.label, "", checkpoint.output_file, view_choice, config_data)
+
+def jobs_menu(config_data):
+    # Follow, cancel and open the results of background scans
+    while True:
+        jobs = get_jobs(read_config(config_data, 'background_jobs')).jobs
+        if not jobs:
+            print(colored("\nNo background jobs.", "red"))
+            return
+        show_job_messages()
+        print_jobs(jobs)
+
+        option = input(colored("\nENTER:\nNumber of a finished job to view it\n'c' cancel a job\n'r' refresh\n'0' back\n-> ", "yellow")).strip().lower()
+        if option == "0":
+            return
+        elif option == "r":
+            continue
+        elif option == "c":
+            number = input(colored("\nEnter job number to cancel:\n-> ", "yellow")).strip()
+            job = get_jobs().get(int(number)) if number.isdigit() else None
+            if job is None or job.status not in ("queued", "running"):
+                print(colored("No running job with that number.", "red"))
+            else:
+                job.cancel()
+                print(colored(f"\nCancelling job {job.number}.", "green"))
+        elif option.isdigit():
+            job = get_jobs().get(int(option))
+            if job is None:
+                print(colored("Invalid choice.", "red"))
+            elif not job.finished_ok():
+                print(colored(f"Job {job.number} is {job.status}, there is no output to view.", "red"))
+            elif not job.output:
+                print(colored(f"Job {job.number} produced no output.", "red"))
+            else:
+                view_choice = get_screen_output(job.output, config_data)
+                report_stuff(job.output, job.description, job.target, job.output_file, view_choice, config_data)
+        else:
+            print(colored("Invalid choice.", "red"))
+
+def get_info_run_script(script_names, config_data):
+    # Every chosen script goes into one nmap run, so discovery and the port scan happen once
+    arg_names = []
+    for script_name in script_names:
+        print_script_description(script_name)
+        try:
+            arg_names.extend((get_catalog().entry(script_name) or {}).get("args", []))
+        except OSError:
+            pass
+    script_args = get_script_args(list(dict.fromkeys(arg_names)))
+    target = get_target()
+    port = get_port()
+    output_file = get_output_file(config_data)
+    description = ",".join(script_names)
+    start_scan(description, target, output_file, config_data,
+               lambda control: run_script(description, target, port, output_file, config_data, control=control, script_args=script_args))
 
     if read_config(config_data, 'speed_dial_ask') == 1:
         ask_to_add_to_speed_dial(config_data)
@@ -370,17 +682,14 @@ def choose_script_from_category(scripts, digit, config_data):
     if 1 <= digit <= len(scripts):
         category = list(scripts.keys())[digit-1]
         print_sub_menu(category, scripts[category])
-        script_choice = input(f"\nChoose a script from {category} by number or '0' back: ").strip()
+        script_choice = input(f"\nChoose scripts from {category} by number (e.g. '3', '1,3,5-8' or 'all') or '0' back: ").strip()
         if script_choice == "0":
             return
-        if not script_choice.isdigit():
+        selected = parse_selection(script_choice, len(scripts[category]))
+        if selected is None:
             print(colored("Invalid choice.", "red"))
             return
-        script_choice = int(script_choice)
-        if script_choice < 1 or script_choice > len(scripts[category]):
-            print(colored("Invalid choice.", "red"))
-            return
-        get_info_run_script(scripts[category], script_choice, config_data)
+        get_info_run_script([scripts[category][i-1] for i in selected], config_data)
     else:
         print(colored("Invalid category choice.", "red"))
 
@@ -396,21 +705,131 @@ def show_help():
     print(colored("=== END OF HELP ===\n", "cyan"))
     input(colored("Press ENTER to return to menu...", "yellow"))
 
+def run_speed_dial(name, targets, output_file, config_data):
+    """
+    The --speed-dial one-shot run, a batch of one job without the summary.
+    Without an output file the scan output and its report go to stdout.
+    Returns the exit code.
+    """
+    outputs = []
+
+    def run_and_keep(*args):
+        output = run_scan(*args)
+        outputs.append(output)
+        return output
+
+    result = run_job(0, {"speed_dial": name, "targets": targets, "output": output_file}, config_data, run_script, run_and_keep)
+    output = outputs[0] if outputs else None
+    if output and not output_file:
+        for line in output.lines():
+            print(line)
+        generate_report(output, config_data["speed_dial"][name], targets, "", "n", load_matcher(config_data))
+    if output:
+        output.close()
+    if result["retcode"] != JOB_OK:
+        print(colored(f"{name}: {result['error']}", "red"))
+    return result["retcode"]
+
+def view_saved_output(path, host, config_data):
+    # The --view viewer, returns the exit code
+    if not os.path.isfile(path):
+        print(colored(f"No such file: {path}", "red"))
+        return 1
+    output = SavedOutput(path, host)
+    try:
+        if host and next(output.lines(), None) is None:
+            print(colored(f"{host} is not in {path}", "red"))
+            return 1
+        view_output(output, load_matcher(config_data))
+    except (OSError, EOFError) as e:
+        print(colored(f"Could not read {path}: {e}", "red"))
+        return 1
+    return 0
+
+def hang_up(signum, frame):
+    # A dropped SSH session: stop like Ctrl-C so running scans save their checkpoint
+    raise SystemExit(1)
+
 def main():
-    config_data = load_config('config.json')
+    parser = argparse.ArgumentParser(description="MyMap, a menu driven wrapper for nmap")
+    parser.add_argument("--batch", metavar="MANIFEST", help="run the jobs in a JSON manifest without any prompts")
+    parser.add_argument("--workers", type=int, default=0, help="number of batch jobs (or --report-dir parser processes, or --agent scans) to run at once")
+    parser.add_argument("--speed-dial", metavar="NAME", help="run one saved speed dial against --targets without any prompts and exit")
+    parser.add_argument("--targets", default="", help="targets of the --speed-dial run (expressions or a target file)")
+    parser.add_argument("--output", metavar="FILE", default="", help="output file of the --speed-dial run")
+    parser.add_argument("--config", default="config.json", help="config file (default: config.json)")
+    parser.add_argument("--report-dir", metavar="DIR", help="build one consolidated report from every -oN/-oX output under DIR")
+    parser.add_argument("--report-format", choices=REPORT_FORMATS, default="text", help="format of the --report-dir report (default: text)")
+    parser.add_argument("--report-output", metavar="FILE", default="", help="write the --report-dir report to FILE instead of the screen")
+    parser.add_argument("--coordinator", metavar="HOST:PORT", help="listen for agents on HOST:PORT and run every scan on them")
+    parser.add_argument("--agent", metavar="HOST:PORT", help="run scans for the coordinator at HOST:PORT until stopped")
+    parser.add_argument("--view", metavar="FILE", help="show a saved output file, .gz/.zst and rotated parts included")
+    parser.add_argument("--host", default="", help="with --view, only show this host (found through the index of compressed files)")
+    parser.add_argument("--profile", action="store_true", help="time mymap's own work and nmap's, print a breakdown at exit")
+    parser.add_argument("--profile-file", metavar="FILE", default="", help="write the --profile breakdown to FILE instead")
+    parser.add_argument("--cprofile", metavar="FILE", default="", help="also save cProfile data of the Python side to FILE")
+    args = parser.parse_args()
+
+    if args.profile or args.profile_file or args.cprofile:
+        profiler.start(cprofile=bool(args.cprofile))
+    signal.signal(signal.SIGHUP, hang_up)
+    try:
+        with span("startup: config"):
+            config_data = load_config(args.config)
+        if (args.agent or args.coordinator) and not read_config(config_data, 'cluster_token'):
+            print(colored("Set cluster_token in the config (the same on the coordinator and every agent) first", "red"))
+            sys.exit(1)
+        # An agent only runs what the coordinator sends, it only needs the token from the config
+        if args.agent:
+            from cluster import run_agent
+            sys.exit(run_agent(args.agent, read_config(config_data, 'cluster_token'), args.workers or 1, run_nmap_with_progress))
+        set_rotation(read_config(config_data, 'output_rotate_mb'))
+        if args.view:
+            sys.exit(view_saved_output(args.view, args.host, config_data))
+        if args.report_dir:
+            sys.exit(run_report_dir(args.report_dir, load_matcher(config_data).rules, args.report_format,
+                                    args.report_output, args.workers))
+        if args.coordinator:
+            from cluster import start_coordinator
+            start_coordinator(args.coordinator, read_config(config_data, 'cluster_token'))
+        if args.speed_dial:
+            sys.exit(run_speed_dial(args.speed_dial, args.targets, args.output, config_data))
+        if args.batch:
+            sys.exit(run_batch(args.batch, config_data, run_script, run_scan, args.workers))
+        menu(config_data)
+    except (KeyboardInterrupt, SystemExit) as e:
+        # Ctrl-C at a prompt or a dropped session: background scans are stopped, not left running
+        cancel_jobs()
+        if isinstance(e, KeyboardInterrupt):
+            print(colored("\nInterrupted.", "red"))
+            sys.exit(130)
+        raise
+    finally:
+        profiler.finish(args.profile_file, args.cprofile)
+
+def menu(config_data):
     print(colored("=================================\n      WELCOME TO... MYMAP!", "magenta"))
     print(colored("  A wrapper for nmap by Kev,", "green"))
     print(colored(" modified, with improvements by", "green"))
     print(colored("Hubert Januszewski and Sophie Hall:))", "green"))
     print(colored("==================================", "magenta"))
 
-    scripts = get_scripts()
+    with span("startup: script catalog"):
+        scripts = get_scripts()
 
     while True:
+        show_job_messages()
         print_sub_menu("SCRIPT CATEGORIES", list(scripts.keys())[:10])
-        category_choice = input(colored("\nOR ENTER:\n- number of script category\n- 's' search\n- 'c' custom\n- 'd' speed dial\n- 'e' edit settings\n- 'h' help\n- 'q' quit\n-> ", 'yellow')).strip().lower()
+        category_choice = input(colored("\nOR ENTER:\n- number of script category\n- 's' search\n- 'c' custom\n- 'd' speed dial\n- 'r' past results\n- 'l' resume last scan\n- 'j' background jobs\n- 'e' edit settings\n- 'h' help\n- 'q' quit\n-> ", 'yellow')).strip().lower()
+        reload_config()
 
         if category_choice == 'q':
+            running = get_jobs().running()
+            if running:
+                choice = input(colored(f"\n{len(running)} background jobs still running, cancel them and quit? (y/n): ", "yellow")).strip().lower()
+                if choice not in ["y", "yes"]:
+                    continue
+                get_jobs().cancel_all()
             break
         elif category_choice == 's':
             search(scripts, config_data)
@@ -418,6 +837,12 @@ def main():
             run_custom_command(config_data)
         elif category_choice == 'd':
             speed_dial(config_data)
+        elif category_choice == 'r':
+            query_results(config_data)
+        elif category_choice == 'l':
+            resume_scan(config_data)
+        elif category_choice == 'j':
+            jobs_menu(config_data)
         elif category_choice == 'e':
             config_checkup(config_data)
         elif category_choice == 'h':
@@ -0,0 +1,235 @@
+import io
+import os
+import re
+import gzip
+import json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# In this file: compressed output files - gzip/zstd writing with rotation and a host index for seeking
+
+# Output file endings that turn compression on
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+
+# A new compressed block starts at the first host after this many bytes of text, the
+# index points at blocks, so reading one host decompresses at most about this much
+BLOCK_SIZE = 256 * 1024
+
+HOST_REGEX = re.compile(r'^Nmap scan report for (.+?)(?: \(([^)]+)\))?(?: \(cached .*\))?\s*$')
+
+# nmap's --stats-every lines go to the terminal but not into -oN files
+STATUS_REGEX = re.compile(r'^(Stats: |.+ Timing: About )')
+
+# Compressed parts start a new file once they reach this many bytes, 0 = never, see set_rotation
+rotate_bytes = 0
+
+def set_rotation(megabytes):
+    global rotate_bytes
+    rotate_bytes = max(0, int(megabytes or 0)) * 1024 * 1024
+
+def compression(path):
+    # "gzip", "zstd" or None, from the file name
+    return COMPRESSIONS.get(os.path.splitext(path)[1].lower())
+
+def check_output(path):
+    # Reason output cannot be written to path, or None
+    if compression(path) == "zstd" and zstandard is None:
+        return "zstd output needs the zstandard module (pip install zstandard), or use a .gz file"
+    return None
+
+def index_path(path):
+    return f"{path}.idx.gz"
+
+def part_path(path, number):
+    # scan.txt.gz, then scan.txt.1.gz, scan.txt.2.gz... once the output rotates
+    if number == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{number}{ext}"
+
+def output_parts(path):
+    parts = [path]
+    while compression(path) and os.path.isfile(part_path(path, len(parts))):
+        parts.append(part_path(path, len(parts)))
+    return parts
+
+def read_index(path):
+    # Index entries in file order, one per block: {"part", "offset", "hosts"}, [] without an index
+    entries = []
+    try:
+        with gzip.open(index_path(path), 'rt') as f:
+            for line in f:
+                entries.append(json.loads(line))
+    except (OSError, EOFError, ValueError):
+        # The end of the index of an interrupted scan can be cut short, what came before still counts
+        pass
+    return entries
+
+def compressor(kind, raw):
+    if kind == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode='wb')
+    return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+
+def decompressor(kind, raw):
+    # Reads on from the current position of raw, across block boundaries
+    if kind == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=False)
+
+class OutputWriter:
+    """
+    Streams text into a gzip or zstd file as a series of independently
+    compressed blocks (gzip members, zstd frames), which any gunzip or
+    zstdcat reads as one file. Blocks start at host reports, and the index
+    (path.idx.gz) gets a JSON line per block with its offset and the addresses
+    and names of its hosts, so one host can be read without decompressing
+    what comes before.
+    With rotate_bytes the output moves on to a new part file at a block
+    boundary once the current one is that big.
+    """
+    def __init__(self, path, append=False, rotate=None):
+        self.path = path
+        self.kind = compression(path)
+        self.rotate = rotate_bytes if rotate is None else rotate
+        self.part = 0
+        self.pending = ""
+        self.stream = None
+        self.hosts = []
+        if append:
+            self.part = len(output_parts(path)) - 1
+        else:
+            # Like opening with 'w': earlier parts and their index go
+            for part in output_parts(path):
+                if os.path.isfile(part):
+                    os.remove(part)
+            if os.path.isfile(index_path(path)):
+                os.remove(index_path(path))
+        self.index = gzip.open(index_path(path), 'at')
+        self.raw = open(part_path(path, self.part), 'ab' if append else 'wb')
+        self.start_block()
+
+    def end_block(self):
+        self.stream.close()
+        self.stream = None
+        if self.hosts:
+            self.index.write(json.dumps({"part": self.part, "offset": self.offset, "hosts": self.hosts}) + "\n")
+            self.index.flush()
+            self.hosts = []
+
+    def start_block(self):
+        self.offset = self.raw.tell()
+        self.stream = compressor(self.kind, self.raw)
+        self.block_size = 0
+
+    def write(self, text):
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self.write_line(line + "\n")
+
+    def write_line(self, line):
+        if line.startswith("Nmap scan report for"):
+            if self.block_size >= BLOCK_SIZE:
+                self.end_block()
+                if self.rotate and self.raw.tell() >= self.rotate:
+                    self.raw.close()
+                    self.part += 1
+                    self.raw = open(part_path(self.path, self.part), 'wb')
+                self.start_block()
+            match = HOST_REGEX.match(line)
+            if match:
+                self.hosts.extend(name for name in match.groups() if name)
+        data = line.encode('utf-8', errors='replace')
+        self.stream.write(data)
+        self.block_size += len(data)
+
+    def on_event(self, kind, value):
+        # As a ScanControl handler: the output lines of a running scan, without the progress lines
+        if kind == "line" and not STATUS_REGEX.match(value):
+            self.write(value)
+
+    def close(self):
+        if self.pending:
+            self.write_line(self.pending)
+            self.pending = ""
+        self.end_block()
+        self.raw.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_output(path, append=False):
+    # A writer for an output file: compressed with a host index for .gz/.zst, a plain text file otherwise
+    if compression(path):
+        return OutputWriter(path, append)
+    return open(path, 'a' if append else 'w')
+
+def open_text(path):
+    # Read any output file as text, decompressing .gz/.zst
+    kind = compression(path)
+    if kind is None:
+        return open(path, 'r', errors='replace')
+    if kind == "gzip":
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    if zstandard is None:
+        raise OSError(check_output(path))
+    reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+    return io.TextIOWrapper(reader, encoding='utf-8', errors='replace')
+
+def iter_lines(path):
+    # Every line of an output file and its rotated parts
+    for part in output_parts(path):
+        with open_text(part) as f:
+            yield from f
+
+def host_block(lines, host):
+    # The report of one host (by address or name) out of a stream of output lines
+    block = []
+    found = False
+    for line in lines:
+        if line.startswith("Nmap scan report for"):
+            if found:
+                break
+            match = HOST_REGEX.match(line)
+            found = bool(match) and host in (match.group(1), match.group(2))
+        elif found and line.startswith(("Nmap done", "# Nmap done")):
+            break
+        if found:
+            block.append(line)
+    return block
+
+def host_lines(path, host):
+    """
+    The lines of one host's report from an output file, [] if it is not
+    there. Compressed files are looked up in the index and decompressed
+    only from the block the host starts in, plain files are read through.
+    """
+    kind = compression(path)
+    if kind is None:
+        with open(path, 'r', errors='replace') as f:
+            return host_block(f, host)
+    entry = next((entry for entry in read_index(path) if host in entry["hosts"]), None)
+    if entry is None:
+        return []
+    if kind == "zstd" and zstandard is None:
+        raise OSError(check_output(path))
+    with open(part_path(path, entry["part"]), 'rb') as raw:
+        raw.seek(entry["offset"])
+        return host_block(io.TextIOWrapper(decompressor(kind, raw), encoding='utf-8', errors='replace'), host)
+
+class SavedOutput:
+    # An output file (or one host of it) with the lines() of a ScanOutput, for view_output
+    def __init__(self, path, host=""):
+        self.path = path
+        self.host = host
+
+    def lines(self):
+        for line in host_lines(self.path, self.host) if self.host else iter_lines(self.path):
+            yield line[:-1] if line.endswith('\n') else line
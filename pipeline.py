@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+
+from termcolor import colored
+
+from engine import run, collect, ScanCancelled
+from budget import with_host_timeout
+from printers import print_progress
+from results import ScanOutput
+from shards import run_jobs
+from targets import TargetSet
+from outputs import open_output
+from timing import span
+
+# In this file: the two-phase pipeline - find live hosts and open ports first, then script only those
+
+DEFAULT_MIN_RATE = 1000
+
+def discovery_args(port, min_rate):
+    # A fast sweep that only reports open ports, no version or script work
+    return ["-T4", "--open", "--min-rate", str(min_rate or DEFAULT_MIN_RATE)] + port.split()
+
+def port_groups(hosts):
+    """
+    Group live hosts by their set of open ports: {(("tcp", 21), ("tcp", 80)): [addresses]}.
+    Hosts with nothing open are left out, a script would have nothing to talk to.
+    """
+    groups = {}
+    for host in hosts:
+        ports = tuple(sorted({(port.protocol, port.portid) for port in host.open_ports()}))
+        if ports:
+            groups.setdefault(ports, []).append(host.address)
+    return groups
+
+# nmap's -p prefix and scan type for each protocol discovery can find open ports on
+PROTOCOLS = (("tcp", "T", "-sS"), ("udp", "U", "-sU"), ("sctp", "S", "-sY"))
+
+def port_args(ports):
+    # -p for exactly the open ports of a group, e.g. ["-sS", "-sU", "-p", "T:21,80,U:53"], sctp ports go in S:
+    lists = {protocol: ",".join(str(portid) for port_protocol, portid in ports if port_protocol == protocol)
+             for protocol, _, _ in PROTOCOLS}
+    if not any(lists[protocol] for protocol, _, _ in PROTOCOLS[1:]):
+        return ["-p", lists["tcp"]]
+    scans = [scan for protocol, _, scan in PROTOCOLS if lists[protocol]]
+    return scans + ["-p", ",".join(f"{prefix}:{lists[protocol]}" for protocol, prefix, _ in PROTOCOLS if lists[protocol])]
+
+def discover(port, targets, min_rate, control, work_dir, label="", host_timeout=0):
+    # Phase 1: the hosts that are up with at least one open port, None if nmap failed
+    args = with_host_timeout(discovery_args(port, min_rate), host_timeout) + targets.nmap_args(os.path.join(work_dir, "discovery.targets"))
+    discovery_label = f"{label} discovery" if label else "discovery"
+
+    def show_progress(kind, value):
+        # Discovery hosts are not results, only progress is passed on
+        if kind == "progress":
+            control.emit(kind, value)
+            if not control.quiet:
+                print_progress(value, discovery_label)
+
+    try:
+        with span("nmap"):
+            retcode, output = run(collect(args, show_progress, control.cancel))
+    except ScanCancelled:
+        # A half done sweep is not results, there is nothing to keep yet
+        raise ScanCancelled() from None
+    hosts = output.hosts
+    output.close()
+    if retcode != 0:
+        print(colored(f"Error running nmap ({discovery_label}): return code {retcode}", "red"))
+        return None
+    return hosts
+
+def run_pipeline(script_args, port, targets, output_file, workers, min_rate, control, label="", host_timeout=0):
+    """
+    Run script_args (e.g. ["-T4", "--script", path]) in two phases. A fast
+    sweep with the user's port option finds live hosts and their open ports,
+    then hosts with the same open ports share one script run, restricted to
+    those ports (-Pn, they are known to be up). Up to `workers` script runs
+    go at once. Returns the merged ScanOutput, None if a phase failed.
+    host_timeout (minutes) is passed to both phases as --host-timeout.
+    """
+    work_dir = tempfile.mkdtemp(prefix="mymap-pipeline-")
+    try:
+        hosts = discover(port, targets, min_rate, control, work_dir, label, host_timeout)
+        if hosts is None:
+            return None
+        groups = port_groups(hosts)
+        live = sum(len(addresses) for addresses in groups.values())
+        summary = f"Pipeline: {live} of {targets.count()} targets up with open ports, {len(groups)} script runs\n"
+        print(colored(summary.strip(), "cyan"))
+
+        jobs, labels, output_parts = [], [], []
+        for i, (ports, addresses) in enumerate(groups.items()):
+            group_file = os.path.join(work_dir, f"group{i+1}.targets")
+            TargetSet(addresses).write(group_file)
+            args = with_host_timeout(script_args, host_timeout) + ["-Pn"] + port_args(ports) + targets.family_args() + ["-iL", group_file]
+            if output_file:
+                output_parts.append(f"{output_file}.group{i+1}")
+                args += ["-oN", output_parts[-1]]
+            jobs.append(args)
+            labels.append(f"{label} group {i+1}/{len(groups)}" if label else f"group {i+1}/{len(groups)}")
+
+        if output_file:
+            with open_output(output_file) as f:
+                f.write(summary)
+        if not jobs:
+            return ScanOutput.from_text(summary)
+        output = run_jobs(jobs, max(1, workers), labels, control, output_file, output_parts, append=True)
+        if output is not None:
+            output.write(summary)
+        return output
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,5 +1,14 @@
+import time
+import shutil
+import tempfile
+
 from termcolor import colored
 
+from catalog import get_catalog
+from rules import DEFAULT_RULES, SEVERITY_COLOURS, Matcher, iter_windows
+from timing import timed, span
+from outputs import open_output
+
 # In this file: funtions that just print pretty stuff
 
 def print_menu(scripts):
@@ -39,87 +48,194 @@ def print_sub_menu(category, scripts):
             else:
                 alternating_colour = "blue"
 
-#generate the report
-def generate_report(output, script, target, output_file, screen_output):
-    vulnerabilities = ["vuln", "exploit", "risk", "danger", "warning", "critical", "high", 
-                       "medium", "low", "Insecure", "dangerous",
-                       "Anonymous FTP Login", "State: VULNERABLE", "EOL", "Windows 2000",
-                       "Windows NT", "Windows 2003", "Windows 2008", "Out of Support", "Login Success"]
-    
-    if target != "":
-        report = f"Penetration Testing Report for target {target} using {script}:\n"
-    else:
-        report = f"Penetration Testing Report for target using {script}:\n"
+def print_progress(percent, label=""):
+    # Print a progress update from nmap's --stats-every output
+    prefix = f"Progress [{label}]" if label else "Progress"
+    print(colored(f"{prefix}: {percent:.2f}% done", "cyan"))
+
+def format_script_results(hosts):
+    # One block per host listing every script that returned output, per port
+    blocks = []
+    for host in hosts:
+        lines = []
+        for script in host.scripts:
+            lines.append(f"  host script {script.id}: {script.output.strip()}")
+        for port in host.ports:
+            for script in port.scripts:
+                lines.append(f"  {port.portid}/{port.protocol} {script.id}: {script.output.strip()}")
+        if lines:
+            name = f"{host.address} ({host.hostname})" if host.hostname else host.address
+            blocks.append(name + ":\n" + "\n".join(lines))
+    return "\n".join(blocks)
+
+def format_results_by_script(hosts):
+    # One block per script listing every host and port it returned output for
+    results = {}
+    for host in hosts:
+        name = f"{host.address} ({host.hostname})" if host.hostname else host.address
+        for script in host.scripts:
+            results.setdefault(script.id, []).append(f"  {name}: {script.output.strip()}")
+        for port in host.ports:
+            for script in port.scripts:
+                results.setdefault(script.id, []).append(f"  {name} {port.portid}/{port.protocol}: {script.output.strip()}")
+    return "\n".join(f"{script_id}:\n" + "\n".join(lines) for script_id, lines in sorted(results.items()))
+
+def script_ids(hosts):
+    ids = set()
+    for host in hosts:
+        ids.update(script.id for script in host.scripts)
+        for port in host.ports:
+            ids.update(script.id for script in port.scripts)
+    return ids
 
-    if any(vulnerability.lower() in output.lower() for vulnerability in vulnerabilities):
-        report += "The scan has identified potential vulnerabilities. It is recommended to investigate these findings further and apply necessary patches or configuration changes to mitigate any risk."
-    else:
-        report += "The scan did not identify any obvious vulnerabilities. However, this does not guarantee the security of the system. Regular scans and updates are recommended."
-
-    report += "\n\nHighlighted lines from the output:\n"
-    lines = output.split('\n')
-
-    for vulnerability in vulnerabilities:
-        matched_lines = [i for i, line in enumerate(lines) if vulnerability in line]
-        for line_index in matched_lines:
-            report += "Potential vulnerability found related to '{}':\n".format(vulnerability)
-            start = max(0, line_index - 3)
-            end = min(len(lines), line_index + 4)
-            for i in range(start, end):
-                report += lines[i] + "\n"
-
-    if output_file:
-        with open(output_file, 'a') as f:
-            f.write("\n\n" + report)
-
-    #if the user said they wanted the output printed to screen, show the report on screen
-    #also show the report on screen if there is no output file
-    if screen_output == "y" or screen_output == "yes" or output_file == "":
-        print(colored("\nReport Output:", "blue"))
-        print("================================================================")
-        print(report)
-
-def view_output(output):
-    # View the output of the command
+#generate the report
+@timed("report")
+def generate_report(output, script, target, output_file, screen_output, matcher=None):
+    matcher = matcher or Matcher(DEFAULT_RULES)
+
+    # The highlighted sections are streamed into a spool file first, since the
+    # summary at the top depends on whether anything was found
+    found = False
+    verdict = []
+
+    def checked(lines):
+        # The summary counts keywords in any case, the highlights only exact ones
+        for line in lines:
+            if not verdict and matcher.any_case(line):
+                verdict.append(line)
+            yield line
+
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as report:
+        if target != "":
+            report.write(f"Penetration Testing Report for target {target} using {script}:\n")
+        else:
+            report.write(f"Penetration Testing Report for target using {script}:\n")
+        if output.stopped:
+            report.write(f"The scan was stopped before it finished ({output.stopped}), this report covers the hosts it got to.\n")
+
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as highlights:
+            # Overlapping context windows are merged so each line is printed only once
+            for keywords, lines in iter_windows(matcher, checked(output.lines())):
+                found = True
+                related = ", ".join(f"'{keyword}'" for keyword in keywords)
+                highlights.write(f"Potential vulnerability found related to {related} ({matcher.severity(keywords)}):\n")
+                highlights.write("\n".join(lines) + "\n")
+
+            if found or verdict:
+                report.write("The scan has identified potential vulnerabilities. It is recommended to investigate these findings further and apply necessary patches or configuration changes to mitigate any risk.\n")
+            else:
+                report.write("The scan did not identify any obvious vulnerabilities. However, this does not guarantee the security of the system. Regular scans and updates are recommended.\n")
+            report.write("\nHighlighted lines from the output:\n")
+            highlights.seek(0)
+            shutil.copyfileobj(highlights, report)
+
+        # Script results straight from the parsed -oX output, when we have it.
+        # Several scripts in one run get a section each instead of one block per host
+        if len(script_ids(output.hosts)) > 1:
+            report.write("\nScript results by script:\n" + format_results_by_script(output.hosts) + "\n")
+        else:
+            script_results = format_script_results(output.hosts)
+            if script_results:
+                report.write("\nScript results by host:\n" + script_results + "\n")
+
+        if output_file:
+            with open_output(output_file, append=True) as f:
+                f.write("\n\n")
+                report.seek(0)
+                shutil.copyfileobj(report, f)
+
+        #if the user said they wanted the output printed to screen, show the report on screen
+        #also show the report on screen if there is no output file
+        if screen_output == "y" or screen_output == "yes" or output_file == "":
+            print(colored("\nReport Output:", "blue"))
+            print("================================================================")
+            report.seek(0)
+            for line in report:
+                print(line, end="")
+            print()
+
+@timed("view output")
+def view_output(output, matcher=None):
+    # View the output of the command, lines are coloured by the worst rule they match
+    matcher = matcher or Matcher(DEFAULT_RULES)
     print(colored("\nCommand Output:", "blue"))
     print("================================================================")
-    lines = output.split('\n')
-
-    # Add new keywords to highlight in red
-    red_keywords = ["VULN", "Login Success", "State: VULNERABLE", "Anonymous FTP login allowed", 
-                    "Windows NT", "Windows 2000", "Windows 2003", "Windows 2008", "ESXi 6.5.0", "EOL", "out of support", "OUT OF SUPPORT", "Out of Support", "Warning", "dangerous"]
-
-    for i, line in enumerate(lines, start=1):
-        if any(keyword in line for keyword in red_keywords):
-            print(colored(line, 'red'))
-        elif "deprecated" in line:
-            print(colored(line, 'yellow'))
-        elif "dangerous" in line or "weak" in line:
-            print(colored(line, 'magenta'))
+
+    for i, line in enumerate(output.lines(), start=1):
+        colour = SEVERITY_COLOURS.get(matcher.severity(matcher.line_hits(line)))
+        if colour:
+            print(colored(line, colour))
         else:
             print(line)
         if i % 20 == 0:
-            input('Press Enter to continue...')
+            with span("waiting for input"):
+                input('Press Enter to continue...')
+
+def print_results(rows):
+    # Print rows from the results store: (scanned, address, port, service, script, detail)
+    if not rows:
+        print(colored("\nNO RESULTS", "red"))
+        return
+    print(colored(f"\n{len(rows)} results:", "blue"))
+    print("================================================================")
+    for scanned, address, port, service, script, detail in rows:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(scanned))
+        where = f"{address}:{port}" if port else address
+        first_line = (detail or "").strip().split("\n")[0]
+        if script:
+            print(colored(f"{when}  {where: <22} {service or '': <12} {script}: ", "green") + first_line)
+        else:
+            print(colored(f"{when}  {where: <22} {service or '': <12} ", "green") + first_line)
 
+def print_batch_summary(results, seconds):
+    # One line per batch job: exit code, time taken, output file or error
+    print(colored("\nBATCH SUMMARY", "blue"))
+    print("================================================================")
+    for result in results:
+        colour = "green" if result["retcode"] == 0 else "red"
+        detail = result["error"] or result["output_file"]
+        print(colored(f"[{result['retcode']}] {result['name']: <30} {result['seconds']: >8.1f}s  {detail}", colour))
+    failed = sum(1 for result in results if result["retcode"] != 0)
+    print(f"{len(results)} jobs, {failed} failed, {seconds:.1f}s total")
+
+def print_jobs(jobs):
+    # One line per background job with its status, progress, ETA and running time
+    colours = {"queued": "yellow", "running": "cyan", "done": "green", "stopped": "yellow", "failed": "red", "cancelled": "red"}
+    print(colored("\nBACKGROUND JOBS", "blue"))
+    print("================================================================")
+    for job in jobs:
+        minutes, seconds = divmod(int(job.elapsed()), 60)
+        state = f"{job.status: <9} {job.progress: >6.2f}%"
+        if job.status == "running":
+            state += f"  ETA {job.eta or '?'}"
+            if job.phase:
+                state += f"  {job.phase}"
+        line = f"{job.number}. [{state}] {minutes}:{seconds:02d}  {job.description}"
+        if job.target:
+            line += f" on {job.target}"
+        if job.hosts_done:
+            line += f" ({job.hosts_done} hosts done)"
+        if job.error:
+            line += f" - {job.error}"
+        print(colored(line, colours.get(job.status, "white")))
+
+@timed("script description")
 def print_script_description(script):
-    # Print the description of the script
-    script_file = f"/usr/share/nmap/scripts/{script}"
+    # Print the description of the script from the script catalog
     try:
-        with open(script_file, 'r') as f:
-            lines = f.readlines()
-        description_lines = [line for line in lines if 'description = [[' in line]
-        if description_lines:
-            start_index = lines.index(description_lines[0])
-            description = []
-            for line in lines[start_index:]:
-                if ']]' in line:
-                    description.append(line.split(']]')[0])
-                    break
-                description.append(line)
-            description = ''.join(description).replace('description = [[', '').strip()
-            print(f"\n{script}:")
-            print(colored(f"{description}", 'blue'))
+        entry = get_catalog().entry(script)
     except FileNotFoundError:
-        print("The script file does not exist.")
+        entry = None
     except PermissionError:
         print("You do not have the necessary permissions to read the script file.")
+        return
+    if entry is None:
+        print("The script file does not exist.")
+        return
+    if entry["description"]:
+        print(f"\n{script}:")
+        print(colored(f"{entry['description']}", 'blue'))
+    if entry.get("categories"):
+        print(colored(f"Categories: {', '.join(entry['categories'])}", 'green'))
+    if entry.get("args"):
+        print(colored(f"Script args: {', '.join(entry['args'])}", 'green'))
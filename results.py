@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+
+# In this file: the compact host/port/script result model and the streaming -oX parser
+
+class ScriptResult:
+    __slots__ = ("id", "output")
+
+    def __init__(self, id, output):
+        self.id = id
+        self.output = output
+
+class Port:
+    __slots__ = ("protocol", "portid", "state", "service", "product", "version", "scripts")
+
+    def __init__(self, protocol, portid, state, service="", product="", version=""):
+        self.protocol = protocol
+        self.portid = portid
+        self.state = state
+        self.service = service
+        self.product = product
+        self.version = version
+        self.scripts = []
+
+class Host:
+    __slots__ = ("address", "hostname", "status", "ports", "scripts")
+
+    def __init__(self, address, hostname="", status=""):
+        self.address = address
+        self.hostname = hostname
+        self.status = status
+        self.ports = []
+        # Host scripts (<hostscript>) that are not tied to a port
+        self.scripts = []
+
+    def open_ports(self):
+        return [port for port in self.ports if port.state == "open"]
+
+class ScanOutput:
+    """
+    nmap's text output, spooled to a temporary file instead of being kept in
+    memory, with the hosts parsed from -oX attached. Read it back with lines(),
+    which streams from disk, so memory use does not grow with the output.
+    The file is only held open while it is being written: release() closes
+    it, so hundreds of finished shards waiting to be merged do not each hold
+    a file descriptor, and the next write opens it again.
+    """
+    def __init__(self, hosts=None):
+        fd, self.path = tempfile.mkstemp(prefix="mymap-", suffix=".out")
+        os.close(fd)
+        self.file = None
+        self.hosts = hosts if hosts is not None else []
+        self.size = 0
+        # Why the scan ended before nmap finished ("time limit", "cancelled"...), "" if it ran to the end
+        self.stopped = ""
+
+    @classmethod
+    def from_text(cls, text, hosts=None):
+        output = cls(hosts)
+        output.write(text)
+        return output
+
+    def writer(self):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8', errors='replace', newline='\n')
+        return self.file
+
+    def write(self, text):
+        self.size += len(text)
+        self.writer().write(text)
+
+    def release(self):
+        # Close the file until the next write
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def extend(self, other):
+        # Append another spooled output (e.g. a shard) to this one
+        other.release()
+        with open(other.path, 'r', encoding='utf-8', errors='replace', newline='\n') as f:
+            shutil.copyfileobj(f, self.writer())
+        self.size += other.size
+        self.hosts.extend(other.hosts)
+
+    def lines(self):
+        # Iterate the output line by line, without line endings
+        self.release()
+        with open(self.path, 'r', encoding='utf-8', errors='replace', newline='\n') as f:
+            for line in f:
+                yield line[:-1] if line.endswith('\n') else line
+
+    def text(self):
+        self.release()
+        with open(self.path, 'r', encoding='utf-8', errors='replace', newline='\n') as f:
+            return f.read()
+
+    def __bool__(self):
+        return self.size > 0
+
+    def close(self):
+        self.release()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def __del__(self):
+        self.close()
+
+def parse_scripts(elem):
+    return [ScriptResult(script.get("id", ""), script.get("output", "")) for script in elem.iter("script")]
+
+def parse_host(elem):
+    # Turn one finished <host> element into a Host record
+    address = ""
+    for addr in elem.findall("address"):
+        # Prefer the IP address over a MAC address
+        if addr.get("addrtype") in ("ipv4", "ipv6") or not address:
+            address = addr.get("addr", "")
+    hostname = elem.find("hostnames/hostname")
+    status = elem.find("status")
+    host = Host(address,
+                hostname.get("name", "") if hostname is not None else "",
+                status.get("state", "") if status is not None else "")
+
+    for port_elem in elem.findall("ports/port"):
+        state = port_elem.find("state")
+        service = port_elem.find("service")
+        port = Port(port_elem.get("protocol", ""), int(port_elem.get("portid", 0)),
+                    state.get("state", "") if state is not None else "",
+                    service.get("name", "") if service is not None else "",
+                    service.get("product", "") if service is not None else "",
+                    service.get("version", "") if service is not None else "")
+        port.scripts = parse_scripts(port_elem)
+        host.ports.append(port)
+
+    hostscript = elem.find("hostscript")
+    if hostscript is not None:
+        host.scripts = parse_scripts(hostscript)
+    return host
+
+class HostParser:
+    """
+    Incremental -oX parser. Feed it the XML in whatever chunks it arrives and
+    it returns every host whose </host> has been seen. Finished elements are
+    dropped from the tree, so memory stays constant however many hosts there are.
+    """
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.root = None
+        self.depth = 0
+
+    def feed(self, data):
+        self.parser.feed(data)
+        hosts = []
+        for event, elem in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = elem
+                self.depth += 1
+                continue
+            self.depth -= 1
+            # Only direct children of <nmaprun> are complete records
+            if self.depth != 1:
+                continue
+            if elem.tag == "host":
+                hosts.append(parse_host(elem))
+            self.root.remove(elem)
+        return hosts
+
+def iter_hosts(xml_file, chunk_size=64 * 1024):
+    # Stream the hosts out of an -oX file without loading all of it
+    parser = HostParser()
+    with open(xml_file, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield from parser.feed(chunk)
@@ -0,0 +1,108 @@
+import re
+from collections import deque
+
+# In this file: the finding rules and the single-pass matcher shared by the report and the viewer
+
+SEVERITIES = ["critical", "high", "medium", "low", "info"]
+
+# Colour used by the viewer for a line, by the highest severity found on it
+SEVERITY_COLOURS = {"critical": "red", "high": "red", "medium": "magenta", "low": "yellow"}
+
+# Used when config.json has no "rules" section. Keywords are matched case sensitively.
+DEFAULT_RULES = {
+    "State: VULNERABLE": "critical",
+    "Login Success": "critical",
+    "VULN": "high",
+    "Anonymous FTP login allowed": "high",
+    "Anonymous FTP Login": "high",
+    "Windows NT": "high",
+    "Windows 2000": "high",
+    "Windows 2003": "high",
+    "Windows 2008": "high",
+    "ESXi 6.5.0": "high",
+    "EOL": "high",
+    "out of support": "high",
+    "Out of Support": "high",
+    "OUT OF SUPPORT": "high",
+    "Warning": "high",
+    "dangerous": "high",
+    "Insecure": "medium",
+    "weak": "medium",
+    "deprecated": "low",
+    "vuln": "info",
+    "exploit": "info",
+    "risk": "info",
+    "danger": "info",
+    "warning": "info",
+    "critical": "info",
+    "high": "info",
+    "medium": "info",
+    "low": "info",
+}
+
+class Matcher:
+    """
+    All rule keywords compiled into one regex, so a line is checked against
+    every rule in a single pass. Longer keywords are tried first, so
+    "dangerous" wins over "danger" where both match. Highlights are case
+    sensitive, the report's verdict ignores case (see any_case).
+    """
+    def __init__(self, rules):
+        self.rules = {keyword: severity for keyword, severity in rules.items()
+                      if keyword and severity in SEVERITIES}
+        keywords = sorted(self.rules, key=len, reverse=True)
+        self.regex = re.compile("|".join(re.escape(keyword) for keyword in keywords)) if keywords else None
+        self.any_case_regex = re.compile(self.regex.pattern, re.IGNORECASE) if keywords else None
+
+    def any_case(self, line):
+        # Whether any keyword is in the line in any case, as the report summary has always checked
+        return self.any_case_regex is not None and self.any_case_regex.search(line) is not None
+
+    def line_hits(self, line):
+        # Keywords found in the line, each reported once, in order of appearance
+        if self.regex is None:
+            return []
+        return list(dict.fromkeys(match.group(0) for match in self.regex.finditer(line)))
+
+    def severity(self, keywords):
+        # Highest severity among the given keywords
+        if not keywords:
+            return None
+        return min((self.rules[keyword] for keyword in keywords), key=SEVERITIES.index)
+
+def iter_windows(matcher, lines, context=3):
+    """
+    Stream over lines once and yield (keywords, window lines) for every hit
+    with +-context lines around it. Windows that overlap or touch are merged,
+    so every line is emitted at most once. Only the current window and the
+    last few lines are held in memory.
+    """
+    before = deque(maxlen=context)
+    window = None
+    after = 0
+    for line in lines:
+        keywords = matcher.line_hits(line)
+        if keywords:
+            if window is None:
+                window = (keywords, list(before))
+            else:
+                # Close enough to the open window that their context would overlap
+                window[0].extend(keyword for keyword in keywords if keyword not in window[0])
+                window[1].extend(before)
+            before.clear()
+            window[1].append(line)
+            after = context
+        elif window is not None and after:
+            window[1].append(line)
+            after -= 1
+        else:
+            if window is not None and len(before) == context:
+                # The gap is too wide for the next hit to join this window
+                yield window
+                window = None
+            before.append(line)
+    if window is not None:
+        yield window
+
+def load_matcher(config_data):
+    return Matcher(config_data.get("rules") or DEFAULT_RULES)
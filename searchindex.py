@@ -0,0 +1,76 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+from catalog import get_catalog
+
+# In this file: the inverted index used to search the script catalog
+
+# How much a hit in each field counts towards a script's rank
+FIELD_WEIGHTS = {"name": 8, "category": 4, "args": 2, "description": 1}
+
+TOKEN_REGEX = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    return TOKEN_REGEX.findall(text.lower())
+
+class SearchIndex:
+    """
+    Inverted index over script names, nmap categories, argument names and
+    descriptions. Query terms match whole tokens or token prefixes (found by
+    bisecting the sorted token list), all terms must match, and scripts are
+    ranked by where the terms were found.
+    """
+    def __init__(self, scripts):
+        self.names = sorted(scripts)
+        self.postings = defaultdict(dict)
+        for name, entry in scripts.items():
+            fields = {
+                "name": name[:-4] if name.endswith(".nse") else name,
+                "category": " ".join(entry.get("categories", [])),
+                "args": " ".join(entry.get("args", [])),
+                "description": entry.get("description", ""),
+            }
+            for field, text in fields.items():
+                for token in set(tokenize(text)):
+                    self.postings[token][name] = self.postings[token].get(name, 0) + FIELD_WEIGHTS[field]
+        self.tokens = sorted(self.postings)
+
+    def term_scores(self, term):
+        # Exact token hits score in full, longer tokens that start with the term score half
+        scores = {}
+        i = bisect_left(self.tokens, term)
+        while i < len(self.tokens) and self.tokens[i].startswith(term):
+            token = self.tokens[i]
+            factor = 1.0 if token == term else 0.5
+            for name, score in self.postings[token].items():
+                scores[name] = max(scores.get(name, 0), score * factor)
+            i += 1
+        return scores
+
+    def search(self, query):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        totals = self.term_scores(terms[0])
+        for term in terms[1:]:
+            scores = self.term_scores(term)
+            totals = {name: total + scores[name] for name, total in totals.items() if name in scores}
+
+        if not totals:
+            # Nothing on token boundaries, fall back to a plain substring match on names
+            query = query.strip().lower()
+            return [name for name in self.names if query in name.lower()]
+        return sorted(totals, key=lambda name: (-totals[name], name))
+
+_index = None
+_indexed = None
+
+def get_index():
+    # Built on first search and rebuilt only if the catalog was reloaded
+    global _index, _indexed
+    scripts = get_catalog().scripts()
+    if _index is None or _indexed is not scripts:
+        _index = SearchIndex(scripts)
+        _indexed = scripts
+    return _index
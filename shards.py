@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+
+from termcolor import colored
+
+from engine import run, run_many, ScanControl, ScanCancelled
+from adaptive import run_waves, WAVES
+from printers import print_progress
+from results import ScanOutput
+from outputs import open_output
+from timing import span
+
+# In this file: functions that split a target set into shards and run nmap over them in parallel
+
+def merge_files(parts, output_file, append=False):
+    # Concatenate the per-shard -oN files into the final output file (compressed for .gz/.zst) and remove them
+    with open_output(output_file, append) as out:
+        for part in parts:
+            if os.path.isfile(part):
+                with open(part, 'r') as f:
+                    shutil.copyfileobj(f, out)
+                os.remove(part)
+
+def run_sharded(args_list, targets, output_file, workers, shard_count=0, control=None, append=False, label="", timing=None):
+    """
+    Split targets (a TargetSet) into shard_count chunks of about the same
+    number of hosts (defaults to one per worker) and run them on up to
+    `workers` concurrent nmap processes.
+    Shard outputs and -oN files are merged back in host order, appended to
+    output_file if append is set. control (a ScanControl) sees every shard's events.
+    With timing (an AdaptiveTiming) the shards run in waves, WAVES per worker
+    by default, and rate and parallelism are tuned between waves.
+    """
+    control = control or ScanControl()
+    if not targets:
+        print(colored("No targets to scan", "red"))
+        return None
+
+    shards = targets.split(shard_count or workers * (WAVES if timing else 1))
+    total = len(shards)
+    print(colored(f"Running {targets.count()} targets as {total} shards on {workers} workers", "cyan"))
+
+    shard_dir = tempfile.mkdtemp(prefix="mymap-shards-")
+    shard_files = [os.path.join(shard_dir, f"shard{i+1}.targets") for i in range(total)]
+    output_parts = [f"{output_file}.shard{i+1}" for i in range(total)] if output_file else []
+
+    jobs = []
+    for i, shard in enumerate(shards):
+        shard.write(shard_files[i])
+        args = list(args_list) + targets.family_args() + ["-iL", shard_files[i]]
+        if output_file:
+            args += ["-oN", output_parts[i]]
+        jobs.append(args)
+
+    try:
+        labels = [f"{label} shard {i+1}/{total}" if label else f"shard {i+1}/{total}" for i in range(total)]
+        return run_jobs(jobs, workers, labels, control, output_file, output_parts, append, timing)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+def run_jobs(jobs, workers, labels, control, output_file="", output_parts=(), append=False, timing=None):
+    """
+    Run nmap argument lists on up to `workers` concurrent processes. The
+    outputs, and the -oN files in output_parts (into output_file), are merged
+    in job order. Returns the merged ScanOutput, or None if every job failed.
+    Stopped by control's cancel flag, it raises ScanCancelled with every
+    job's output so far merged instead.
+    With timing (an AdaptiveTiming) they run in waves instead, see run_waves.
+    """
+    total = len(jobs)
+
+    def show_progress(index, kind, value):
+        control.emit(kind, value)
+        if kind == "progress" and not control.quiet:
+            print_progress(value, labels[index])
+        elif kind == "exit" and value != 0:
+            print(colored(f"Error running nmap ({labels[index]}): return code {value}", "red"))
+
+    try:
+        with span("nmap"):
+            if timing:
+                results = run_waves(jobs, timing, show_progress, control.cancel, control.quiet)
+            else:
+                results = run(run_many(jobs, workers, show_progress, control.cancel))
+    finally:
+        if output_file:
+            merge_files(output_parts, output_file, append)
+
+    merged = ScanOutput()
+    if control.cancel.is_set():
+        for _, output in results:
+            merged.extend(output)
+            output.close()
+        raise ScanCancelled(merged)
+    failed = 0
+    for retcode, output in results:
+        if retcode == 0:
+            merged.extend(output)
+        else:
+            failed += 1
+        output.close()
+    if failed:
+        print(colored(f"{failed} of {total} nmap runs failed", "red"))
+    if failed == total:
+        merged.close()
+        return None
+    return merged
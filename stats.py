@@ -0,0 +1,84 @@
+import re
+
+# In this file: parsing of the telemetry nmap prints with --stats-every
+
+PROGRESS_REGEX = re.compile(r'About\s+(\d+(\.\d+)?)%\s+done')
+ETA_REGEX = re.compile(r'ETC:\s+\S+\s+\((\d+:\d+:\d+)\s+remaining\)')
+ETC_REGEX = re.compile(r'ETC:\s+(\S+)')
+# Stats: 0:01:03 elapsed; 12 hosts completed (5 up), 4 undergoing SYN Stealth Scan
+STATS_REGEX = re.compile(r'^Stats:\s+(\d+:\d+:\d+)\s+elapsed;\s+(\d+)\s+hosts completed\s+\((\d+)\s+up\),\s+(\d+)\s+undergoing\s+(.+?)\s*$')
+# SYN Stealth Scan Timing: About 26.00% done; ETC: 12:00 (0:00:10 remaining)
+TIMING_REGEX = re.compile(r'^(.+?) Timing: About')
+# Nmap done: 256 IP addresses (12 hosts up) scanned in 30.05 seconds
+DONE_REGEX = re.compile(r'^Nmap done:\s+(\d+)\s+IP address(?:es)?\s+\((\d+)\s+hosts?\s+up\)')
+TIMEOUT_REGEX = re.compile(r'^Skipping host .* due to host timeout')
+# Increasing send delay ... due to N out of M dropped probes, or a retransmission cap being hit
+CONGESTION_REGEX = re.compile(r'^(Increasing send delay|Warning: .* giving up on port because retransmission cap hit)')
+
+def seconds(clock):
+    # "h:mm:ss" to seconds
+    hours, minutes, secs = (int(part) for part in clock.split(":"))
+    return hours * 3600 + minutes * 60 + secs
+
+class ScanStats:
+    """
+    The state of a running scan as far as nmap has told us: the current
+    phase, how far it got, how many hosts are done, and the signs of a
+    struggling network (host timeouts, dropped probes, retransmission caps).
+    """
+    __slots__ = ("phase", "percent", "etc", "remaining", "elapsed", "hosts_completed",
+                 "hosts_up", "hosts_undergoing", "hosts_timed_out", "congestion")
+
+    def __init__(self):
+        self.phase = ""
+        self.percent = 0.0
+        self.etc = ""
+        self.remaining = ""
+        self.elapsed = 0
+        self.hosts_completed = 0
+        self.hosts_up = 0
+        self.hosts_undergoing = 0
+        self.hosts_timed_out = 0
+        self.congestion = 0
+
+    def copy(self):
+        other = ScanStats()
+        for name in self.__slots__:
+            setattr(other, name, getattr(self, name))
+        return other
+
+class StatsParser:
+    # Feed it every output line, feed() says whether the stats changed
+    def __init__(self):
+        self.stats = ScanStats()
+
+    def feed(self, line):
+        stats = self.stats
+        match = STATS_REGEX.match(line)
+        if match:
+            stats.elapsed = seconds(match.group(1))
+            stats.hosts_completed = int(match.group(2))
+            stats.hosts_up = int(match.group(3))
+            stats.hosts_undergoing = int(match.group(4))
+            stats.phase = match.group(5)
+            return True
+
+        match = PROGRESS_REGEX.search(line)
+        if match:
+            timing = TIMING_REGEX.match(line)
+            if timing:
+                stats.phase = timing.group(1)
+            stats.percent = float(match.group(1))
+            eta = ETA_REGEX.search(line)
+            if eta:
+                stats.etc = ETC_REGEX.search(line).group(1)
+                stats.remaining = eta.group(1)
+            return True
+
+        if TIMEOUT_REGEX.match(line):
+            stats.hosts_timed_out += 1
+            return True
+        if CONGESTION_REGEX.match(line):
+            stats.congestion += 1
+            return True
+        return False
@@ -0,0 +1,221 @@
+import os
+import time
+import sqlite3
+
+from results import Host, Port, ScriptResult
+
+# In this file: the local SQLite store that keeps the results of every scan
+
+STORE_FILE = os.path.join(os.path.expanduser("~"), ".local", "share", "mymap", "results.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    command TEXT NOT NULL,
+    retcode INTEGER,
+    output_file TEXT,
+    scan_key TEXT
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    address TEXT NOT NULL,
+    hostname TEXT,
+    status TEXT,
+    scanned REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ports (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    address TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    protocol TEXT,
+    state TEXT,
+    service TEXT,
+    product TEXT,
+    version TEXT,
+    scanned REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scripts (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    address TEXT NOT NULL,
+    port INTEGER,
+    script TEXT NOT NULL,
+    output TEXT,
+    scanned REAL NOT NULL,
+    protocol TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs(started);
+CREATE INDEX IF NOT EXISTS hosts_run ON hosts(run_id, address);
+CREATE INDEX IF NOT EXISTS hosts_hostname ON hosts(hostname, scanned);
+CREATE INDEX IF NOT EXISTS hosts_address ON hosts(address, scanned);
+CREATE INDEX IF NOT EXISTS ports_address ON ports(address, scanned);
+CREATE INDEX IF NOT EXISTS ports_port ON ports(port, scanned);
+CREATE INDEX IF NOT EXISTS ports_service ON ports(service, scanned);
+CREATE INDEX IF NOT EXISTS ports_run ON ports(run_id, address, port);
+CREATE INDEX IF NOT EXISTS scripts_script ON scripts(script, scanned);
+CREATE INDEX IF NOT EXISTS scripts_address ON scripts(address, scanned);
+"""
+
+# Indexes on columns that older stores get from migrate()
+LATE_INDEXES = """
+CREATE INDEX IF NOT EXISTS runs_scan_key ON runs(scan_key, started);
+"""
+
+class ResultStore:
+    """
+    Every scan run with its command line and duration, plus the hosts, ports
+    and script results parsed from its -oX output. Rows carry the scan time,
+    so questions like "which hosts had ftp-anon output in the last 30 days"
+    are answered from the indexes.
+    """
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self.ready = False
+
+    def connect(self):
+        # A short-lived connection per call keeps the store safe to use from any thread
+        if not self.ready:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self.ready:
+            conn.executescript(SCHEMA)
+            self.migrate(conn)
+            conn.executescript(LATE_INDEXES)
+            self.ready = True
+        return conn
+
+    def migrate(self, conn):
+        # Stores created before scan keys, or before script results knew their port's protocol
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(runs)")]
+        if "scan_key" not in columns:
+            conn.execute("ALTER TABLE runs ADD COLUMN scan_key TEXT")
+            conn.commit()
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(scripts)")]
+        if "protocol" not in columns:
+            conn.execute("ALTER TABLE scripts ADD COLUMN protocol TEXT")
+            conn.commit()
+
+    def record(self, command, started, duration, retcode, output_file, hosts, scan_key=None):
+        conn = self.connect()
+        try:
+            with conn:
+                run_id = conn.execute(
+                    "INSERT INTO runs (started, duration, command, retcode, output_file, scan_key) VALUES (?, ?, ?, ?, ?, ?)",
+                    (started, duration, command, retcode, output_file, scan_key)).lastrowid
+                conn.executemany(
+                    "INSERT INTO hosts (run_id, address, hostname, status, scanned) VALUES (?, ?, ?, ?, ?)",
+                    [(run_id, host.address, host.hostname, host.status, started) for host in hosts])
+                conn.executemany(
+                    "INSERT INTO ports (run_id, address, port, protocol, state, service, product, version, scanned) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(run_id, host.address, port.portid, port.protocol, port.state, port.service, port.product, port.version, started)
+                     for host in hosts for port in host.ports])
+                conn.executemany(
+                    "INSERT INTO scripts (run_id, address, port, protocol, script, output, scanned) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(run_id, host.address, None, None, script.id, script.output, started) for host in hosts for script in host.scripts]
+                    + [(run_id, host.address, port.portid, port.protocol, script.id, script.output, started)
+                       for host in hosts for port in host.ports for script in port.scripts])
+            return run_id
+        finally:
+            conn.close()
+
+    def query(self, host=None, port=None, service=None, script=None, contains=None, days=None):
+        """
+        Search past results. With a script or output filter this returns script
+        results, otherwise port results. Rows are
+        (scanned, address, port, service, script, state or script output), newest first.
+        """
+        where = []
+        params = []
+        if script or contains:
+            sql = ("SELECT s.scanned, s.address, s.port, p.service, s.script, s.output FROM scripts s "
+                   "LEFT JOIN ports p ON p.run_id = s.run_id AND p.address = s.address AND p.port = s.port "
+                   "AND (s.protocol IS NULL OR p.protocol = s.protocol)")
+            table = "s"
+            if script:
+                where.append("s.script = ?")
+                params.append(script)
+            if contains:
+                where.append("s.output LIKE ?")
+                params.append(f"%{contains}%")
+        else:
+            sql = "SELECT p.scanned, p.address, p.port, p.service, NULL, p.state FROM ports p"
+            table = "p"
+
+        if host:
+            where.append(f"{table}.address = ?")
+            params.append(host)
+        if port:
+            where.append(f"{table}.port = ?")
+            params.append(int(port))
+        if service:
+            where.append("p.service = ?")
+            params.append(service)
+        if days:
+            where.append(f"{table}.scanned >= ?")
+            params.append(time.time() - float(days) * 86400)
+
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {table}.scanned DESC"
+
+        conn = self.connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def latest_hosts(self, scan_key, names):
+        """
+        The most recent result for each of `names` (addresses or hostnames)
+        among runs with the given scan key. Returns {address: (Host, scanned)}
+        with ports and script results filled in.
+        """
+        conn = self.connect()
+        try:
+            # Temp tables instead of IN (...) so target lists of any size work
+            conn.execute("CREATE TEMP TABLE wanted (name TEXT PRIMARY KEY)")
+            conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", [(name,) for name in names])
+            rows = conn.execute(
+                "SELECT h.run_id, h.address, h.hostname, h.status, h.scanned FROM hosts h "
+                "JOIN runs r ON r.id = h.run_id "
+                "WHERE r.scan_key = ? AND (h.address IN (SELECT name FROM wanted) OR h.hostname IN (SELECT name FROM wanted)) "
+                "ORDER BY h.scanned", (scan_key,)).fetchall()
+
+            latest = {}
+            for run_id, address, hostname, status, scanned in rows:
+                latest[address] = (run_id, Host(address, hostname or "", status or ""), scanned)
+            if not latest:
+                return {}
+
+            conn.execute("CREATE TEMP TABLE latest (run_id INTEGER, address TEXT)")
+            conn.executemany("INSERT INTO latest VALUES (?, ?)", [(run_id, address) for address, (run_id, _, _) in latest.items()])
+            ports = {}
+            for address, portid, protocol, state, service, product, version in conn.execute(
+                    "SELECT p.address, p.port, p.protocol, p.state, p.service, p.product, p.version FROM ports p "
+                    "JOIN latest l ON l.run_id = p.run_id AND l.address = p.address ORDER BY p.port"):
+                port = Port(protocol, portid, state, service or "", product or "", version or "")
+                latest[address][1].ports.append(port)
+                # 53/tcp and 53/udp are different ports
+                ports[(address, portid, protocol)] = port
+                ports.setdefault((address, portid, None), port)
+            for address, portid, protocol, script, output in conn.execute(
+                    "SELECT s.address, s.port, s.protocol, s.script, s.output FROM scripts s "
+                    "JOIN latest l ON l.run_id = s.run_id AND l.address = s.address"):
+                result = ScriptResult(script, output or "")
+                if portid is None:
+                    latest[address][1].scripts.append(result)
+                elif (address, portid, protocol) in ports:
+                    # Rows from before the protocol was stored (None) go to the first port with that number
+                    ports[(address, portid, protocol)].scripts.append(result)
+            return {address: (host, scanned) for address, (_, host, scanned) in latest.items()}
+        finally:
+            conn.close()
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = ResultStore()
+    return _store
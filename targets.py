@@ -0,0 +1,322 @@
+import os
+import re
+import ipaddress
+from itertools import product
+
+# In this file: the target engine - parsing, exclusions, dedup and lazy expansion of targets
+
+HOSTNAME_REGEX = re.compile(r'^(?=.*[A-Za-z])[A-Za-z0-9_]([A-Za-z0-9_\-\.]*[A-Za-z0-9_])?$')
+OCTET_REGEX = re.compile(r'^[0-9,\-\*]+$')
+
+# Most separate intervals one octet range may expand to (10.*.*.1 is 65536), *.*.*.1 would be 16.7 million
+MAX_OCTET_INTERVALS = 65536
+
+def merge_intervals(intervals):
+    # Sort and join overlapping or adjacent (start, end) intervals, ends inclusive
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def subtract_intervals(intervals, removed):
+    # Both lists sorted and merged; returns intervals minus removed
+    result = []
+    i = 0
+    for start, end in intervals:
+        while i < len(removed) and removed[i][1] < start:
+            i += 1
+        j = i
+        while j < len(removed) and removed[j][0] <= end:
+            if removed[j][0] > start:
+                result.append((start, removed[j][0] - 1))
+            start = max(start, removed[j][1] + 1)
+            j += 1
+        if start <= end:
+            result.append((start, end))
+    return result
+
+def parse_octet(spec):
+    # One octet of an nmap style range: "5", "1-254", "-100", "*", "1,3,7-9"
+    ranges = []
+    for part in spec.split(','):
+        if part == '*':
+            low, high = 0, 255
+        elif '-' in part:
+            first, _, last = part.partition('-')
+            low = int(first) if first else 0
+            high = int(last) if last else 255
+        else:
+            low = high = int(part)
+        if not 0 <= low <= high <= 255:
+            raise ValueError(f"bad octet range '{spec}'")
+        ranges.append((low, high))
+    return merge_intervals(ranges)
+
+def octet_intervals(specs):
+    """
+    Intervals covered by an octet range expression such as 10.0.0-3.1-254.
+    Trailing full octets (0-255) are folded into their parent, so
+    10.0-3.*.* is 1 interval instead of 1024. Raises ValueError if the
+    range is more than MAX_OCTET_INTERVALS separate intervals.
+    """
+    full = 4
+    while full > 0 and specs[full-1] == [(0, 255)]:
+        full -= 1
+    if full == 0:
+        return [(0, 2**32 - 1)]
+    level = full - 1
+    size = 256 ** (3 - level)
+    prefixes = [[value for low, high in spec for value in range(low, high + 1)] for spec in specs[:level]]
+    pieces = len(specs[level])
+    for values in prefixes:
+        pieces *= len(values)
+    if pieces > MAX_OCTET_INTERVALS:
+        raise ValueError(f"octet range expands to {pieces} separate ranges (at most {MAX_OCTET_INTERVALS}), "
+                         f"split it into several scans")
+    intervals = []
+    for values in product(*prefixes):
+        base = sum(value * 256 ** (3 - i) for i, value in enumerate(values))
+        for low, high in specs[level]:
+            intervals.append((base + low * size, base + high * size + size - 1))
+    return intervals
+
+def parse_expression(expr):
+    """
+    Parse one target expression into (family, intervals) where family is 4
+    or 6, or ("host", name) for a hostname. Handles addresses, CIDR blocks,
+    nmap octet ranges (10.0.0-3.1-254, 10.0.*.1), address ranges
+    (10.0.0.1-10.0.0.50) and IPv6. Raises ValueError for anything else.
+    """
+    if ':' in expr and '%' in expr:
+        # The intervals cannot keep a scope, and without it a link-local address is ambiguous
+        raise ValueError(f"IPv6 scope ids are not supported '{expr}', give the interface with -e instead")
+
+    if '/' in expr:
+        try:
+            network = ipaddress.ip_network(expr, strict=False)
+        except ValueError:
+            raise ValueError(f"bad CIDR block '{expr}'")
+        return network.version, [(int(network.network_address), int(network.broadcast_address))]
+
+    if ':' in expr:
+        address = ipaddress.IPv6Address(expr)
+        return 6, [(int(address), int(address))]
+
+    if '-' in expr and expr.count('.') == 6:
+        first, _, last = expr.partition('-')
+        start, end = int(ipaddress.IPv4Address(first)), int(ipaddress.IPv4Address(last))
+        if start > end:
+            raise ValueError(f"bad address range '{expr}'")
+        return 4, [(start, end)]
+
+    parts = expr.split('.')
+    if len(parts) == 4 and all(OCTET_REGEX.match(part) for part in parts):
+        return 4, octet_intervals([parse_octet(part) for part in parts])
+
+    if HOSTNAME_REGEX.match(expr):
+        return "host", expr
+    raise ValueError(f"not a valid target '{expr}'")
+
+def is_target(expr):
+    try:
+        parse_expression(expr)
+        return True
+    except ValueError:
+        return False
+
+def is_address(expr):
+    # A target made of IP addresses only (no hostnames)
+    try:
+        return parse_expression(expr)[0] != "host"
+    except ValueError:
+        return False
+
+class TargetSet:
+    """
+    A set of targets kept as merged integer intervals per address family plus
+    a list of hostnames. Duplicates and overlaps disappear on construction,
+    exclusions are subtracted, and addresses are only generated when the set
+    is iterated, so a /8 costs a single interval.
+    """
+    def __init__(self, include=(), exclude=()):
+        v4, v6, hostnames = [], [], {}
+        for expr in include:
+            family, value = parse_expression(expr)
+            if family == "host":
+                hostnames[value.lower()] = value
+            else:
+                (v4 if family == 4 else v6).extend(value)
+
+        not_v4, not_v6, not_hosts = [], [], set()
+        for expr in exclude:
+            family, value = parse_expression(expr)
+            if family == "host":
+                not_hosts.add(value.lower())
+            else:
+                (not_v4 if family == 4 else not_v6).extend(value)
+
+        self.v4 = subtract_intervals(merge_intervals(v4), merge_intervals(not_v4))
+        self.v6 = subtract_intervals(merge_intervals(v6), merge_intervals(not_v6))
+        self.hostnames = [name for key, name in hostnames.items() if key not in not_hosts]
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Whitespace separated expressions, '#' starts a comment. '!expr'
+        excludes a target and '!file' every target listed in that file.
+        """
+        include, exclude = [], []
+        for token in split_tokens(text):
+            if not token.startswith('!'):
+                include.append(token)
+            elif os.path.isfile(token[1:]):
+                with open(token[1:], 'r') as f:
+                    exclude.extend(entry.lstrip('!') for entry in split_tokens(f.read()))
+            else:
+                exclude.append(token[1:])
+        return cls(include, exclude)
+
+    def count(self):
+        return sum(end - start + 1 for start, end in self.v4 + self.v6) + len(self.hostnames)
+
+    def __bool__(self):
+        return bool(self.v4 or self.v6 or self.hostnames)
+
+    def __iter__(self):
+        # Every address, generated on demand
+        for start, end in self.v4:
+            for value in range(start, end + 1):
+                yield str(ipaddress.IPv4Address(value))
+        for start, end in self.v6:
+            for value in range(start, end + 1):
+                yield str(ipaddress.IPv6Address(value))
+        yield from self.hostnames
+
+    def expressions(self):
+        # The smallest list of CIDR blocks (plus hostnames) nmap needs to cover the set
+        for family, intervals in ((ipaddress.IPv4Address, self.v4), (ipaddress.IPv6Address, self.v6)):
+            for start, end in intervals:
+                for network in ipaddress.summarize_address_range(family(start), family(end)):
+                    yield str(network.network_address) if network.num_addresses == 1 else str(network)
+        yield from self.hostnames
+
+    def family_args(self):
+        # nmap scans one address family per run, IPv6 needs -6
+        return ["-6"] if self.v6 and not self.v4 else []
+
+    def nmap_args(self, path):
+        # A single target goes on the command line, anything bigger through an -iL file at path
+        if self.count() == 1:
+            return self.family_args() + [next(iter(self))]
+        self.write(path)
+        return self.family_args() + ["-iL", path]
+
+    def position(self, target):
+        """
+        How many targets nmap has gone through once it reaches target (an
+        address or hostname of this set, 1 for the first), in the order of
+        expressions() and of -iL files. None if target is not in the set.
+        """
+        if target.lower() in (name.lower() for name in self.hostnames):
+            names = [name.lower() for name in self.hostnames]
+            return sum(end - start + 1 for start, end in self.v4 + self.v6) + names.index(target.lower()) + 1
+        try:
+            address = ipaddress.ip_address(target)
+        except ValueError:
+            return None
+        value = int(address)
+        passed = 0 if address.version == 4 else sum(end - start + 1 for start, end in self.v4)
+        for start, end in (self.v4 if address.version == 4 else self.v6):
+            if start <= value <= end:
+                return passed + value - start + 1
+            passed += end - start + 1
+        return None
+
+    def head(self, count):
+        # The first count targets, in the same order
+        pieces = []
+        for family, intervals in ((4, self.v4), (6, self.v6)):
+            for start, end in intervals:
+                if count <= 0:
+                    break
+                take = min(end - start + 1, count)
+                pieces.append((family, start, start + take - 1))
+                count -= take
+        pieces += [("host", name, name) for name in self.hostnames[:max(count, 0)]]
+        return TargetSet.from_pieces(pieces)
+
+    def split(self, count):
+        """
+        Split into up to `count` sets with nearly the same number of hosts,
+        keeping address order, so shards can be merged back in host order.
+        """
+        total = self.count()
+        count = max(1, min(count, total))
+        size = -(-total // count)
+        chunks = []
+        current, filled = [], 0
+        for family, intervals in ((4, self.v4), (6, self.v6)):
+            for start, end in intervals:
+                while start <= end:
+                    take = min(end - start + 1, size - filled)
+                    current.append((family, start, start + take - 1))
+                    filled += take
+                    start += take
+                    if filled == size:
+                        chunks.append(current)
+                        current, filled = [], 0
+        for name in self.hostnames:
+            current.append(("host", name, name))
+            filled += 1
+            if filled == size:
+                chunks.append(current)
+                current, filled = [], 0
+        if current:
+            chunks.append(current)
+        return [TargetSet.from_pieces(chunk) for chunk in chunks]
+
+    @classmethod
+    def from_pieces(cls, pieces):
+        target_set = cls()
+        for family, start, end in pieces:
+            if family == 4:
+                target_set.v4.append((start, end))
+            elif family == 6:
+                target_set.v6.append((start, end))
+            else:
+                target_set.hostnames.append(start)
+        return target_set
+
+    def write(self, path):
+        # Write as an nmap -iL file, one CIDR block or host per line
+        with open(path, 'w') as f:
+            for expr in self.expressions():
+                f.write(expr + "\n")
+
+def split_tokens(text):
+    # Same rules as nmap -iL: whitespace separated entries, '#' starts a comment
+    for line in text.splitlines():
+        yield from line.split('#')[0].split()
+
+def load_targets(target):
+    # A target file (nmap -iL format, plus '!' exclusions) or a string of target expressions
+    if os.path.isfile(target):
+        with open(target, 'r') as f:
+            return TargetSet.parse(f.read())
+    return TargetSet.parse(target)
+
+def check_targets(target):
+    # Reason the targets cannot be scanned, or None
+    try:
+        targets = load_targets(target)
+    except (ValueError, OSError) as e:
+        return str(e)
+    if not targets:
+        return "no targets left after exclusions"
+    if targets.v4 and targets.v6:
+        return "IPv4 and IPv6 targets cannot be mixed in one scan"
+    return None
@@ -0,0 +1,87 @@
+import sys
+import time
+import cProfile
+import threading
+import functools
+from contextlib import contextmanager
+
+# In this file: the --profile mode - timing spans for mymap's own work next to the time spent in nmap
+
+class Profiler:
+    """
+    Total time and count per named span. Spans can nest (the nmap span
+    includes the engine's output handling) and can come from several
+    threads at once, so the spans do not add up to the wall time.
+    Recording is off unless start() was called, a span then costs one
+    flag check.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.spans = {}
+        self.lock = threading.Lock()
+        self.started = 0.0
+        self.cprofile = None
+
+    def start(self, cprofile=False):
+        self.enabled = True
+        self.started = time.perf_counter()
+        if cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def add(self, name, seconds, count=1):
+        with self.lock:
+            total, calls = self.spans.get(name, (0.0, 0))
+            self.spans[name] = (total + seconds, calls + count)
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def report(self):
+        wall = time.perf_counter() - self.started
+        lines = [f"{'span': <32} {'calls': >7} {'seconds': >10} {'% wall': >7}"]
+        for name, (total, calls) in sorted(self.spans.items(), key=lambda item: -item[1][0]):
+            lines.append(f"{name: <32} {calls: >7} {total: >10.3f} {total / wall * 100 if wall else 0: >6.1f}%")
+        lines.append(f"{'wall time': <32} {'': >7} {wall: >10.3f}")
+        return "\n".join(lines) + "\n"
+
+    def finish(self, report_file="", cprofile_file=""):
+        # Print the breakdown (or write it to report_file) and save the cProfile data
+        if not self.enabled:
+            return
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(cprofile_file)
+        text = self.report()
+        if report_file:
+            with open(report_file, 'w') as f:
+                f.write(text)
+        else:
+            sys.stdout.write("\nTIME BREAKDOWN\n" + text)
+        if self.cprofile:
+            print(f"Python profile saved to {cprofile_file} (python -m pstats {cprofile_file})")
+
+profiler = Profiler()
+
+def span(name):
+    return profiler.span(name)
+
+def timed(name):
+    # Decorator: every call of the function is a span
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate